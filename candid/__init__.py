@@ -17,10 +17,12 @@ if not _fitsLoaded:
     print('ERROR: astropy.io.fits or pyfits required!')
 
 import time
+import functools
 import scipy.special
 import scipy.interpolate
 import scipy.stats
 import scipy.optimize
+import scipy.spatial
 try:
     from scipy.misc import factorial
 except:
@@ -28,6 +30,14 @@ except:
 
 import random
 
+_numbaLoaded=False
+try:
+    # -- optional: compiled visibility computations (see _VbinNumba)
+    import numba
+    _numbaLoaded=True
+except:
+    pass
+
 # -- defunct ;(
 #from scipy import weave
 #from scipy.weave import converters
@@ -41,6 +51,20 @@ try:
 except:
     pass
 
+try:
+    # -- share the data with the pool of processes (python>=3.8)
+    from multiprocessing import shared_memory
+except:
+    shared_memory = None
+import pickle
+import hashlib
+import shutil
+import tempfile
+import atexit
+import weakref
+import threading
+import concurrent.futures
+
 import os
 import sys
 
@@ -89,6 +113,14 @@ CONFIG = {'color map':'cubehelix', # color map used
           'progress bar': True,
           'Ncores': None, # default is to use N-1 Cores
           'Nsmear': 3,
+          'smearing': 'samples', # bandwidth smearing: 'samples' (Nsmear) or 'analytic'
+          'batch size': None, # positions computed at once in chi2Map; None is automatic
+          'analytic jacobian': True, # derivatives of the binary model in the fits
+          'chunk duration': 0.2, # in seconds, of the groups of tasks sent to the processes
+          'cache': None, # directory to keep the data read from the OIFITS files
+          'map interpolation': 'rbf', # in fitMap: 'rbf', 'delaunay' or 'legacy rbf'
+          'map neighbors': 64, # number of minima used locally by 'rbf'
+          'profile': False, # time spent in each part of the analyses, see Open.last_profile
           }
 
 # -- units of the parameters
@@ -105,6 +137,85 @@ def paramUnits(s):
         else:
             return ''
 
+# -- profiling (see CONFIG['profile']): name -> [calls, seconds], in this process
+_profileData = {}
+
+def _profileTime():
+    """
+    current time if CONFIG['profile'], else None (see _profileAdd)
+    """
+    if CONFIG['profile']:
+        return time.time()
+    return None
+
+def _profileAdd(name, t0, n=1):
+    """
+    adds the time since "t0" (see _profileTime) and "n" calls to the counter
+    "name". Nothing is done if "t0" is None.
+    """
+    if t0 is None:
+        return
+    c = _profileData.setdefault(name, [0, 0.0])
+    c[0] += n
+    c[1] += time.time()-t0
+    return
+
+def _profileMerge(counters):
+    """
+    adds "counters" (e.g. from a process of the pool) to the counters of this
+    process
+    """
+    for k in counters.keys():
+        c = _profileData.setdefault(k, [0, 0.0])
+        c[0] += counters[k][0]
+        c[1] += counters[k][1]
+    return
+
+def _profiled(method):
+    """
+    decorator of the analyses of Open: if CONFIG['profile'], the counters of
+    the main process and of the processes of the pool during the analysis are
+    summarized in self.last_profile and, if the analysis adds a result to the
+    history, in its ['internal']['profile'].
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not CONFIG['profile'] or self._profiling:
+            return method(self, *args, **kwargs)
+        self._profiling = True
+        _profileData.clear()
+        n0, N0 = len(self.history), (_N_modelObservables, _N_fitFunc)
+        t0 = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._profiling = False
+            # -- number of models and fits, all processes
+            n = [_profileData.pop(k, [0])[0] for k in ['model evaluations', 'fits']]
+            self.last_profile = {'analysis':method.__name__,
+                                 'total':time.time()-t0,
+                                 'model evaluations':n[0]+_N_modelObservables-N0[0],
+                                 'fits':n[1]+_N_fitFunc-N0[1],
+                                 'counters':{k:{'calls':_profileData[k][0],
+                                                'time':_profileData[k][1]}
+                                             for k in sorted(_profileData.keys())}}
+            if len(self.history)>n0:
+                self.history[-1]['internal']['profile'] = self.last_profile
+            _printProfile(self.last_profile)
+    return wrapper
+
+def _printProfile(profile):
+    """
+    prints a profile (see Open.last_profile)
+    """
+    print(' | profile of %s: %.2fs total, %d models, %d fits'%(profile['analysis'],
+            profile['total'], profile['model evaluations'], profile['fits']))
+    print(' | %-28s %10s %10s'%('', 'calls', 'time (s)'))
+    for k in profile['counters'].keys():
+        c = profile['counters'][k]
+        print(' | %-28s %10d %10.3f'%(k, c['calls'], c['time']))
+    return
+
 def variables():
     print(' | global parameters (can be updated):')
     for k in CONFIG.keys():
@@ -147,23 +258,89 @@ def _Vld(base, diam, wavel, alpha=0.36):
               scipy.special.gamma(k_ + 1.) *x**k_
     return V_
 
-def _VbinSlow(uv, param):
+def _smearingProfile():
     """
-    Analytical complex visibility of a binary composed of a uniform
-    disk diameter and an unresolved source. "param" is a dictionnary
-    containing:
+    transmission of the spectral channels used for the bandwidth smearing,
+    based on CONFIG['Nsmear']: 'none' (<=2), 'top-hat' (3) or 'gaussian' (>3)
+    """
+    if CONFIG['Nsmear']<=2:
+        return 'none'
+    elif CONFIG['Nsmear']==3:
+        return 'top-hat'
+    else:
+        return 'gaussian'
 
-    'diam*'   : in mas
-    'alpha*'  : optional LD coef for main star
-    'wavel'   : in um
-    'x, y'    : in mas
-    'f'       : flux ratio in % -> takes the absolute value
-    'f_wl_dwl': addition flux ratio in the line at wl, width dwl
-    'fres'    : resolved flux
-    'fres_wl_dwl': addition resolved flux ratio in the line at wl, width dwl
+# -- half width of the smearing samples, in units of the channel width
+_smearingHalfWidth = {'none':0.0, 'top-hat':0.5, 'gaussian':0.8}
 
-    'xg', yg', 'diamg', 'fg': gaussian position, diameters and flux
+_smearingSamplesCache = {}
+def _smearingSamples():
+    """
+    wavelength offsets (in units of the spectral channel width) and normalized
+    transmissions used to compute numerically the bandwidth smearing, based on
+    CONFIG['Nsmear']. Computed once for each (Nsmear, profile), the arrays
+    returned are read only.
+    """
+    key = (CONFIG['Nsmear'], _smearingProfile())
+    if key in _smearingSamplesCache:
+        return _smearingSamplesCache[key]
+    if key[1]=='none':
+        dl = np.array([0.])
+        Tr = np.array([1.0])
+    elif key[1]=='top-hat':
+        # -- original implementation, with top-hat transmission (slow and a little innacurate)
+        dl = np.linspace(-0.5, 0.5, CONFIG['Nsmear'])
+        Tr = np.ones(CONFIG['Nsmear'])
+    else: # -- gaussian
+        tsigma = 1/2.355 # FWHM of 1
+        #tsigma /=  0.57282 # FWH Maximum -> FWH Flux,
+        # -- takes most of the Gaussian transmission
+        dl = np.linspace(-_smearingHalfWidth['gaussian'],
+                         _smearingHalfWidth['gaussian'], CONFIG['Nsmear'])
+        Tr = np.exp(-dl**2/(2*tsigma**2))
+    Tr /= np.sum(Tr)
+    dl.flags.writeable = False
+    Tr.flags.writeable = False
+    _smearingSamplesCache[key] = (dl, Tr)
+    return dl, Tr
+
+_smearingKernelCache = {}
+_smearingKernelCacheSize = 32
+def _smearingKernel(wl, dwavel):
+    """
+    normalized transmissions Tr (Nsmear) and inverse wavelengths of the
+    smearing samples 1/wl (len(wl), Nsmear) for the spectral channels centered
+    on "wl" (1D, in um) of width "dwavel" (in um). see _smearingSamples
+
+    The tables are kept for the last wavelength tables used, keyed by (Nsmear,
+    profile, dwavel, sha1 of wl): the callers usually pass a new copy of the
+    same wavelengths at each call (flattened from the data blocks), and the
+    hash is much cheaper than the table.
+    """
+    dl, Tr = _smearingSamples()
+    wl = np.asarray(wl, dtype=float)
+    if len(wl)==0 or wl.strides[0]==0:
+        # -- single wavelength
+        iwl = 1/(wl[:1,None] + dl[None,:]*dwavel)
+        return Tr, np.broadcast_to(iwl, (len(wl), len(dl)))
+    wl = np.ascontiguousarray(wl)
+    key = (CONFIG['Nsmear'], _smearingProfile(), float(dwavel), wl.shape,
+           hashlib.sha1(wl).digest())
+    if not key in _smearingKernelCache:
+        if len(_smearingKernelCache)>=_smearingKernelCacheSize:
+            # -- drop the oldest table
+            _smearingKernelCache.pop(next(iter(_smearingKernelCache)))
+        iwl = 1/(wl[:,None] + dl[None,:]*dwavel)
+        iwl.flags.writeable = False
+        _smearingKernelCache[key] = iwl
+    return Tr, _smearingKernelCache[key]
+
+def _VbinTerms(uv, param):
+    """
+    terms of the binary visibility which do not depend on the position of the
+    companion (see _VbinSlow for "param"). returns:
 
+    f, fres, fg, Vstar, Vcomp, Vg, phig
     """
     if 'f' in param.keys():
         f = np.abs(param['f'])/100.
@@ -219,22 +396,29 @@ def _VbinSlow(uv, param):
         Vg = 0.0
         fg = 0.0
         phig = 0.0
+    return f, fres, fg, Vstar, Vcomp, Vg, phig
 
-    if CONFIG['Nsmear']<=2:
-        dl = np.array([0.])
-        Tr = np.array([1.0])
-    elif CONFIG['Nsmear']==3:
-        # -- original implementation, with top-hat transmission (slow and a little innacurate)
-        dl = np.linspace(-0.5, 0.5, CONFIG['Nsmear'])
-        Tr = np.ones(CONFIG['Nsmear'])
-    else: # -- gaussian
-        tsigma = 1/2.355 # FWHM of 1
-        #tsigma /=  0.57282 # FWH Maximum -> FWH Flux,
-        # -- takes most of the Gaussian transmission
-        dl = np.linspace(-0.8, 0.8, CONFIG['Nsmear'])
-        Tr = np.exp(-dl**2/(2*tsigma**2))
-    Tr /= np.sum(Tr)
+def _VbinSlow(uv, param):
+    """
+    Analytical complex visibility of a binary composed of a uniform
+    disk diameter and an unresolved source. "param" is a dictionnary
+    containing:
+
+    'diam*'   : in mas
+    'alpha*'  : optional LD coef for main star
+    'wavel'   : in um
+    'x, y'    : in mas
+    'f'       : flux ratio in % -> takes the absolute value
+    'f_wl_dwl': addition flux ratio in the line at wl, width dwl
+    'fres'    : resolved flux
+    'fres_wl_dwl': addition resolved flux ratio in the line at wl, width dwl
 
+    'xg', yg', 'diamg', 'fg': gaussian position, diameters and flux
+
+    """
+    f, fres, fg, Vstar, Vcomp, Vg, phig = _VbinTerms(uv, param)
+    c = np.pi/180/3600000.*1e6
+    dl, Tr = _smearingSamples()
 
     # -- Lachaume and
 
@@ -270,55 +454,223 @@ def _VbinSlow(uv, param):
         res = (Vstar + tmp.sum(axis=2))/(1.0 + f + fres + fg)
     return res
 
-try:
-    # -- Using Cython visibility function
-    import cyvis
-    def _VbinCy(uv, p):
-        N = np.size(uv[0])
-        if not 'diam*' in p.keys():
-            diam = 0.0
-        else:
-            diam = p['diam*']*1.0 # copy
+def _VbinBatch(uv, param, X, Y):
+    """
+    Same as _VbinSlow, but for a set of companion positions "X", "Y" (1D arrays,
+    in mas) instead of param['x'] and param['y']. The smeared phasors of the
+    companion are computed at once for all positions (see _smearedPhasor).
 
-        if not 'diamc' in p.keys():
-            diamc = 0.0
-        else:
-            diamc = p['diamc']*1.0 # copy
+    returns complex visibilities of shape (len(X),)+uv[0].shape
+    """
+    X, Y = np.atleast_1d(X), np.atleast_1d(Y)
+    s = np.shape(uv[0])
+    u, v = np.ravel(uv[0]), np.ravel(uv[1])
+    wavel = param['wavel']
+    if not np.isscalar(wavel):
+        wavel = np.ravel(wavel)
+    tmp = {k:param[k] for k in param.keys()}
+    tmp['wavel'] = wavel
+    f, fres, fg, Vstar, Vcomp, Vg, phig = _VbinTerms((u, v), tmp)
+    # -- smeared companion phasor
+    C = _smearedPhasor(u, v, np.broadcast_to(wavel, u.shape), param['dwavel'], X, Y)
+    # -- the gaussian has no phase (see _VbinSlow)
+    res = (Vstar + f*Vcomp*C + fg*Vg)/(1.0 + f + fres + fg)
+    return np.reshape(res, (len(X),)+s)
+
+def _smearedPhasorSlow(u, v, wl, dwavel, X, Y):
+    """
+    bandwidth smeared phasor of an unresolved companion of unit flux:
 
-        if not 'fres' in p.keys():
-            fres = 0.0
-        else:
-            fres = p['fres']*1.0 # copy
+    sum_k Tr_k exp(-2i.pi.c.(u*X + v*Y)/wl_k)
 
-        if isinstance(p['wavel'], float):
-            wavel = np.ones(N)*p['wavel']
-        else:
-            wavel = p['wavel'].flatten()
+    - u, v (in m), wl (in um): 1D arrays
+    - dwavel: width of the spectral channels (in um)
+    - X, Y: 1D arrays of positions (in mas)
 
-        if not 'dwavel' in p.keys():
-            dwavel = 0.0
-        else:
-            dwavel = p['dwavel']*1.0 # copy
-        if isinstance(dwavel, float):
-            dwavel = np.ones(N)*p['dwavel']
-        else:
-            dwavel = p['wavel'].flatten()
-        Vr = np.ones(np.size(uv[0]), dtype=np.double)
-        Vi = np.zeros(np.size(uv[0]), dtype=np.double)
-
-        cyvis.cyVbin(len(Vr), Vr, Vi, uv[0].flatten(), uv[1].flatten(),
-                     wavel, dwavel, CONFIG['Nsmear'],
-                     p['x'], p['y'], min(p['f'], 100), fres,
-                     diam, diamc)
-        return np.reshape(Vr+1j*Vi, uv[0].shape)
-    _Vbin = _VbinCy
+    the phases are computed in a single broadcast over (position, uv point,
+    smearing sample), with the tables of _smearingKernel. returns complex array
+    of shape (len(X), len(u))
+    """
+    c = np.pi/180/3600000.*1e6
+    Tr, iwl = _smearingKernel(wl, dwavel)
+    # -- phases: (position, uv point, sample)
+    phi = 2*np.pi*c*(X[:,None]*u[None,:] + Y[:,None]*v[None,:])
+    phi = phi[:,:,None]*iwl[None,:,:]
+    return np.exp(-1j*phi) @ Tr
+
+# -- largest quadratic term of the phase across a channel for the analytic smearing
+_analyticSmearingTol = 0.01 # in rad
+
+def _smearedPhasorAnalytic(u, v, wl, dwavel, X, Y, weighted=False):
+    """
+    same as _smearedPhasorSlow, for the continuous transmission of the
+    channels (see _smearingProfile) instead of samples. The phase being linear
+    in wavelength across the channel, the smearing is a real factor S (sinc
+    for a top-hat, gaussian for a gaussian) of the phasor at the central
+    wavelength:
+
+    C = exp(-i.phi).S(phi*dwavel/wl) with phi = 2.pi.c.(u*X + v*Y)/wl
+
+    The samples are used for the (position, uv point) where the quadratic term
+    of the phase across the channel is larger than _analyticSmearingTol, and
+    everywhere if it is the case for more than 10% of them.
+
+    if weighted, returns C, Cw: Cw is the phasor weighted by 1/wl, such that
+    dC/dX = -2i.pi.c.u.Cw (see _VbinJac)
+    """
+    c = 2*np.pi*np.pi/180/3600000.*1e6
+    profile = _smearingProfile()
+    X, Y = np.atleast_1d(X), np.atleast_1d(Y)
+    h = _smearingHalfWidth[profile]
+    # -- upper bound of the number of (position, uv point) needing the samples,
+    #    before computing the phases: |u*X + v*Y| <= B*R
+    q = np.sort(c*np.hypot(u, v)/wl*(h*dwavel/wl)**2)
+    R = np.hypot(X, Y)
+    Nbad = len(q) - np.searchsorted(q, _analyticSmearingTol/np.maximum(R, 1e-30),
+                                    side='right')
+    if np.sum(Nbad)>0.1*len(q)*len(R):
+        # -- cheaper to use the samples everywhere
+        if not weighted:
+            return _smearedPhasorSamples(u, v, wl, dwavel, X, Y)
+        Tr, iwl = _smearingKernel(wl, dwavel)
+        E = np.exp(-1j*c*(X[:,None]*u[None,:] + Y[:,None]*v[None,:])[:,:,None]*
+                   iwl[None,:,:])*Tr
+        return E.sum(axis=2), (E*iwl[None,:,:]).sum(axis=2)
+    p = c*(X[:,None]*u[None,:] + Y[:,None]*v[None,:])
+    a = p/wl[None,:]
+    r = dwavel/wl[None,:]
+    b = a*r
+    if profile=='none':
+        S, dS = 1.0, 0.0
+    elif profile=='top-hat':
+        S = np.sinc(b/(2*np.pi))
+        _b = b + (b==0)
+        dS = (b!=0)*(np.cos(b/2) - S)/_b
+    else:
+        # -- variance of the gaussian of FWHM 1 truncated at the samples (see
+        #    _smearingSamples), so both converge for large Nsmear
+        z = _smearingHalfWidth['gaussian']*2.355
+        s2 = (1 - 2*z*np.exp(-z**2/2)/np.sqrt(2*np.pi)/scipy.special.erf(z/np.sqrt(2)))
+        s2 /= 2.355**2
+        S = np.exp(-b**2*s2/2)
+        dS = -b*s2*S
+    E = np.exp(-1j*a)
+    C = E*S
+    if weighted:
+        Cw = E/wl[None,:]*(S + 1j*r*dS)
+    # -- samples where the phase is not linear enough in wavelength
+    bad = np.abs(a)*(h*r)**2 > _analyticSmearingTol
+    if bad.any():
+        Tr, iwl = _smearingKernel(wl, dwavel)
+        j, i = np.where(bad)
+        _E = np.exp(-1j*p[j,i][:,None]*iwl[i])*Tr[None,:]
+        C[j,i] = _E.sum(axis=1)
+        if weighted:
+            Cw[j,i] = (_E*iwl[i]).sum(axis=1)
+    if weighted:
+        return C, Cw
+    return C
+
+def _smearedPhasor(u, v, wl, dwavel, X, Y):
+    """
+    smeared phasor of the companion (see _smearedPhasorSlow), with the
+    analytic smearing if CONFIG['smearing']=='analytic' (see
+    _smearedPhasorAnalytic) else with the samples, using the compiled
+    function if available.
+    """
+    if CONFIG['smearing']=='analytic':
+        return _smearedPhasorAnalytic(u, v, wl, dwavel, X, Y)
+    return _smearedPhasorSamples(u, v, wl, dwavel, X, Y)
+
+if _numbaLoaded:
+    @numba.njit(cache=True)
+    def _nbSmearedPhasor(u, v, iwl, X, Y, Tr, Cr, Ci):
+        c = 2*np.pi*np.pi/180/3600000.*1e6
+        for j in range(X.size):
+            for i in range(u.size):
+                p = c*(u[i]*X[j] + v[i]*Y[j])
+                cr, ci = 0.0, 0.0
+                for k in range(Tr.size):
+                    phi = p*iwl[i,k]
+                    cr += Tr[k]*np.cos(phi)
+                    ci -= Tr[k]*np.sin(phi)
+                Cr[j,i] = cr
+                Ci[j,i] = ci
+        return
+
+    def _smearedPhasorNumba(u, v, wl, dwavel, X, Y):
+        """
+        same as _smearedPhasorSlow, compiled with Numba
+        """
+        Tr, iwl = _smearingKernel(wl, dwavel)
+        _f = lambda a: np.ascontiguousarray(a, dtype=np.float64)
+        Cr = np.zeros((np.size(X), np.size(u)))
+        Ci = np.zeros((np.size(X), np.size(u)))
+        _nbSmearedPhasor(_f(u), _f(v), _f(iwl), _f(X), _f(Y), _f(Tr), Cr, Ci)
+        return Cr + 1j*Ci
+
+    def _VbinNumba(uv, param):
+        """
+        same as _VbinSlow, with the smeared phasor of the companion compiled with
+        Numba (see _smearedPhasorNumba). The terms which do not depend on the
+        position of the companion (UD or LD primary, diamc, fres, gaussian) are
+        the ones of _VbinSlow (see _VbinTerms).
+        """
+        return _VbinBatch(uv, param, param['x'], param['y'])[0]
+
+    # -- Using Numba visibility function
+    _smearedPhasorSamples = _smearedPhasorNumba
+    _Vbin = _VbinNumba
     if __name__=='__main__':
-        print('Using Cython visibilities computation (Faster than Numpy)')
-except:
+        print('Using Numba visibilities computation (Faster than Numpy)')
+else:
+    def _VbinNumpy(uv, param):
+        """
+        same as _VbinSlow, with the smeared phasor of the companion computed with
+        the cached smearing tables (see _smearedPhasorSlow)
+        """
+        return _VbinBatch(uv, param, param['x'], param['y'])[0]
+
     # -- Using Numpy visibility function
-    _Vbin = _VbinSlow
+    _smearedPhasorSamples = _smearedPhasorSlow
+    _Vbin = _VbinNumpy
     if __name__=='__main__':
-        print('Using Numpy visibilities computation (Slower than Cython)')
+        print('Using Numpy visibilities computation (Slower than Numba)')
+
+def _checkVbin(N=100, verbose=True):
+    """
+    check the visibility function in use (_Vbin) against the reference
+    implementation _VbinSlow, with smearing, for random binaries with UD and LD
+    primaries, resolved companion, resolved flux and gaussian.
+
+    returns the largest absolute difference found. CONFIG['Nsmear'] and
+    CONFIG['smearing'] are changed during the check, and always restored.
+    """
+    global CONFIG
+    Nsmear, smearing = CONFIG['Nsmear'], CONFIG['smearing']
+    rng = np.random.RandomState(0)
+    u = rng.uniform(-130, 130, (N,6))
+    v = rng.uniform(-130, 130, (N,6))
+    wavel = np.linspace(1.5, 1.8, 6)[None,:] + 0*u
+    params = [{'x':5.0, 'y':-12., 'f':2.0, 'diam*':0.8},
+              {'x':-30., 'y':4.2, 'f':10., 'diam*':1.5, 'alpha*':0.3},
+              {'x':12., 'y':25., 'f':1.0, 'diam*':2.3, 'diamc':0.5, 'fres':3.0},
+              {'x':-3., 'y':-7., 'f':5.0, 'diam*':0.5, 'diamg':5., 'fg':4.0},
+              ]
+    err = 0.0
+    try:
+        CONFIG['smearing'] = 'samples'
+        for n in [1, 3, 7]:
+            CONFIG['Nsmear'] = n
+            for p in params:
+                p['wavel'], p['dwavel'] = wavel, 0.05
+                tmp = np.abs(_Vbin((u, v), p) - _VbinSlow((u, v), p)).max()
+                if verbose:
+                    print(' | Nsmear=%d'%n, p, '-> %.2e'%tmp)
+                err = max(err, tmp)
+    finally:
+        CONFIG['Nsmear'], CONFIG['smearing'] = Nsmear, smearing
+    return err
 
 def _V2binSlow(uv, param):
     """
@@ -393,9 +745,10 @@ if False: # -- check approximation
 
 def _V2binFast(uv, param):
     """
-    using weave
     uv = (u,v) where u,v a are ndarray
 
+    same as _V2binSlow, using the compiled visibility if available (see _Vbin).
+
     param MUST contain:
     - diam*, x, y: in mas
     - f: in %
@@ -403,128 +756,20 @@ def _V2binFast(uv, param):
 
     optional:
     - diamc: in mas
-    - dwavel: in um
+    - dwavel: in um (default is monochromatic)
     - fres: fully resolved flux, in fraction of primary flux
     """
-    u, v = uv
-    B = np.sqrt(u**2+v**2)
-    s = u.shape
-    u, v = u.flatten(), v.flatten()
-    NU = len(u)
-    vr, vi, v2 = np.zeros(NU), np.zeros(NU), np.zeros(NU)
-
-    diam = np.abs(float(param['diam*']))
-
-    wavel = param['wavel']
-
-    if isinstance(wavel, np.ndarray):
-        wavel = wavel.flatten()
-    else:
-        wavel = np.ones(NU)*wavel
-
-    if 'x' in param.keys():
-        x = param['x']*1.0
-    else:
-        x = 0.0
-
-    if 'y' in param.keys():
-        y = param['y']*1.0
-    else:
-        y = 0.0
-
-    if 'f' in param.keys():
-        f = np.abs(param['f'])*1.0
-    else:
-        f = 0.0
-
-    if 'diamc' in param.keys():
-        diamc = np.abs(param['diamc'])*1.0
-    else:
-        diamc = 0.0
-
-    if 'dwavel' in param.keys():
-        dwavel = param['dwavel']*1.0
-    else:
-        dwavel = 0.0
-
-    if __warningDwavel and dwavel==0:
-        print(' >>> WARNING: no spectral bandwidth provided!')
-
-    if 'fres' in param.keys():
-        fres = param['fres']*1.0
-    else:
-        fres = 0.0
-
-    #print(diam, x, y, f, wavel, dwavel)
-    #print(u.shape, v.shape, wavel.shape, vr.shape)
-    Nsmear = CONFIG['Nsmear']
-    print('#'*12, f, diam, '#'*12)
-    code = u"""
-    int i, j;
-    float vis, X, pi, phi, visc, wl, t_vr, t_vi, c;
-
-    pi = 3.1415926535;
-    c = 0.004848136;
-    f /= 100.0; /* flux ratio given in % */
-    if (f>1){
-        f = 1.0;
-        }
-    fres /= 100.0; /* flux ratio given in % */
-
-    phi = 0.0;
-    /* -- companion visibility, default is unresoved (V=1) */
-    visc = 1.0;
-    vis = 1.0;
-    for (i=0; i<NU; i++){
-        /* -- primary star of V_UD */
-        phi = -2*pi*c*(u[i]*x + v[i]*y);
-
-        if (Nsmear<2){
-            if (diam>0){
-                X = pi*c*B[i]*diam/wavel[i];
-                vis = VUDX;
-            }
-            if (diamc>0) {
-                X = pi*c*B[i]*diamc/wavel[i];
-                visc = VUDX;
-                }
-            vr[i] = vis/(1.0+f+fres) + f * visc * cos( phi/wavel[i] ) / (1.0 + f + fres);
-            vi[i] = f * visc * sin( phi/wavel[i] ) / (1.0 + f + fres);
-            v2[i] = vr[i]*vr[i] + vi[i]*vi[i];
-        } else {
-        for (j=0;j<Nsmear;j++) {
-            wl = wavel[i]+(-0.5 + j/(Nsmear-1.0))*dwavel;
-            if (diam>0){
-                X = pi*c*B[i]*diam/wl;
-                vis = VUDX;
-            }
-            if (diamc>0) {
-                X = pi*c*B[i]*diamc/wl;
-                visc = VUDX;
-                }
-            t_vr = (vis + f * visc * cos(phi/wl) ) / (1.0 + f + fres);
-            t_vi = (0.0 + f * visc * sin(phi/wl) ) / (1.0 + f + fres);
-
-            vr[i] += t_vr / Nsmear;
-            vi[i] += t_vi / Nsmear;
-            v2[i] += (t_vr*t_vr + t_vi*t_vi) / Nsmear;
-            }
-        }
-    }""".replace('VUDX', _VUDX)
-    err = weave.inline(code, ['u','v','NU','diam','x','y','f','diamc','B',
-                              'wavel','dwavel','vr','vi', 'v2', 'Nsmear','fres'],
-                       compiler = 'gcc', verbose=0, #extra_compile_args=['-O3'],
-                       type_converters = converters.blitz,
-                       #headers=['<algorithm>', '<limits>']
-                       )
-    v2 = v2.reshape(s)
-    return v2
+    tmp = {k:param[k] for k in param.keys()}
+    if not 'dwavel' in tmp.keys():
+        tmp['dwavel'] = 0.0
+    return _V2binSlow(uv, tmp)
 
 def _T3binFast(uv, param):
     """
-    using weave
     uv = (u1,v1, u2, v2) where u1,v1, u2,v2 a are ndarray
 
+    same as _T3binSlow, using the compiled visibility if available (see _Vbin).
+
     param MUST contain:
     - diam*, x, y: in mas
     - f: in %
@@ -532,198 +777,14 @@ def _T3binFast(uv, param):
 
     optional:
     - diamc: in mas
-    - dwavel: in um
+    - dwavel: in um (default is monochromatic)
     - fres: unresolved flux, in fraction of primary flux
 
     """
-    u1, v1, u2, v2 = uv
-    s = u1.shape
-    u1, v1 = u1.flatten(), v1.flatten()
-    u2, v2 = u2.flatten(), v2.flatten()
-    NU = len(u1)
-    t3r, t3i = np.zeros(NU), np.zeros(NU)
-
-    diam = np.abs(float(param['diam*']))
-
-    wavel = param['wavel']
-
-    if isinstance(wavel, np.ndarray):
-        wavel = wavel.flatten()
-    else:
-        wavel = np.ones(NU)*wavel
-
-    if 'x' in param.keys():
-        x = float(param['x'])
-    else:
-        x = 0.0
-
-    if 'y' in param.keys():
-        y = float(param['y'])
-    else:
-        y = 0.0
-
-    if 'f' in param.keys():
-        f = float(np.abs(param['f']))
-        #f = min(f, 1.0)
-    else:
-        f = 0.0
-
-    if 'diamc' in param.keys():
-        diamc = np.abs(float(param['diamc']))
-    else:
-        diamc = 0.0
-
-    if 'dwavel' in param.keys():
-        dwavel = float(param['dwavel'])
-    else:
-        dwavel = 0.0
-
-    if __warningDwavel and dwavel==0:
-        print(' >>> WARNING: no spectral bandwidth provided!')
-
-    if 'fres' in param.keys():
-        fres = float(param['fres'])
-    else:
-        fres = 0.0
-
-    Nsmear = CONFIG['Nsmear']
-
-    code = u"""int i, j;
-    /* -- first baseline */
-    double B1, vis1, phi1, visc1, vr1, vi1;
-
-    /* -- second baseline */
-    double B2, vis2, phi2, visc2, vr2, vi2;
-
-    /* -- third baseline */
-    double u12, v12;
-    double B12, vis12, phi12, visc12, vr12, vi12;
-
-    double X, pi, wl, c;
-    pi = 3.1415926535;
-    c = 0.004848136;
-    f /= 100.; /* flux ratio given in % */
-    if (f>1) {f = 1.0;}
-    fres /= 100.; /* flux ratio given in % */
-
-    phi1  = 0.0;
-    phi2  = 0.0;
-    phi12 = 0.0;
-    vis1  = 1.0;
-    vis2  = 1.0;
-    vis12 = 1.0;
-
-    /* -- companion visibility, default is unresoved (V=1) */
-    visc1  = 1.0;
-    visc2  = 1.0;
-    visc12 = 1.0;
-
-
-    for (i=0; i<NU; i++){
-        /* -- baselines for each u,v coordinates */
-        B1 = sqrt(u1[i]*u1[i] + v1[i]*v1[i]);
-        B2 = sqrt(u2[i]*u2[i] + v2[i]*v2[i]);
-
-        u12 = u1[i] + u2[i];
-        v12 = v1[i] + v2[i];
-        B12 = sqrt(u12*u12 + v12*v12);
-
-        phi1  = -2*pi*0.004848136*(u1[i] * x + v1[i] * y);
-        phi2  = -2*pi*0.004848136*(u2[i] * x + v2[i] * y);
-        phi12 = -2*pi*0.004848136*(  u12 * x +   v12 * y);
-
-        if (Nsmear<2) { /* -- monochromatic */
-            if (diam>0) {
-                /* -- approximation of V_UD */
-                X = pi*c*B1*diam/wavel[i];
-                vis1 = VUDX;
-                X = pi*c*B2*diam/wavel[i];
-                vis2 = VUDX;
-                X = pi*c*B12*diam/wavel[i];
-                vis12 = VUDX;
-            }
-            if (diamc>0) {
-                /* -- approximation of V_UD */
-                X = pi*c*B1*diamc/wavel[i];
-                visc1 = VUDX;
-                X = pi*c*B2*diamc/wavel[i];
-                visc2 = VUDX;
-                X = pi*c*B12*diamc/wavel[i];
-                visc12 = VUDX;
-                }
-
-            /* -- binary visibilities: */
-            vr1 = (vis1 + f*cos(phi1/wavel[i])) / (1.0 + f + fres);
-            vi1 = f*sin(phi1/wavel[i]) / (1.0 + f + fres);
-
-            vr2 = (vis2 + f*cos(phi2/wavel[i])) / (1.0 + f + fres);
-            vi2 = f*sin(phi2/wavel[i]) / (1.0 + f + fres);
-
-            vr12 = (vis12 + f*cos(phi12/wavel[i])) / (1.0 + f + fres);
-            vi12 = f*sin(phi12/wavel[i]) / (1.0 + f + fres);
-
-            /* -- T3 = V1 * V2 * conj(V12) */
-            t3r[i] = vr1*(vr2*vr12 + vi2*vi12);
-            t3r[i] += vi1*(vr2*vi12 - vi2*vr12);
-            t3i[i] = vr1*(vi2*vr12 - vr2*vi12);
-            t3i[i] += vi1*(vr2*vr12 + vi2*vi12);
-
-        } else { /* -- smeared */
-            vr1 = 0.0;
-            vi1 = 0.0;
-            vr2 = 0.0;
-            vi2 = 0.0;
-            vr12 = 0.0;
-            vi12 = 0.0;
-            for (j=0; j<Nsmear; j++) {
-                /* -- wavelength in bin: */
-                wl = wavel[i] + (-0.5 + j/(Nsmear-1.0)) * dwavel;
-                if (diam>0) {
-                    /* -- approximation of V_UD */
-                    X = pi*c*B1*diam/wl;
-                    vis1 = VUDX;
-                    X = pi*c*B2*diam/wl;
-                    vis2 = VUDX;
-                    X = pi*c*B12*diam/wl;
-                    vis12 = VUDX;
-                }
-                if (diamc>0) {
-                    /* -- approximation of V_UD */
-                    X = pi*c*B1*diamc/wl;
-                    visc1 = VUDX;
-                    X = pi*c*B2*diamc/wl;
-                    visc2 = VUDX;
-                    X = pi*c*B12*diamc/wl;
-                    visc12 = VUDX;
-                    }
-
-                /* == smear in T3 ======================= */
-                /* -- binary visibilities: */
-                vr1 = (vis1 + f*cos(phi1/wl)) / (1.0 + f + fres);
-                vi1 = f*sin(phi1/wl) / (1.0 + f + fres);
-
-                vr2 = (vis2 + f*cos(phi2/wl)) / (1.0 + f + fres);
-                vi2 = f*sin(phi2/wl) / (1.0 + f + fres);
-
-                vr12 = (vis12 + f*cos(phi12/wl)) / (1.0 + f + fres);
-                vi12 = f*sin(phi12/wl) / (1.0 + f + fres);
-
-                /* -- T3 = V1 * V2 * conj(V12) */
-                t3r[i] += vr1*(vr2*vr12 + vi2*vi12)/Nsmear;
-                t3r[i] += vi1*(vr2*vi12 - vi2*vr12)/Nsmear;
-                t3i[i] += vr1*(vi2*vr12 - vr2*vi12)/Nsmear;
-                t3i[i] += vi1*(vr2*vr12 + vi2*vi12)/Nsmear;
-            }
-        }
-
-    }""".replace('VUDX', _VUDX)
-    err = weave.inline(code, ['u1','v1','u2','v2','NU','diam','x','y', 'fres',
-                              'f','diamc','wavel','dwavel','t3r','t3i','Nsmear'],
-                       #type_factories = blitz_type_factories,
-                       compiler = 'gcc', verbose=0)
-    res = t3r + 1j*t3i
-    res = res.reshape(s)
-    return res
+    tmp = {k:param[k] for k in param.keys()}
+    if not 'dwavel' in tmp.keys():
+        tmp['dwavel'] = 0.0
+    return _T3binSlow(uv, tmp)
 
 def _NsmearForCPaccuracy(errCP, B, sep, wavel, dwavel, f):
     """
@@ -766,6 +827,7 @@ def _modelObservables(obs, param, flattened=True):
     tmp = {k:param[k] for k in param.keys()}
     tmp['f'] = np.abs(tmp['f'])
     for i, o in enumerate(obs):
+        t0 = _profileTime()
         if 'dwavel' in param.keys():
             dwavel = param['dwavel']
         elif 'dwavel;'+o[0].split(';')[1] in param.keys():
@@ -819,7 +881,7 @@ def _modelObservables(obs, param, flattened=True):
             # -- wl range based on min, mean, max
             _wl = np.linspace(o[-4][0], o[-4][2], 2*n+2)
             # -- remove pix width
-            tmp.pop('dwavel')
+            tmp.pop('dwavel', None)
             _cp = []
             for _l in _wl:
                 tmp['wavel']=_l
@@ -828,16 +890,389 @@ def _modelObservables(obs, param, flattened=True):
             res[i] = np.array([np.polyfit(_wl-o[-4][1], _cp[:,j], n)[n-p] for j in range(_cp.shape[1])])
         else:
             print('ERROR: unreckognized observable:', o[0])
+        _profileAdd('model '+o[0].split(';')[0], t0)
 
     if not flattened:
         return res
 
-    res2 = np.array([])
-    for r in res:
-        res2 = np.append(res2, r.flatten())
     _N_modelObservables += 1
+    if len(res)==0:
+        return np.array([])
+    return np.concatenate([np.ravel(r) for r in res])
+
+def _modelObservablesBatch(obs, param, X, Y):
+    """
+    same as _modelObservables (flattened), but for a set of companion positions
+    "X", "Y" (1D arrays, in mas). param['x'] and param['y'] are ignored.
+
+    returns an array of shape (len(X), Ndata)
+    """
+    global _N_modelObservables
+    X, Y = np.atleast_1d(X), np.atleast_1d(Y)
+    res = []
+    tmp = {k:param[k] for k in param.keys() if not k.startswith('dwavel')}
+    tmp['f'] = min(np.abs(tmp['f']), 100)
+    for o in obs:
+        t0 = _profileTime()
+        if 'dwavel' in param.keys():
+            dwavel = param['dwavel']
+        elif 'dwavel;'+o[0].split(';')[1] in param.keys():
+            dwavel = param['dwavel;'+o[0].split(';')[1]]
+        else:
+            dwavel = 0.0
+        t = o[0].split(';')[0]
+        if t=='v2':
+            tmp['wavel'] = o[3]
+            tmp['dwavel'] = dwavel
+            r = np.abs(_VbinBatch((o[1], o[2]), tmp, X, Y))**2
+        elif t in ['cp', 't3', 'icp', 'scp', 'ccp']:
+            tmp['wavel'] = o[5]
+            tmp['dwavel'] = dwavel
+            t3 = _VbinBatch((o[1], o[2]), tmp, X, Y)*\
+                 _VbinBatch((o[3], o[4]), tmp, X, Y)*\
+                 np.conj(_VbinBatch((o[1]+o[3], o[2]+o[4]), tmp, X, Y))
+            if t=='cp':
+                r = np.angle(t3)
+            elif t=='scp':
+                r = np.sin(np.angle(t3))
+            elif t=='ccp':
+                r = np.cos(np.angle(t3))
+            elif t=='icp':
+                r = t3/np.absolute(t3)
+            elif t=='t3':
+                r = np.absolute(t3)
+        else:
+            # -- polynomial observables: one position at a time
+            r = []
+            for x,y in zip(X, Y):
+                _p = {k:param[k] for k in param.keys()}
+                _p['x'], _p['y'] = x, y
+                r.append(_modelObservables([o], _p))
+            r = np.array(r)
+        res.append(np.reshape(r, (len(X), -1)))
+        _profileAdd('model '+t, t0, len(X))
+    _N_modelObservables += len(X)
+    return np.concatenate(res, axis=1)
+
+def _fluxComponents(obs, param, X, Y):
+    """
+    terms of the binary model (see _VbinBatch) which do not depend on the flux
+    ratio of the companion, for the positions "X", "Y" (1D arrays, in mas).
+    For each block of "obs": (type, [(A, B, f0, D0), ...]) with one element per
+    complex visibility (1 for v2, 3 for closure phases), such that
+
+    V = (A + f*B)/(D0 + f) with f = f0 + flux ratio/100
+
+    B has shape (len(X), Ndata in block). Only for the observables in
+    _jacObservables. see _fluxObservables
+    """
+    X, Y = np.atleast_1d(X), np.atleast_1d(Y)
+    res = []
+    for o in obs:
+        t0 = _profileTime()
+        if 'dwavel' in param.keys():
+            dwavel = param['dwavel']
+        elif 'dwavel;'+o[0].split(';')[1] in param.keys():
+            dwavel = param['dwavel;'+o[0].split(';')[1]]
+        else:
+            dwavel = 0.0
+        t = o[0].split(';')[0]
+        if t=='v2':
+            uvs, wl = [(o[1], o[2])], o[3]
+        else:
+            uvs, wl = [(o[1], o[2]), (o[3], o[4]), (o[1]+o[3], o[2]+o[4])], o[5]
+        terms = []
+        for uv in uvs:
+            u, v = np.ravel(uv[0]), np.ravel(uv[1])
+            tmp = {k:param[k] for k in param.keys() if not k.startswith('dwavel')}
+            tmp['f'] = 0.0
+            tmp['wavel'] = wl if np.isscalar(wl) else np.ravel(wl)
+            f0, fres, fg, Vstar, Vcomp, Vg, phig = _VbinTerms((u, v), tmp)
+            C = _smearedPhasor(u, v, np.broadcast_to(tmp['wavel'], u.shape), dwavel, X, Y)
+            # -- the gaussian has no phase (see _VbinSlow)
+            terms.append((Vstar + fg*Vg, Vcomp*C, f0, 1.0 + fres + fg))
+        res.append((t, terms))
+        _profileAdd('model '+t+' (flux components)', t0, len(X))
+    return res
+
+def _fluxObservables(comp, F):
+    """
+    observables (flattened, see _modelObservables) from the components "comp"
+    (see _fluxComponents) for the flux ratios "F" (in %): 1D array common to
+    all positions, or 2D array (position, flux ratio).
+
+    returns an array of shape (Npositions, Nflux, Ndata)
+    """
+    global _N_modelObservables
+    t0 = _profileTime()
+    F = np.minimum(np.abs(np.asarray(F, dtype=float)), 100)/100.
+    res = []
+    for t, terms in comp:
+        V = []
+        for A, B, f0, D0 in terms:
+            f = f0 + F[...,None]
+            V.append((A + f*B[:,None,:])/(D0 + f))
+        if t=='v2':
+            r = np.abs(V[0])**2
+        else:
+            t3 = V[0]*V[1]*np.conj(V[2])
+            if t=='cp':
+                r = np.angle(t3)
+            elif t=='scp':
+                r = np.sin(np.angle(t3))
+            elif t=='ccp':
+                r = np.cos(np.angle(t3))
+            elif t=='t3':
+                r = np.absolute(t3)
+        res.append(r)
+    _N_modelObservables += res[0].shape[0]*res[0].shape[1]
+    _profileAdd('model (flux observables)', t0, res[0].shape[0]*res[0].shape[1])
+    return np.concatenate(res, axis=2)
+
+class _FluxModel:
+    """
+    binary model (see _VbinBatch) at the companion positions "X", "Y" (1D
+    arrays, in mas), as a function of the flux ratio of the companion. The
+    terms which do not depend on the flux ratio are computed once (see
+    _fluxComponents): for each complex visibility, the visibility of the
+    primary (with the gaussian) A, the smeared phasor of the companion
+    B = Vcomp*C, the flux of the lines f0 and the other fluxes D0. The
+    observables for any number of flux ratios f (in %) are then:
+
+    V = (A + (f0+f/100)*B)/(D0 + f0+f/100)
+
+    - obs: list of data blocks (or a _FitData), only _jacObservables
+    - param: parameters of the model, as for _VbinSlow. 'f', 'x' and 'y' are
+      ignored.
+    """
+    def __init__(self, obs, param, X, Y):
+        if isinstance(obs, _FitData):
+            obs = obs.obs
+        self.X, self.Y = np.atleast_1d(X), np.atleast_1d(Y)
+        self.components = _fluxComponents(obs, param, self.X, self.Y)
+    def observables(self, F):
+        """
+        observables (flattened) for the flux ratios "F" (in %), 1D array or 2D
+        (position, flux ratio). returns an array (position, flux ratio, data)
+        """
+        return _fluxObservables(self.components, F)
+    def chi2(self, F, meas, errs):
+        """
+        chi2r (see _chi2Func) for the flux ratios "F" (see observables) and the
+        measurements "meas" +- "errs" (flattened). returns an array (position,
+        flux ratio). The flux ratios are taken one at a time, to limit memory.
+        """
+        F = np.asarray(F, dtype=float)
+        if F.ndim==1:
+            F = F[None,:]*np.ones(len(self.X))[:,None]
+        res = np.zeros(F.shape)
+        for k in range(F.shape[1]):
+            r = np.nan_to_num(meas[None,:] - self.observables(F[:,k:k+1])[:,0,:])
+            res[:,k] = np.nanmean(r**2/errs[None,:]**2, axis=1)
+        return res
+
+# -- observables handled by _modelObservablesJac
+_jacObservables = ['v2', 'cp', 't3', 'scp', 'ccp']
+
+def _VbinJac(uv, param, keys):
+    """
+    complex visibility of the binary (see _VbinSlow) and its analytical
+    derivatives with respect to the parameters "keys", among 'x', 'y', 'f',
+    'fres' and 'diam*' (uniform disk only). Bandwidth smearing is taken into
+    account.
+
+    returns V, [dV/dk for k in keys], with the shape of uv[0]
+    """
+    s = np.shape(uv[0])
+    u, v = np.ravel(uv[0]), np.ravel(uv[1])
+    tmp = {k:param[k] for k in param.keys()}
+    tmp['f'] = min(np.abs(param['f']), 100)
+    if not np.isscalar(tmp['wavel']):
+        tmp['wavel'] = np.ravel(tmp['wavel'])
+    wl = np.broadcast_to(tmp['wavel'], u.shape)
+    f, fres, fg, Vstar, Vcomp, Vg, phig = _VbinTerms((u, v), tmp)
+    c = 2*np.pi*np.pi/180/3600000.*1e6
+    if ('x' in keys or 'y' in keys) and CONFIG['smearing']=='analytic':
+        C, Cw = _smearedPhasorAnalytic(u, v, wl, tmp['dwavel'], tmp['x'], tmp['y'],
+                                       weighted=True)
+        C, Cw = C[0], Cw[0]
+    elif 'x' in keys or 'y' in keys:
+        # -- smeared companion phasor C, and the same weighted by 1/wl for d/dx, d/dy
+        Tr, iwl = _smearingKernel(wl, tmp['dwavel'])
+        E = Tr[None,:]*np.exp(-1j*c*(u*tmp['x']+v*tmp['y'])[:,None]*iwl)
+        C, Cw = E.sum(axis=1), (E*iwl).sum(axis=1)
+    elif np.any(f!=0) or 'f' in keys:
+        C = _smearedPhasor(u, v, wl, tmp['dwavel'],
+                           np.array([tmp['x']]), np.array([tmp['y']]))[0]
+    else:
+        C = 0.0
+    D = 1.0 + f + fres + fg
+    # -- the gaussian has no phase (see _VbinSlow)
+    V = (Vstar + f*Vcomp*C + fg*Vg)/D
+    dV = []
+    for k in keys:
+        if k=='x':
+            dV.append(-1j*c*u*f*Vcomp*Cw/D)
+        elif k=='y':
+            dV.append(-1j*c*v*f*Vcomp*Cw/D)
+        elif k=='f':
+            # -- f is in %, used as min(|f|, 100)
+            df = np.sign(param['f'])*(np.abs(param['f'])<100)/100.
+            dV.append(df*(Vcomp*C - V)/D)
+        elif k=='fres':
+            dV.append(-V/D/100.)
+        elif k=='diam*':
+            # -- d(2J1(z)/z)/dz = -2J2(z)/z, see _Vud
+            B = np.sqrt(u**2+v**2)
+            z = 0.01523087098933543*tmp['diam*']*B/wl
+            z += 1e-6*(z==0)
+            dV.append(-2*scipy.special.jv(2, z)/z*0.01523087098933543*B/wl/D)
+    return np.reshape(V, s), [np.reshape(d, s) for d in dV]
+
+def _modelObservablesJac(obs, param, keys):
+    """
+    same as _modelObservables (flattened), also returning the derivatives of
+    the model with respect to the parameters "keys", as an array of shape
+    (Ndata, len(keys)).
+
+    Derivatives are analytical for x, y, f, fres and diam* (uniform disk, not 0)
+    and computed by finite differences for the other parameters. Only for the
+    observables in _jacObservables.
+    """
+    global _N_modelObservables
+    t0 = _profileTime()
+    ana = ['x', 'y', 'f', 'fres']
+    # -- V(diam*) is even: its derivative is 0 for diam*=0, where the fit would
+    #    be stuck. Finite differences (one sided) get it out of there.
+    if not ('alpha*' in param.keys() and param['alpha*']>0.0) and \
+            param['diam*']!=0:
+        ana.append('diam*')
+    ana = [k for k in keys if k in ana]
+    res, jac = [], []
+    tmp = {k:param[k] for k in param.keys() if not k.startswith('dwavel')}
+    for o in obs:
+        if 'dwavel' in param.keys():
+            tmp['dwavel'] = param['dwavel']
+        elif 'dwavel;'+o[0].split(';')[1] in param.keys():
+            tmp['dwavel'] = param['dwavel;'+o[0].split(';')[1]]
+        else:
+            tmp['dwavel'] = 0.0
+        t = o[0].split(';')[0]
+        if t=='v2':
+            tmp['wavel'] = o[3]
+            V, dV = _VbinJac((o[1], o[2]), tmp, ana)
+            r = np.abs(V)**2
+            d = [2*np.real(np.conj(V)*x) for x in dV]
+        elif t in ['cp', 't3', 'scp', 'ccp']:
+            tmp['wavel'] = o[5]
+            V1, dV1 = _VbinJac((o[1], o[2]), tmp, ana)
+            V2, dV2 = _VbinJac((o[3], o[4]), tmp, ana)
+            V3, dV3 = _VbinJac((o[1]+o[3], o[2]+o[4]), tmp, ana)
+            t3 = V1*V2*np.conj(V3)
+            dt3 = [a*V2*np.conj(V3) + V1*b*np.conj(V3) + V1*V2*np.conj(c)
+                   for a,b,c in zip(dV1, dV2, dV3)]
+            if t=='t3':
+                r = np.absolute(t3)
+                d = [np.real(np.conj(t3)*x)/r for x in dt3]
+            else:
+                r = np.angle(t3)
+                d = [np.imag(x/t3) for x in dt3]
+                if t=='scp':
+                    r, d = np.sin(r), [np.cos(r)*x for x in d]
+                elif t=='ccp':
+                    r, d = np.cos(r), [-np.sin(r)*x for x in d]
+        else:
+            raise Exception('no derivatives for observable '+o[0])
+        res.append(np.ravel(r))
+        jac.append(np.array([np.ravel(x) for x in d]).reshape(len(ana), -1).T)
+    _N_modelObservables += 1
+    if len(res)==0:
+        return np.array([]), np.zeros((0, len(keys)))
+    res = np.concatenate(res)
+    jac = np.concatenate(jac, axis=0)
+    J = np.zeros((len(res), len(keys)))
+    for i,k in enumerate(keys):
+        if k in ana:
+            J[:,i] = jac[:,ana.index(k)]
+        else:
+            # -- finite differences
+            _p = {_k:param[_k] for _k in param.keys()}
+            h = 1e-4*np.abs(_p[k]) if _p[k]!=0 else 1e-4
+            _p[k] += h
+            J[:,i] = (_modelObservables(obs, _p) - res)/h
+    _profileAdd('model jacobian', t0)
+    return res, J
+
+def _interpMap(x, y, z, X, Y):
+    """
+    interpolate the values "z" at positions "x", "y" (1D) on the arrays "X",
+    "Y", according to CONFIG['map interpolation']:
+    - 'rbf': linear radial basis functions using the CONFIG['map neighbors']
+      closest points (scipy.interpolate.RBFInterpolator)
+    - 'delaunay': linear interpolation on the triangulation of the points,
+      nearest point outside of their convex hull
+    - 'legacy rbf': scipy.interpolate.Rbf, on all the points. Memory and
+      time grow as the square and the cube of the number of points!
+    """
+    x, y, z = np.asarray(x, float), np.asarray(y, float), np.asarray(z, float)
+    xy = np.array([x, y]).T
+    XY = np.array([X.flatten(), Y.flatten()]).T
+    method = CONFIG['map interpolation']
+    if method=='legacy rbf':
+        return scipy.interpolate.Rbf(x, y, z, function='linear')(X, Y)
+    elif method=='delaunay':
+        Z = scipy.interpolate.NearestNDInterpolator(xy, z)(XY)
+        if len(z)>=3:
+            try:
+                tmp = scipy.interpolate.LinearNDInterpolator(xy, z)(XY)
+                Z[np.isfinite(tmp)] = tmp[np.isfinite(tmp)]
+            except scipy.spatial.QhullError:
+                # -- aligned points: keep the nearest
+                pass
+        return Z.reshape(X.shape)
+    elif method=='rbf':
+        return scipy.interpolate.RBFInterpolator(xy, z, kernel='linear', degree=0,
+                    neighbors=min(CONFIG['map neighbors'], len(z)))(XY).reshape(X.shape)
+    else:
+        raise ValueError("unknown CONFIG['map interpolation']: "+str(method))
 
-    return res2
+def _uniqueMinima(fits, scale):
+    """
+    indices of the distinct minima in the list "fits" (results of _fitFunc),
+    in order: a fit is a new minimum if no previous minimum is at a distance
+    <=1. The distance is the mean of the squared differences of 'x', 'y', 'f'
+    and 'diam' (the ones fitted in both), in units of 0.5*scale (x, y), 0.01
+    (f) and 0.1*scale (diam).
+
+    The minima are stored in cells of size "scale" in x and y: only the
+    minima in the neighbouring cells can be at a distance <=1.
+    """
+    units = {'x':0.5*scale, 'y':0.5*scale, 'f':0.01, 'diam':0.1*scale}
+    def _fitted(f, k):
+        return k in f['uncer'].keys() and f['uncer'][k]!=0
+    def _dist(f, a):
+        tmp, n = 0., 0.
+        for k in ['x', 'y', 'f', 'diam']:
+            if _fitted(f, k) and _fitted(a, k):
+                tmp += (f['best'][k]-a['best'][k])**2/units[k]**2
+                n += 1.
+        return tmp/n
+    res, cells, others = [], {}, []
+    for i,f in enumerate(fits):
+        if _fitted(f, 'x') and _fitted(f, 'y'):
+            c = (int(np.floor(f['best']['x']/scale)), int(np.floor(f['best']['y']/scale)))
+            near = others+[j for dx in [-1,0,1] for dy in [-1,0,1]
+                           for j in cells.get((c[0]+dx, c[1]+dy), [])]
+        else:
+            # -- no position: can be close to any minimum
+            c, near = None, res
+        if not any([_dist(f, fits[j])<=1 for j in near]):
+            res.append(i)
+            if c is None:
+                others.append(i)
+            else:
+                cells.setdefault(c, []).append(i)
+    return res
 
 def _nSigmas(chi2r_TEST, chi2r_TRUE, NDOF):
     """
@@ -863,16 +1298,97 @@ def _injectCompanionData(data, delta, param):
     data and delta have same length
     """
     global CONFIG
-
+    t0 = _profileTime()
     bi = _modelObservables(data, param, flattened=False)
     ud = param.copy(); ud['f'] = 0.0
     ud = _modelObservables(data, ud, flattened=False)
     for i,d in enumerate(data):
         d[-2] += np.sign(param['f'])*(bi[i]-ud[i])
+    _profileAdd('data: companion injection', t0)
     return data
     return res
 
-def _generateFitData(chi2Data, observables, instruments):
+class _FitData:
+    """
+    compiled version of the data (a list of blocks as in Open._chi2Data),
+    restricted to "observables" and "instruments". Built once, it is passed
+    directly to _fitFunc, _chi2Func, _chi2MapBlock and _detectLimit instead of
+    the list of blocks. contains:
+
+    - obs: the list of blocks meaningful for the observables and instruments
+    - meas, errs: measurements and errors, flattened (errs==0 set to 1)
+    - uv: B/wl, flattened (max baseline of the triangle if CP or T3)
+    - wl: wavelength, flattened (mean wavelength for the polynomial fits)
+    - itype: index in "typenames" (e.g. 'v2;ins') of each data point
+    - iobs: index in "obs" of each data point
+    - ndata: number of valid (not NaN) data points
+    """
+    def __init__(self, chi2Data, observables, instruments):
+        t0 = _profileTime()
+        self.observables = list(observables)
+        self.instruments = list(instruments)
+        self.obs = list(filter(lambda c: c[0].split(';')[0] in observables and
+                                         c[0].split(';')[1] in instruments,
+                               chi2Data))
+        self.typenames = []
+        _meas, _errs, _wl, _uv, _itype, _iobs = [], [], [], [], [], []
+        for i,c in enumerate(self.obs):
+            t = c[0].split(';')[0]
+            if not c[0] in self.typenames:
+                self.typenames.append(c[0])
+            n = c[-2].size
+            _itype.append(np.full(n, self.typenames.index(c[0])))
+            _iobs.append(np.full(n, i))
+            _meas.append(np.ravel(c[-2]))
+            _errs.append(np.ravel(c[-1]))
+            if '_' in t:
+                # -- polynomial fit: c[-4] is (min, mean, max) of the
+                #    wavelength, the mean is the effective one of each point
+                wl = np.full(n, c[-4][1])
+            else:
+                wl = np.ravel(np.broadcast_to(c[-4], c[-2].shape))
+            _wl.append(wl)
+            if t.startswith('v2'):
+                _uv.append(np.sqrt(np.ravel(c[1])**2+np.ravel(c[2])**2)/wl)
+            elif t.split('_')[0] in ['t3', 'cp', 'icp', 'scp', 'ccp']:
+                tmp = np.maximum(np.sqrt(np.ravel(c[1])**2+np.ravel(c[2])**2),
+                                 np.sqrt(np.ravel(c[3])**2+np.ravel(c[4])**2))
+                tmp = np.maximum(tmp, np.sqrt(np.ravel(c[1]+c[3])**2+np.ravel(c[2]+c[4])**2))
+                _uv.append(tmp/wl)
+            assert len(_wl[-1])==n and len(_uv[-1])==n, \
+                'wavelengths or baselines do not match the data in '+c[0]
+        _cat = lambda x, dtype=float: np.concatenate(x) if len(x) else np.array([], dtype=dtype)
+        self.meas = _cat(_meas)
+        self.errs = _cat(_errs)
+        self.wl = _cat(_wl)
+        self.uv = _cat(_uv)
+        self.itype = _cat(_itype, int)
+        self.iobs = _cat(_iobs, int)
+        self.ndata = int(np.sum(~(np.isnan(self.meas)|np.isnan(self.errs))))
+        self.errs += self.errs==0. # remove bad point in a dirty way
+        _profileAdd('data: flattening', t0)
+        return
+    @property
+    def types(self):
+        """
+        type (e.g. 'v2;ins') of each data point
+        """
+        return np.array(self.typenames)[self.itype]
+    def __len__(self):
+        return len(self.meas)
+
+def _compileFitData(chi2Data, observables, instruments):
+    """
+    returns a _FitData for chi2Data, unless chi2Data already is one. If
+    chi2Data is a string, it is the name of the shared data (see _shareFitData)
+    """
+    if isinstance(chi2Data, _FitData):
+        return chi2Data
+    if isinstance(chi2Data, str):
+        return _attachFitData(chi2Data)
+    return _FitData(chi2Data, observables, instruments)
+
+def _generateFitData(chi2Data, observables, instruments):
     """
     filter only the meaningful observables
     returns:
@@ -883,47 +1399,194 @@ def _generateFitData(chi2Data, observables, instruments):
     - type, flattened
     - wl, flattened
     """
-    _meas, _errs, _wl, _uv, _type = np.array([]), np.array([]), np.array([]), [], []
-    for c in chi2Data:
-        if c[0].split(';')[0] in observables and \
-            c[0].split(';')[1] in instruments:
-            _type.extend([c[0]]*len(c[-2].flatten()))
-            _meas = np.append(_meas, c[-2].flatten())
-            _errs = np.append(_errs, c[-1].flatten())
-            _wl = np.append(_wl, c[-4].flatten())
-
-            if c[0].split(';')[0] == 'v2':
-                _uv = np.append(_uv, np.sqrt(c[1].flatten()**2+c[2].flatten()**2)/c[3].flatten())
-            elif c[0].split(';')[0].startswith('v2_'):
-                _uv = np.append(_uv, np.sqrt(c[1].flatten()**2+c[2].flatten()**2)/c[3][1])
-            elif c[0].split(';')[0] == 't3' or c[0].split(';')[0] == 'cp' or\
-                c[0].split(';')[0] == 'icp' or c[0].split(';')[0] == 'scp' or c[0].split(';')[0] == 'ccp':
-                tmp = np.maximum(np.sqrt(c[1].flatten()**2+c[2].flatten()**2)/c[5].flatten(),
-                                 np.sqrt(c[3].flatten()**2+c[4].flatten()**2)/c[5].flatten())
-                tmp = np.maximum(tmp, np.sqrt((c[1]+c[3]).flatten()**2+(c[2]+c[4]).flatten()**2)/c[5].flatten() )
-                _uv = np.append(_uv, tmp)
-
-    _errs += _errs==0. # remove bad point in a dirty way
-    return _meas, _errs, _uv, np.array(_type), _wl
+    data = _compileFitData(chi2Data, observables, instruments)
+    return data.meas, data.errs, data.uv, data.types, data.wl
+
+def _shareFitData(data):
+    """
+    publish the arrays of the _FitData "data" once in a block of shared memory,
+    with a header describing them. Its name is all the processes of the pool
+    need to rebuild the _FitData without copy (see _attachFitData).
+
+    returns the SharedMemory, to be closed and unlinked by the caller.
+    """
+    t0 = _profileTime()
+    arrays = [data.meas, data.errs, data.wl, data.uv, data.itype, data.iobs]
+    for c in data.obs:
+        arrays.extend(c[1:])
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    # -- position of each array, aligned on 8 bytes
+    offsets, n = [], 0
+    for a in arrays:
+        offsets.append(n)
+        n += 8*int(np.ceil(a.nbytes/8.))
+    header = pickle.dumps({'observables':data.observables,
+                           'instruments':data.instruments,
+                           'typenames':data.typenames,
+                           'ndata':data.ndata,
+                           'names':[c[0] for c in data.obs],
+                           'lengths':[len(c)-1 for c in data.obs],
+                           'arrays':[(o, a.shape, a.dtype.str) for o,a in
+                                     zip(offsets, arrays)]})
+    start = 8*int(np.ceil((8+len(header))/8.))
+    shm = shared_memory.SharedMemory(create=True, size=max(start+n, 1))
+    shm.buf[:8] = np.array([len(header)], dtype='<u8').tobytes()
+    shm.buf[8:8+len(header)] = header
+    for o,a in zip(offsets, arrays):
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf,
+                   offset=start+o)[...] = a
+    _profileAdd('data: shared memory', t0)
+    return shm
+
+# -- shared data attached in this process: name -> (SharedMemory, _FitData)
+_attachedFitData = {}
+
+def _attachFitData(name):
+    """
+    _FitData published under "name" by _shareFitData. Attached once per
+    process, the arrays are read only views on the shared memory.
+    """
+    global _attachedFitData
+    if name in _attachedFitData:
+        return _attachedFitData[name][1]
+    # -- only keep the most recent data
+    for k in list(_attachedFitData.keys()):
+        shm = _attachedFitData.pop(k)[0]
+        try:
+            shm.close()
+        except:
+            pass
+    shm = shared_memory.SharedMemory(name=name)
+    n = int(np.frombuffer(shm.buf[:8], dtype='<u8')[0])
+    header = pickle.loads(bytes(shm.buf[8:8+n]))
+    start = 8*int(np.ceil((8+n)/8.))
+    arrays = []
+    for o, shape, dtype in header['arrays']:
+        a = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start+o)
+        a.flags.writeable = False
+        arrays.append(a)
+    data = _FitData.__new__(_FitData)
+    data.observables = header['observables']
+    data.instruments = header['instruments']
+    data.typenames = header['typenames']
+    data.ndata = header['ndata']
+    data.meas, data.errs, data.wl, data.uv, data.itype, data.iobs = arrays[:6]
+    data.obs, k = [], 6
+    for name_, l in zip(header['names'], header['lengths']):
+        data.obs.append([name_]+arrays[k:k+l])
+        k += l
+    _attachedFitData[name] = (shm, data)
+    return data
+
+def _poolInit(name, config):
+    """
+    initializer of the processes of the pool: same CONFIG as the main process
+    and attach the shared data "name" (see _shareFitData)
+    """
+    global CONFIG
+    CONFIG.update(config)
+    if not name is None:
+        _attachFitData(name)
+    return
+
+def _runChunk(function, args, config=None):
+    """
+    compute function(*a) for each a in "args", in a process of the pool (see
+    Open._map), with the CONFIG "config" of the main process. returns the list
+    of results, the time it took and, if CONFIG['profile'], the counters of the
+    process for this chunk (else None).
+    """
+    global CONFIG
+    if not config is None:
+        CONFIG.update(config)
+    _profileData.clear()
+    N = (_N_modelObservables, _N_fitFunc)
+    t = time.time()
+    res = [function(*a) for a in args]
+    t = time.time()-t
+    if not CONFIG['profile']:
+        return res, t, None
+    _profileData['model evaluations'] = [_N_modelObservables-N[0], 0.0]
+    _profileData['fits'] = [_N_fitFunc-N[1], 0.0]
+    _profileData['pool: computation'] = [len(args), t]
+    return res, t, dict(_profileData)
+
+def _poolSize(Ncores=None):
+    """
+    number of processes used for the computations if CONFIG['Ncores'] is
+    "Ncores" (default: CONFIG['Ncores']; None means all the cores)
+    """
+    if Ncores is None:
+        Ncores = CONFIG['Ncores']
+    if Ncores is None:
+        return max(multiprocessing.cpu_count(), 1)
+    return max(min(multiprocessing.cpu_count(), Ncores), 1)
+
+def _runTimeSamples(Nsmear=None):
+    """
+    number of wavelengths computed per spectral channel by the models if
+    CONFIG['Nsmear'] is "Nsmear" (default: CONFIG['Nsmear']): the cost of the
+    models is about proportional to it. With CONFIG['smearing']=='analytic',
+    the phasors are mostly computed once per channel (see _smearedPhasor).
+    """
+    if Nsmear is None:
+        Nsmear = CONFIG['Nsmear']
+    if CONFIG['smearing']=='analytic':
+        return 1
+    return max(int(Nsmear), 1)
+
+# -- Open instances with processes or shared memory to release when exiting
+_openInstances = weakref.WeakSet()
+def _releaseAtExit():
+    for o in list(_openInstances):
+        o._closePool()
+        o._releaseSharedData()
+    return
+atexit.register(_releaseAtExit)
+
+def _oiGrid(hdu, keys, wavel):
+    """
+    read-only views (no copy) of the columns "keys" of the OIFITS table "hdu"
+    and of the wavelength table "wavel", broadcast on the (row, wavelength)
+    grid of the data. returns [column for k in keys] + [wavelength]
+    """
+    shape = (len(hdu.data), len(wavel))
+    res = [np.broadcast_to(np.asarray(hdu.data[k], dtype=float)[:,None], shape)
+           for k in keys]
+    res.append(np.broadcast_to(np.asarray(wavel, dtype=float)[None,:], shape))
+    return res
+
+def _resolvesStar(observables):
+    """
+    True if the diameter of the star can be fitted to "observables": V2 or T3,
+    including the polynomial fits of V2 (v2_p_n)
+    """
+    return any([o.split('_')[0] in ['v2', 't3'] for o in observables])
 
 _N_fitFunc = 0
-def _fitFunc(param, chi2Data, observables, instruments, fitAlso=[], doNotFit=[]):
+def _fitFunc(param, chi2Data, observables, instruments, fitAlso=[], doNotFit=[],
+             counts=None):
     """
-    fit the data in "chi2data" (only "observables") using starting parameters
+    fit the data in "chi2data" (only "observables") using starting parameters.
+    "chi2Data" can be a list of data blocks or a _FitData.
+
+    counts: for a bootstrap, number of times each data point (flattened, see
+    _FitData) is drawn. The residuals are weighted accordingly (see
+    _bootstrapWeights), the data are not copied.
 
     returns a dpfit dictionnary
     """
     global _N_fitFunc
     # -- extract meaningfull data
-    _meas, _errs, _uv, _types, _wl = _generateFitData(chi2Data, observables,
-                                                    instruments)
+    data = _compileFitData(chi2Data, observables, instruments)
+    observables = data.observables
     # -- guess what needs to be fitted
     fitOnly=[]
 
     if param['f']!=0:
         fitOnly.extend(['x', 'y', 'f'])
 
-    if 'v2' in observables or 't3' in observables:
+    if _resolvesStar(observables):
        for k in ['diam*', 'diamc', 'fres']:
            if k in param.keys():
                fitOnly.append(k)
@@ -936,13 +1599,25 @@ def _fitFunc(param, chi2Data, observables, instruments, fitAlso=[], doNotFit=[])
         if f in fitOnly:
             fitOnly.remove(f)
 
+    # -- analytical derivatives of the model, if possible
+    if CONFIG['analytic jacobian'] and \
+        all([t.split(';')[0] in _jacObservables for t in data.typenames]):
+        jac = _modelObservablesJac
+    else:
+        jac = None
+
+    if counts is None:
+        weights = None
+    else:
+        weights = _bootstrapWeights(data, counts)
+
     # -- does the actual fit
-    res = _dpfit_leastsqFit(_modelObservables,
-                            list(filter(lambda c: c[0].split(';')[0] in observables and
-                                             c[0].split(';')[1] in instruments,
-                                             chi2Data)),
-                            param, _meas, _errs, fitOnly = fitOnly)
+    res = _dpfit_leastsqFit(_modelObservables, data.obs, param, data.meas, data.errs,
+                            fitOnly = fitOnly, jac=jac, weights=weights)
 
+    # -- shared data (see _shareFitData) are not sent back to the main process
+    if isinstance(chi2Data, str):
+        res['x'], res['y'], res['err'] = None, None, None
     # -- _k used in some callbacks
     if '_k' in param.keys():
         res['_k'] = param['_k']
@@ -954,18 +1629,32 @@ def _fitFunc(param, chi2Data, observables, instruments, fitAlso=[], doNotFit=[])
     _N_fitFunc += 1
     return res
 
+def _bootstrapWeights(data, counts):
+    """
+    weights of the residuals of a bootstrapped "data" (_FitData), where
+    "counts" is the number of times each data point is drawn. As in the
+    chi2 the contribution of each point goes as its weight squared, the weights
+    are normalized so that sum(weights**2) is the number of points, in each
+    block of data.obs.
+    """
+    counts = np.asarray(counts, dtype=float)
+    n = np.bincount(data.iobs, minlength=len(data.obs))
+    s = np.bincount(data.iobs, weights=counts**2, minlength=len(data.obs))
+    norm = np.sqrt(n/(s + (s==0)))
+    return counts*norm[data.iobs]
+
 def _chi2Func(param, chi2Data, observables, instruments):
     """
     Returns the chi2r comparing model of parameters "param" and data "chi2Data", only
-    considering "observables" (such as v2, cp, t3)
+    considering "observables" (such as v2, cp, t3). "chi2Data" can be a list of data
+    blocks or a _FitData.
     """
-    _meas, _errs, _uv, _types, _wl = _generateFitData(chi2Data, observables, instruments)
+    data = _compileFitData(chi2Data, observables, instruments)
 
-    res = (_meas-_modelObservables(list(filter(lambda c: c[0].split(';')[0] in observables and
-                                                    c[0].split(';')[1] in instruments, chi2Data)), param))
+    res = data.meas-_modelObservables(data.obs, param)
     res = np.nan_to_num(res) # FLAG == TRUE are nans in the data
     res[np.iscomplex(res)] = np.abs(res[np.iscomplex(res)])
-    res = np.abs(res)**2/_errs**2
+    res = np.abs(res)**2/data.errs**2
     res = np.nanmean(res)
 
     if '_i' in param.keys() and '_j' in param.keys():
@@ -974,15 +1663,148 @@ def _chi2Func(param, chi2Data, observables, instruments):
         #print('test:', res)
         return res
 
+def _fitMapGrid(rmin, rmax, step, beta=1.0, halfPlane=False):
+    """
+    starting points of fitMap: circles between "rmin" and "rmax" (mas), about
+    "step" apart (evenly spaced in radius**(1/beta)), with points about "step"
+    apart on each circle. "halfPlane": only x>=0 (V2 only are symmetric).
+
+    returns the list of (x, y), whether each point is on the coarse grid (for
+    the adaptive mode) and the local step
+    """
+    R = np.linspace(rmin**(1/beta), rmax**(1/beta), int((rmax-rmin)/step+1))**beta
+    XY = []
+    coarse, spacing = [], []
+    for i,r in enumerate(R):
+        n = max(4, int(2*np.pi*r/np.gradient(R)[i]))
+        for j,t in enumerate(np.linspace(0, 2*np.pi, n+1)[:-1]):
+            if not (halfPlane and np.cos(t)<0):
+                # -- exactly 0 on the axes, not ~1e-16: the finite
+                #    differences of leastsq take steps relative to the value
+                x, y = r*np.cos(t), r*np.sin(t)
+                XY.append((0.0 if abs(x)<1e-12*r else x, 0.0 if abs(y)<1e-12*r else y))
+                coarse.append(i%2==0 and j%2==0)
+                spacing.append(np.gradient(R)[i])
+    return XY, coarse, spacing
+
+def _chi2MapBlock(param, X, Y, chi2Data, observables, instruments):
+    """
+    chi2r (see _chi2Func) for a block of companion positions "X", "Y" (in mas),
+    all other parameters taken from "param". The data are flattened once for
+    the whole block. "chi2Data" can be a list of data blocks or a _FitData.
+
+    if param contains '_i' and '_j' (arrays of indices, same length as X and Y),
+    returns (_i, _j, chi2r) else returns chi2r
+    """
+    data = _compileFitData(chi2Data, observables, instruments)
+    res = data.meas[None,:] - _modelObservablesBatch(data.obs, param, X, Y)
+    res = np.nan_to_num(res) # FLAG == TRUE are nans in the data
+    res = np.abs(res)**2/data.errs[None,:]**2
+    res = np.nanmean(res, axis=1)
+    if '_i' in param.keys() and '_j' in param.keys():
+        return param['_i'], param['_j'], res
+    else:
+        return res
+
+def _chi2CubeBlock(param, X, Y, F, chi2Data, observables, instruments):
+    """
+    chi2r (see _chi2Func) for a block of companion positions "X", "Y" (in mas)
+    and each flux ratio in "F" (in %, 1D array), all other parameters taken
+    from "param". The terms which do not depend on the flux ratio are computed
+    once per position (see _FluxModel); other observables are computed one
+    flux ratio at a time (see _chi2MapBlock).
+
+    if param contains '_i' and '_j' (arrays of indices, same length as X and Y),
+    returns (_i, _j, chi2r) else returns chi2r, as an array (position, flux
+    ratio).
+    """
+    data = _compileFitData(chi2Data, observables, instruments)
+    tmp = {k:param[k] for k in param.keys() if not k in ['_i', '_j']}
+    if all([o[0].split(';')[0] in _jacObservables for o in data.obs]):
+        res = _FluxModel(data, tmp, X, Y).chi2(F, data.meas, data.errs)
+    else:
+        res = []
+        for f in F:
+            tmp['f'] = f
+            res.append(_chi2MapBlock(tmp, X, Y, data, data.observables,
+                                     data.instruments))
+        res = np.array(res).T
+    if '_i' in param.keys() and '_j' in param.keys():
+        return param['_i'], param['_j'], res
+    else:
+        return res
+
+def _fitDataHash(data):
+    """
+    sha1 of the measurements, errors and coordinates of a _FitData
+    """
+    h = hashlib.sha1()
+    for a in [data.meas, data.errs, data.uv, data.wl]:
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+def _openChi2Map(directory, X, Y, param):
+    """
+    open (or create) the chi2 map checkpoint in "directory" for the grid "X",
+    "Y" (1D, mas) and parameters "param" (dict). returns the memory-mapped
+    arrays (chi2, done). The content is reset if the grid or the parameters
+    differ from the ones in the directory.
+    """
+    files = [os.path.join(directory, f) for f in ['chi2.npy', 'done.npy', 'param.pkl']]
+    param = dict(param)
+    param['X'], param['Y'] = list(X), list(Y)
+    if all([os.path.exists(f) for f in files]):
+        with open(files[2], 'rb') as f:
+            old = pickle.load(f)
+        if old==param:
+            return (np.lib.format.open_memmap(files[0], mode='r+'),
+                    np.lib.format.open_memmap(files[1], mode='r+'))
+        print(' > WARNING: %s contains another map, starting again'%directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    # -- "done" is created last: the map is valid as soon as it exists
+    for f in files:
+        if os.path.exists(f):
+            os.remove(f)
+    chi2 = np.lib.format.open_memmap(files[0], mode='w+', dtype=np.float64,
+                                     shape=(len(Y), len(X)))
+    with open(files[2], 'wb') as f:
+        pickle.dump(param, f)
+    done = np.lib.format.open_memmap(files[1], mode='w+', dtype=bool,
+                                     shape=(len(Y), len(X)))
+    return chi2, done
+
+def loadChi2Map(directory):
+    """
+    read the chi2 map written by chi2Map(..., checkpoint=directory), possibly
+    while it is being computed. returns a dict with keys 'X', 'Y' (2D, in mas),
+    'chi2' (nan where not yet computed), 'done' (boolean) and the parameters of
+    the map.
+    """
+    with open(os.path.join(directory, 'param.pkl'), 'rb') as f:
+        res = pickle.load(f)
+    done = np.load(os.path.join(directory, 'done.npy'), mmap_mode='r')
+    chi2 = np.load(os.path.join(directory, 'chi2.npy'), mmap_mode='r')
+    # -- mask first: values are written before it
+    res['done'] = np.array(done)
+    res['chi2'] = np.where(res['done'], chi2, np.nan)
+    res['X'], res['Y'] = np.meshgrid(res['X'], res['Y'])
+    return res
+
 def _detectLimit(param, chi2Data, observables, instruments, delta=None, method='injection'):
     """
-    Returns the flux ratio (in %) for which the chi2 ratio between binary and UD is 3 sigmas.
+    Returns the flux ratio (in %) for which the chi2 ratio between binary and UD is 3 sigmas,
+    nan if it is not bracketed after 50 iterations.
 
     Uses the position and diameter given in "Param" and only varies the flux ratio
 
     - method=="Absil", uses chi2_BIN/chi2_UD, assuming chi2_UD is the best model
     - otherwise, uses chi2_UD/chi2_BIN, after injecting a companion
+
+    "chi2Data" can be a list of data blocks or a _FitData.
     """
+    chi2Data = _compileFitData(chi2Data, observables, instruments)
+    observables, instruments = chi2Data.observables, chi2Data.instruments
     fr, nsigma, chi2= [], [], []
     mult = 1.4
     cond = True
@@ -994,8 +1816,7 @@ def _detectLimit(param, chi2Data, observables, instruments, delta=None, method='
         else:
             chi2_0 = _chi2Func(tmp, chi2Data, observables, instruments)
 
-    ndata = np.sum([c[-1].size for c in chi2Data if c[0].split(';')[0] in observables and
-                                                    c[0].split(';')[1] in instruments])
+    ndata = len(chi2Data)
     n = 0
     while cond:
         if method=='Absil':
@@ -1008,14 +1829,14 @@ def _detectLimit(param, chi2Data, observables, instruments, delta=None, method='
 
         elif method=='injection':
             fr.append(param['f'])
-            # -- copy data
-            data = [[x if i==0 else x.copy() for i,x in enumerate(d)]
-                        for d in chi2Data]
+            # -- copy data (only the measurements are modified)
+            data = [d[:-2]+[d[-2].copy(), d[-1]] for d in chi2Data.obs]
             # -- inject companion
-            data = _injectCompanionData(data, delta, param)
+            data = _FitData(_injectCompanionData(data, delta, param),
+                            observables, instruments)
             # -- compare chi2 UD and chi2 Binary
             tmp = {k:(param[k] if k!='f' else 0.0) for k in param.keys()} # -- UD
-            if 'v2' in observables or 't3' in observables:
+            if _resolvesStar(observables):
                 fit = _fitFunc(tmp, data, observables, instruments,
                                doNotFit=list(filter(lambda k: k!='diam*', tmp.keys())))
                 a = fit['chi2']
@@ -1060,10 +1881,332 @@ def _detectLimit(param, chi2Data, observables, instruments, delta=None, method='
     fr, nsigma = np.array(fr), np.array(nsigma)
     fr = fr[np.argsort(nsigma)]
     nsigma = nsigma[np.argsort(nsigma)]
+    if nsigma[0]<3<=nsigma[-1]:
+        res = np.interp(3, nsigma, fr)
+    else:
+        # -- 3 sigma not bracketed
+        res = np.nan
     if '_i' in param.keys() and '_j' in param.keys():
-        return param['_i'], param['_j'], np.interp(3, nsigma, fr)
+        return param['_i'], param['_j'], res
     else:
-        return np.interp(3, nsigma, fr)
+        return res
+
+def _detectLimitBlock(param, X, Y, chi2Data, observables, instruments, method='injection'):
+    """
+    same as _detectLimit, for a block of positions "X", "Y" (1D arrays, in mas),
+    all other parameters taken from "param".
+
+    nsigma is computed for all the positions and a grid of flux ratios (0.001%
+    to 100%) at once, then on a finer grid around 3 sigma: the model is linear
+    in the flux ratio (see _FluxModel), so the companion phasors are
+    computed only once per position. The result is nan if 3 sigma is not
+    reached between 0.001% and 100%. For 'injection', the UD refit of the data
+    with the injected companion is linearized around param['diam*'].
+
+    Falls back on _detectLimit for each position for other observables, or
+    for 'injection' with an unresolved primary (diam*=0).
+
+    if param contains '_i' and '_j' (arrays), returns (_i, _j, f3) else f3
+    """
+    data = _compileFitData(chi2Data, observables, instruments)
+    X, Y = np.atleast_1d(X), np.atleast_1d(Y)
+    tmp = {k:param[k] for k in param.keys() if not k in ['_i', '_j']}
+    # -- UD fit on the injected data (see _detectLimit)
+    fit = method=='injection' and ('v2' in data.observables or 't3' in data.observables)
+    if not all([o[0].split(';')[0] in _jacObservables for o in data.obs]) or \
+            (fit and param['diam*']==0):
+        res = []
+        for x,y in zip(X, Y):
+            tmp['x'], tmp['y'] = x, y
+            res.append(_detectLimit(dict(tmp), data, data.observables,
+                                    data.instruments, method=method))
+        res = np.array(res)
+    else:
+        ndata = len(data)
+        w = 1/data.errs**2
+        tmp['x'], tmp['y'] = 0.0, 0.0
+        ud = dict(tmp); ud['f'] = 0.0
+        Mud = _modelObservables(data.obs, ud)
+        r0 = data.meas - Mud
+        chi2_0 = np.nanmean(np.nan_to_num(r0)**2*w)
+        if fit:
+            # -- derivative of the UD model with respect to the diameter
+            h = 1e-3*param['diam*']
+            ud['diam*'] = param['diam*']+h
+            J = (_modelObservables(data.obs, ud)-Mud)/h
+            J[~np.isfinite(data.meas)] = 0.0
+            wJ = np.nan_to_num(w)*J
+        model = _FluxModel(data, tmp, X, Y)
+        def _nsigma(F):
+            # -- F: (position, flux ratio)
+            if method=='Absil':
+                return _nSigmas(model.chi2(F, data.meas, data.errs), chi2_0, ndata)
+            res = np.zeros(F.shape)
+            for k in range(F.shape[1]):
+                # -- residuals of the UD model on the injected data
+                R = np.nan_to_num(r0 + model.observables(F[:,k:k+1])[:,0,:] - Mud)
+                if fit:
+                    R -= J[None,:]*(np.sum(wJ*R, axis=1)/np.sum(wJ*J))[:,None]
+                res[:,k] = _nSigmas(np.nanmean(R**2*w, axis=1), chi2_0, ndata)
+            return res
+        # -- coarse grid, then finer between the bracketing flux ratios
+        F = np.logspace(-3, 2, 26)[None,:]*np.ones(len(X))[:,None]
+        for k in range(2):
+            ns = _nsigma(F)
+            up = ns>=3
+            i = np.clip(np.argmax(up, axis=1), 1, F.shape[1]-1)
+            i[~up.any(axis=1)] = F.shape[1]-1
+            Fa, Fb = F[np.arange(len(X)), i-1], F[np.arange(len(X)), i]
+            if k==0:
+                F = Fa[:,None]*(Fb/Fa)[:,None]**np.linspace(0, 1, 9)[None,:]
+        na, nb = ns[np.arange(len(X)), i-1], ns[np.arange(len(X)), i]
+        # -- interpolation in log(f)
+        c = np.clip((3-na)/(nb-na+(nb==na)), 0, 1)
+        res = Fa*(Fb/Fa)**c
+        # -- 3 sigma not bracketed by the grid of flux ratios
+        res[(na>=3)|(nb<3)] = np.nan
+    if '_i' in param.keys() and '_j' in param.keys():
+        return param['_i'], param['_j'], res
+    else:
+        return res
+
+# -- version of the format of the cached data (see Open._saveCache)
+_cacheFormat = 1
+
+def _oifitsCacheKey(filenames, options):
+    """
+    key of the cached data for the OIFITS files "filenames" (list), read with
+    "options" (dict): sha1 of the content of the files and the options
+    """
+    h = hashlib.sha1()
+    h.update(repr((_cacheFormat, sorted(options.items()))).encode())
+    for f in filenames:
+        with open(f, 'rb') as fh:
+            for b in iter(lambda: fh.read(2**20), b''):
+                h.update(b)
+    return h.hexdigest()
+
+def _compactArray(a):
+    """
+    returns the smallest array which can be broadcast to "a", and the shape of
+    "a" (coordinates are often broadcast along the wavelength axis)
+    """
+    s = tuple(slice(0,1) if st==0 else slice(None) for st in a.strides)
+    return np.ascontiguousarray(a[s]), a.shape
+
+class _OifitsFile:
+    """
+    content of a single OIFITS file, read independently of any Open instance
+    so that several files can be read at the same time (see
+    Open._loadOifitsFiles). The attributes have the same meaning as in Open.
+    Messages are kept in "log", to be printed in order.
+    """
+    def __init__(self, filename, reducePoly=None, largeCP=False, wlOffset=0.0,
+                 v2bias=1., instruments=None):
+        self.filename = filename
+        self.wlOffset = wlOffset
+        self.v2bias = v2bias
+        self.loadOnlyInstruments = instruments
+        self.wavel, self.dwavel, self.all_dwavel, self.wavel_3m = {}, {}, {}, {}
+        self.telArray = {}
+        self._rawData = []
+        self.smearFov = 5e3 # bandwidth smearing FoV, in mas
+        self.diffFov = 5e3 # diffraction FoV, in mas
+        self.minSpatialScale = 5e3
+        self.log = []
+        t = time.time()
+        self._read(filename, reducePoly=reducePoly, largeCP=largeCP)
+        self.time = time.time()-t
+        return
+    def _print(self, *args):
+        self.log.append(' '.join([str(a) for a in args]))
+        return
+    def _read(self, filename, reducePoly=None, largeCP=False):
+        """
+        Note that CP are stored in radians, not degrees like in the OIFITS!
+
+        reducePoly: reduce data by poly fit of order "reducePoly" on as a
+        function wavelength
+
+        largeCP: set to true if CP goes substantially off 0.0
+        """
+        self._fitsHandler = fits.open(filename)
+        self._dataheader={}
+        for k in ['X','Y','F']:
+            try:
+                self._dataheader[k] = self._fitsHandler[0].header['INJCOMP'+k]
+            except:
+                pass
+        if self.loadOnlyInstruments is None:
+            testInst = lambda h: True
+        else:
+            testInst = lambda h: h.header['INSNAME'] in self.loadOnlyInstruments
+
+        # -- load Wavelength and Array: ----------------------------------------------
+        for hdu in self._fitsHandler[1:]:
+            if hdu.header['EXTNAME']=='OI_WAVELENGTH' and testInst(hdu):
+                self.wavel[hdu.header['INSNAME']] = self.wlOffset + hdu.data['EFF_WAVE']*1e6 # in um
+                self.wavel_3m[hdu.header['INSNAME']] = (self.wlOffset + self.wavel[hdu.header['INSNAME']].min(),
+                                                        self.wlOffset + self.wavel[hdu.header['INSNAME']].mean(),
+                                                        self.wlOffset + self.wavel[hdu.header['INSNAME']].max())
+                self.all_dwavel[hdu.header['INSNAME']] = hdu.data['EFF_BAND']*1e6
+                self.dwavel[hdu.header['INSNAME']] = \
+                        np.mean(self.all_dwavel[hdu.header['INSNAME']])
+                if type(hdu.data['EFF_WAVE'])==np.ndarray and len(hdu.data['EFF_WAVE'])>1:
+                    self._print(' | EFF_BAND/gradient(EFF_WAVE)', hdu.header['INSNAME'], '~',
+                        '%.3f'%np.mean(hdu.data['EFF_BAND']/np.gradient(hdu.data['EFF_WAVE'])))
+                else:
+                    # -- nothing to do
+                    pass
+            if hdu.header['EXTNAME']=='OI_ARRAY':
+                name = hdu.header['ARRNAME']
+                diam = hdu.data['DIAMETER'].mean()
+                if diam==0:
+                    if 'VLTI' in name:
+                        if 'AT' in hdu.data['TEL_NAME'][0]:
+                            diam = 1.8
+                        if 'UT' in hdu.data['TEL_NAME'][0]:
+                            diam = 8.2
+                self.telArray[name] = diam
+
+        # -- load all data:
+        maxRes = 0.0 # -- in Mlambda
+        #amberWLmin, amberWLmax = 1.8, 2.4 # -- K
+        #amberWLmin, amberWLmax = 1.3, 1.8 # -- H
+        #amberWLmin, amberWLmax = 1.0, 1.3 # -- J
+        #amberWLmin, amberWLmax = 1.0, 1.8 # -- J+H
+        amberWLmin, amberWLmax = 1.4, 2.5 # -- H+K
+        #amberWLmin, amberWLmax = 1.0, 2.5 # -- J+H+K
+
+        amberAtmBand = [1.0, 1.35, 1.9]
+        for hdu in self._fitsHandler[1:]:
+            if hdu.header['EXTNAME'] in ['OI_T3', 'OI_VIS2'] and testInst(hdu):
+                ins = hdu.header['INSNAME']
+                arr = hdu.header['ARRNAME']
+
+            if hdu.header['EXTNAME']=='OI_T3' and testInst(hdu):
+                # -- coordinates, shared by all the blocks of this HDU
+                coord = _oiGrid(hdu, ['U1COORD', 'V1COORD', 'U2COORD', 'V2COORD'],
+                                self.wavel[ins])
+                coord.insert(5, _oiGrid(hdu, ['MJD'], self.wavel[ins])[0])
+                shape = coord[0].shape
+                wl = coord[4]
+                flag = np.reshape(hdu.data['FLAG'], shape)
+                # -- CP
+                data = np.reshape(hdu.data['T3PHI']*np.pi/180, shape)
+                data[flag] = np.nan # we'll deal with that later...
+                data[np.reshape(hdu.data['T3PHIERR'], shape)>1e8] = np.nan # we'll deal with that later...
+                err = np.reshape(hdu.data['T3PHIERR']*np.pi/180, shape)
+                if 'AMBER' in ins:
+                    self._print(' | !!AMBER: rejecting CP WL<%3.1fum'%amberWLmin)
+                    self._print(' | !!AMBER: rejecting CP WL>%3.1fum'%amberWLmax)
+                    data[wl<amberWLmin] = np.nan
+                    data[wl>amberWLmax] = np.nan
+                    for b in amberAtmBand:
+                        data[np.abs(wl-b)<0.05] = np.nan
+
+                if not reducePoly is None:
+                    p, ep = _decomposeObsBatch(self.wavel[ins], data, err, reducePoly)
+                    # -- each order:
+                    for j in range(reducePoly+1):
+                        self._rawData.append(['cp_%d_%d;'%(j,reducePoly)+ins,
+                          hdu.data['U1COORD'],
+                          hdu.data['V1COORD'],
+                          hdu.data['U2COORD'],
+                          hdu.data['V2COORD'],
+                          self.wavel_3m[ins],
+                          hdu.data['MJD'],
+                          p[:,j], ep[:,j]])
+
+                if np.sum(np.isnan(data))<data.size:
+                    if not largeCP:
+                        self._rawData.append(['cp;'+ins]+coord+[data, err])
+                    else:
+                        # -- complex closure phase: t3 normalized, i.e exp(i*CP)
+                        # self._rawData.append(['icp;'+ins]+coord+[np.exp(1j*data), err])
+                        # -- cos(CP) and sin(CP)
+                        self._rawData.append(['ccp;'+ins]+coord+
+                            [np.cos(data), err/np.sqrt(2),
+                            #np.abs(np.sin(data))*err
+                            ])
+                        self._rawData.append(['scp;'+ins]+coord+
+                            [np.sin(data), err/np.sqrt(2),
+                            #np.abs(np.cos(data))*err
+                            ])
+                else:
+                    self._print(' > WARNING: no valid T3PHI values in this HDU')
+                # -- T3
+                data = np.reshape(hdu.data['T3AMP']/np.sqrt(self.v2bias)**3, shape)
+                data[flag] = np.nan # we'll deal with that later...
+                data[np.reshape(hdu.data['T3AMPERR'], shape)>1e8] = np.nan # we'll deal with that later...
+                err = np.reshape(hdu.data['T3AMPERR'], shape)
+                if 'AMBER' in ins:
+                    self._print(' | !!AMBER: rejecting T3 WL<%3.1fum'%amberWLmin)
+                    self._print(' | !!AMBER: rejecting T3 WL>%3.1fum'%amberWLmax)
+                    data[wl<amberWLmin] = np.nan
+                    data[wl>amberWLmax] = np.nan
+
+                    for b in amberAtmBand:
+                        data[np.abs(wl-b)<0.1] = np.nan
+
+                if np.sum(np.isnan(data))<data.size:
+                    self._rawData.append(['t3;'+ins]+coord+[data, err])
+                else:
+                    self._print(' > WARNING: no valid T3AMP values in this HDU')
+                Bmax = (hdu.data['U1COORD']**2+hdu.data['V1COORD']**2).max()
+                Bmax = max(Bmax, (hdu.data['U2COORD']**2+hdu.data['V2COORD']**2).max())
+                Bmax = max(Bmax, ((hdu.data['U1COORD']+hdu.data['U2COORD'])**2
+                                   +(hdu.data['V1COORD']+hdu.data['V2COORD'])**2).max())
+                Bmax = np.sqrt(Bmax)
+                maxRes = max(maxRes, Bmax/self.wavel[ins].min())
+                self.smearFov = min(self.smearFov, self.wavel[ins].min()**2/self.dwavel[ins]/Bmax*180*3.6/np.pi)
+                self.diffFov = min(self.diffFov, self.wavel[ins].min()/self.telArray[arr]*180*3.6/np.pi)
+
+            if hdu.header['EXTNAME']=='OI_VIS2' and testInst(hdu):
+                # -- coordinates
+                coord = _oiGrid(hdu, ['UCOORD', 'VCOORD', 'MJD'], self.wavel[ins])
+                coord.insert(2, coord.pop())
+                shape = coord[0].shape
+                wl = coord[2]
+                data = np.reshape(hdu.data['VIS2DATA']/self.v2bias, shape)
+                err = np.reshape(hdu.data['VIS2ERR'], shape)
+                data[np.reshape(hdu.data['FLAG'], shape)] = np.nan # we'll deal with that later...
+
+                if 'AMBER' in ins:
+                    self._print(' | !!AMBER: rejecting V2 WL<%3.1fum'%amberWLmin)
+                    self._print(' | !!AMBER: rejecting V2 WL>%3.1fum'%amberWLmax)
+                    data[wl<amberWLmin] = np.nan
+                    data[wl>amberWLmax] = np.nan
+                    data[data<-3*err] = np.nan
+                    self._print(' | !!AMBER: rejecting bad V2 (<<0 or err too large):',
+                                np.sum(err>np.abs(data)))
+                    data[err>0.5*np.abs(data)] = np.nan
+                    for b in amberAtmBand:
+                        data[np.abs(wl-b)<0.1] = np.nan
+                if not reducePoly is None:
+                    p, ep = _decomposeObsBatch(self.wavel[ins], data, err, reducePoly)
+                    # -- each order:
+                    for j in range(reducePoly+1):
+                        self._rawData.append(['v2_%d_%d;'%(j,reducePoly)+ins,
+                          hdu.data['UCOORD'],
+                          hdu.data['VCOORD'],
+                          self.wavel_3m[ins],
+                          hdu.data['MJD'],
+                          p[:,j], ep[:,j]])
+
+                #print('KLUDGE on V2 err') ???
+                self._rawData.append(['v2;'+ins]+coord+[data, err])
+
+                Bmax = (hdu.data['UCOORD']**2+hdu.data['VCOORD']**2).max()
+                Bmax = np.sqrt(Bmax)
+                maxRes = max(maxRes, Bmax/self.wavel[ins].min())
+                self.smearFov = min(self.smearFov, self.wavel[ins].min()**2/self.dwavel[ins]/Bmax*180*3.6/np.pi)
+                self.diffFov = min(self.diffFov, self.wavel[ins].min()/self.telArray[arr]*180*3.6/np.pi)
+
+        self.minSpatialScale = min(1e-6/maxRes*180*3600*1000/np.pi, self.minSpatialScale)
+        self._fitsHandler.close()
+        return
+
 
 # == The main class
 class Open:
@@ -1084,13 +2227,7 @@ class Open:
         self.v2bias = v2bias
         self.loadOnlyInstruments = instruments
         if isinstance(filename, list):
-            self._initOiData()
-            for i,f in enumerate(filename):
-                print(' | file %d/%d: %s'%(i+1, len(filename), f))
-                #try:
-                self._loadOifitsData(f, reducePoly=reducePoly, largeCP=largeCP)
-                #except:
-                #    print('   -> ERROR! could not read', f)
+            files = filename
             self.filename = filename
             if len(filename)<=1:
                 self.titleFilename = '\n'.join([os.path.basename(f) for f in filename])
@@ -1099,25 +2236,34 @@ class Open:
         elif os.path.isdir(filename):
             print(' | loading FITS files in ', filename)
             files = os.listdir(filename)
-            files = list(filter(lambda x: ('.fit' in x.lower()) or ('.oifits' in x.lower()), files))
-            self._initOiData()
-            for i,f in enumerate(files):
-                print(' | file %d/%d: %s'%(i+1, len(files), f))
-                try:
-                    self._loadOifitsData(os.path.join(filename, f), reducePoly=reducePoly, largeCP=largeCP)
-                except:
-                    print('   -> ERROR! could not read', os.path.join(filename, f))
+            files = sorted(filter(lambda x: ('.fit' in x.lower()) or ('.oifits' in x.lower()), files))
+            files = [os.path.join(filename, f) for f in files]
             self.filename = filename
             self.titleFilename = filename
-        elif os.path.exists(filename):
+        else:
             print(' | loading file', filename)
+            files = [filename]
             self.filename = filename
             self.titleFilename = os.path.basename(filename)
-            self._initOiData()
-            self._loadOifitsData(filename, reducePoly=reducePoly, largeCP=largeCP)
 
-        print(' | compute aux data for companion injection')
-        self._compute_delta()
+        self._initOiData()
+        cache = None
+        if not CONFIG['cache'] is None:
+            cache = os.path.join(CONFIG['cache'], _oifitsCacheKey(files,
+                        {'reducePoly':reducePoly, 'largeCP':largeCP,
+                         'wlOffset':wlOffset, 'v2bias':v2bias,
+                         'instruments':instruments}))
+        if not cache is None and os.path.exists(os.path.join(cache, 'index.pkl')):
+            print(' | cached data:', cache)
+            self._loadCache(cache)
+        else:
+            self._loadOifitsFiles(files, reducePoly=reducePoly, largeCP=largeCP,
+                                  skipErrors=not isinstance(filename, list) and
+                                             os.path.isdir(filename))
+            print(' | compute aux data for companion injection')
+            self._compute_delta()
+            if not cache is None:
+                self._saveCache(cache)
         #self.estimateCorrSpecChannels()
 
         # -- all MJDs in the files:
@@ -1139,6 +2285,15 @@ class Open:
         print(', '.join(["'"+o+"'" for o in self.instruments])+']')
 
         self._chi2Data = self._copyRawData()
+        # -- _fitData() in shared memory, for the pool (see _sharedData)
+        self._shared = None
+        # -- pool of processes, kept from one analysis to the next (see _pool)
+        self._poolCache = None
+        # -- see CONFIG['profile']
+        self._profiling = False
+        self.last_profile = None
+        # -- cost models of the analyses, see _probeRunTime
+        self._runTimeModel = {}
 
         self.rmin = rmin
         if self.rmin is None:
@@ -1178,9 +2333,8 @@ class Open:
                 self.diam = 0.0
 
         if forcedDiam is None and \
-            ('v2' in self.observables or 't3' in self.observables) and\
-            ('v2' in [c[0].split(';')[0] for c in self._chi2Data] or
-             't3' in [c[0].split(';')[0] for c in self._chi2Data]):
+            _resolvesStar(self.observables) and\
+            _resolvesStar([c[0].split(';')[0] for c in self._chi2Data]):
             tmp = {'x':0.0, 'y':0.0, 'f':0.0, 'diam*':guess, 'alpha*':self.alpha}
             if self.alpha>0:
                 print(' | LD diam Fit')
@@ -1189,7 +2343,7 @@ class Open:
 
             for _k in self.dwavel.keys():
                 tmp['dwavel;'+_k] = self.dwavel[_k]
-            fit_0 = _fitFunc(tmp, self._chi2Data, self.observables,
+            fit_0 = _fitFunc(tmp, self._fitData(), self.observables,
                                 self.instruments, fitAlso=fitAlso)
             self.chi2_UD = fit_0['chi2']
             print(' | best fit diameter: %5.3f +- %5.3f mas'%(fit_0['best']['diam*'],
@@ -1212,7 +2366,7 @@ class Open:
             for _k in self.dwavel.keys():
                 tmp['dwavel;'+_k] = self.dwavel[_k]
             #fit_0 = _fitFunc(tmp, self._chi2Data, self.observables)
-            self.chi2_UD = _chi2Func(tmp, self._chi2Data, self.observables,
+            self.chi2_UD = _chi2Func(tmp, self._fitData(), self.observables,
                                         self.instruments)
             self.ediam = np.nan
             print(' |  chi2 = %4.3f'%self.chi2_UD)
@@ -1234,12 +2388,88 @@ class Open:
         self.diffFov = 5e3 # diffraction FoV, in mas
         self.minSpatialScale = 5e3
         self._delta = []
+        self._fitsHandler, self._dataheader = None, {}
         return
+    def _saveCache(self, directory):
+        """
+        save the data read from the OIFITS files (_rawData, _delta, wavelength
+        tables and fields of view) in "directory", which is created. The arrays
+        are stored as .npy files, so they can be memory-mapped (see _loadCache).
+        """
+        index = {k:getattr(self, k) for k in ['wavel', 'dwavel', 'all_dwavel',
+                    'wavel_3m', 'telArray', 'smearFov', 'diffFov',
+                    'minSpatialScale', '_dataheader']}
+        tmp = directory+'.tmp%d'%os.getpid()
+        os.makedirs(tmp)
+        arrays = []
+        def _store(x):
+            # -- arrays are replaced by ('array', index in arrays, shape)
+            if isinstance(x, np.ndarray):
+                a, shape = _compactArray(x)
+                arrays.append(a)
+                return ('array', len(arrays)-1, shape)
+            return x
+        index['_rawData'] = [[d[0]]+[_store(x) for x in d[1:]] for d in self._rawData]
+        index['_delta'] = [None if d is None else tuple(_store(x) for x in d)
+                           for d in self._delta]
+        for i,a in enumerate(arrays):
+            np.save(os.path.join(tmp, '%d.npy'%i), a)
+        with open(os.path.join(tmp, 'index.pkl'), 'wb') as f:
+            pickle.dump(index, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # -- saved in the meantime by another session
+            shutil.rmtree(tmp, ignore_errors=True)
+        return
+    def _loadCache(self, directory):
+        """
+        load the data saved by _saveCache in "directory". The arrays are
+        memory-mapped, read only.
+        """
+        with open(os.path.join(directory, 'index.pkl'), 'rb') as f:
+            index = pickle.load(f)
+        def _load(x):
+            if isinstance(x, tuple) and len(x)==3 and x[0]=='array':
+                a = np.load(os.path.join(directory, '%d.npy'%x[1]), mmap_mode='r')
+                return np.broadcast_to(a.view(np.ndarray), x[2])
+            return x
+        self._rawData = [[d[0]]+[_load(x) for x in d[1:]] for d in index.pop('_rawData')]
+        self._delta = [None if d is None else tuple(_load(x) for x in d)
+                       for d in index.pop('_delta')]
+        for k in index:
+            setattr(self, k, index[k])
+        return
+    @property
+    def _chi2Data(self):
+        """
+        data used in the analysis (list of blocks, same structure as _rawData)
+        """
+        return self.__chi2Data
+    @_chi2Data.setter
+    def _chi2Data(self, data):
+        self.__chi2Data = data
+        # -- compiled data (see _fitData) are out of date
+        self._fitDataCache = None
+    def _fitData(self):
+        """
+        compiled version (_FitData) of _chi2Data for the current observables and
+        instruments. It is only rebuilt if one of them changed.
+        """
+        key = (tuple(self.observables), tuple(self.instruments))
+        if self._fitDataCache is None or self._fitDataCache[0]!=key:
+            self._fitDataCache = (key, _FitData(self._chi2Data, self.observables,
+                                                self.instruments))
+        return self._fitDataCache[1]
     def _copyRawData(self):
         """
-        create a copy of the raw data
+        create a copy of the raw data. Only the data and errors are copied: the
+        coordinates (u, v, wavel, MJD) are read-only views, shared with _rawData
         """
-        return [[x if i==0 else x.copy() for i,x in enumerate(d)] for d in self._rawData]
+        t0 = _profileTime()
+        res = [d[:-2]+[d[-2].copy(), d[-1].copy()] for d in self._rawData]
+        _profileAdd('data: copy', t0)
+        return res
 
     def _loadOifitsData(self, filename, reducePoly=None, largeCP=False):
         """
@@ -1250,247 +2480,54 @@ class Open:
 
         largeCP: set to true if CP goes substantially off 0.0
         """
-        self._fitsHandler = fits.open(filename)
-        self._dataheader={}
-        for k in ['X','Y','F']:
+        self._loadOifitsFiles([filename], reducePoly=reducePoly, largeCP=largeCP)
+        return
+    def _loadOifitsFiles(self, filenames, reducePoly=None, largeCP=False,
+                         skipErrors=False):
+        """
+        read the OIFITS files "filenames" (see _OifitsFile), at the same time
+        in several threads, and merge them in order. If "skipErrors", files
+        which cannot be read are reported and ignored.
+        """
+        def _read(f):
             try:
-                self._dataheader[k] = self._fitsHandler[0].header['INJCOMP'+k]
-            except:
-                pass
-        if self.loadOnlyInstruments is None:
-            testInst = lambda h: True
+                return _OifitsFile(f, reducePoly=reducePoly, largeCP=largeCP,
+                                   wlOffset=self.wlOffset, v2bias=self.v2bias,
+                                   instruments=self.loadOnlyInstruments)
+            except Exception as e:
+                if not skipErrors:
+                    raise
+                return e
+        Nthreads = min(_poolSize(), len(filenames))
+        if Nthreads>1:
+            with concurrent.futures.ThreadPoolExecutor(Nthreads) as executor:
+                files = list(executor.map(_read, filenames))
         else:
-            testInst = lambda h: h.header['INSNAME'] in self.loadOnlyInstruments
-
-        # -- load Wavelength and Array: ----------------------------------------------
-        for hdu in self._fitsHandler[1:]:
-            if hdu.header['EXTNAME']=='OI_WAVELENGTH' and testInst(hdu):
-                self.wavel[hdu.header['INSNAME']] = self.wlOffset + hdu.data['EFF_WAVE']*1e6 # in um
-                self.wavel_3m[hdu.header['INSNAME']] = (self.wlOffset + self.wavel[hdu.header['INSNAME']].min(),
-                                                        self.wlOffset + self.wavel[hdu.header['INSNAME']].mean(),
-                                                        self.wlOffset + self.wavel[hdu.header['INSNAME']].max())
-                self.all_dwavel[hdu.header['INSNAME']] = hdu.data['EFF_BAND']*1e6
-                self.dwavel[hdu.header['INSNAME']] = \
-                        np.mean(self.all_dwavel[hdu.header['INSNAME']])
-                if type(hdu.data['EFF_WAVE'])==np.ndarray and len(hdu.data['EFF_WAVE'])>1:
-                    print(' | EFF_BAND/gradient(EFF_WAVE)', hdu.header['INSNAME'], '~',
-                        '%.3f'%np.mean(hdu.data['EFF_BAND']/np.gradient(hdu.data['EFF_WAVE'])))
-                else:
-                    # -- nothing to do
-                    pass
-            if hdu.header['EXTNAME']=='OI_ARRAY':
-                name = hdu.header['ARRNAME']
-                diam = hdu.data['DIAMETER'].mean()
-                if diam==0:
-                    if 'VLTI' in name:
-                        if 'AT' in hdu.data['TEL_NAME'][0]:
-                            diam = 1.8
-                        if 'UT' in hdu.data['TEL_NAME'][0]:
-                            diam = 8.2
-                self.telArray[name] = diam
-
-        # -- load all data:
-        maxRes = 0.0 # -- in Mlambda
-        #amberWLmin, amberWLmax = 1.8, 2.4 # -- K
-        #amberWLmin, amberWLmax = 1.3, 1.8 # -- H
-        #amberWLmin, amberWLmax = 1.0, 1.3 # -- J
-        #amberWLmin, amberWLmax = 1.0, 1.8 # -- J+H
-        amberWLmin, amberWLmax = 1.4, 2.5 # -- H+K
-        #amberWLmin, amberWLmax = 1.0, 2.5 # -- J+H+K
-
-        amberAtmBand = [1.0, 1.35, 1.9]
-        for hdu in self._fitsHandler[1:]:
-            if hdu.header['EXTNAME'] in ['OI_T3', 'OI_VIS2'] and testInst(hdu):
-                ins = hdu.header['INSNAME']
-                arr = hdu.header['ARRNAME']
-
-            if hdu.header['EXTNAME']=='OI_T3' and testInst(hdu):
-                # -- CP
-                data = hdu.data['T3PHI']*np.pi/180
-                data[hdu.data['FLAG']] = np.nan # we'll deal with that later...
-                data[hdu.data['T3PHIERR']>1e8] = np.nan # we'll deal with that later...
-                if len(data.shape)==1:
-                    data = np.array([np.array([d]) for d in data])
-                err = hdu.data['T3PHIERR']*np.pi/180
-                if len(err.shape)==1:
-                    err = np.array([np.array([e]) for e in err])
-                if 'AMBER' in ins:
-                    print(' | !!AMBER: rejecting CP WL<%3.1fum'%amberWLmin)
-                    print(' | !!AMBER: rejecting CP WL>%3.1fum'%amberWLmax)
-                    wl = hdu.data['MJD'][:,None]*0+self.wavel[ins][None,:]
-                    data[wl<amberWLmin] = np.nan
-                    data[wl>amberWLmax] = np.nan
-                    for b in amberAtmBand:
-                        data[np.abs(wl-b)<0.05] = np.nan
-
-                if not reducePoly is None:
-                    p = []
-                    ep = []
-                    for i in range(len(data)):
-                        if all(np.isnan(data[i])) or all(np.isnan(err[i])):
-                            tmp = {'A'+str(j):np.nan for j in range(reducePoly+1)},\
-                                {'A'+str(j):np.nan for j in range(reducePoly+1)}
-                        else:
-                            tmp = _decomposeObs(self.wavel[ins], data[i], err[i], reducePoly)
-                        p.append(tmp[0])
-                        ep.append(tmp[1])
-                    # -- each order:
-                    for j in range(reducePoly+1):
-                        self._rawData.append(['cp_%d_%d;'%(j,reducePoly)+ins,
-                          hdu.data['U1COORD'],
-                          hdu.data['V1COORD'],
-                          hdu.data['U2COORD'],
-                          hdu.data['V2COORD'],
-                          self.wavel_3m[ins],
-                          hdu.data['MJD'],
-                          np.array([x['A'+str(j)] for x in p]),
-                          np.array([x['A'+str(j)] for x in ep])])
-
-                if np.sum(np.isnan(data))<data.size:
-                    if not largeCP:
-                        self._rawData.append(['cp;'+ins,
-                              hdu.data['U1COORD'][:,None]+0*self.wavel[ins][None,:],
-                              hdu.data['V1COORD'][:,None]+0*self.wavel[ins][None,:],
-                              hdu.data['U2COORD'][:,None]+0*self.wavel[ins][None,:],
-                              hdu.data['V2COORD'][:,None]+0*self.wavel[ins][None,:],
-                              self.wavel[ins][None,:]+0*hdu.data['V1COORD'][:,None],
-                              hdu.data['MJD'][:,None]+0*self.wavel[ins][None,:],
-                              data, err])
-                    else:
-                        # -- complex closure phase: t3 normalized, i.e exp(i*CP)
-                        # self._rawData.append(['icp;'+ins,
-                        #     hdu.data['U1COORD'][:,None]+0*self.wavel[ins][None,:],
-                        #     hdu.data['V1COORD'][:,None]+0*self.wavel[ins][None,:],
-                        #     hdu.data['U2COORD'][:,None]+0*self.wavel[ins][None,:],
-                        #     hdu.data['V2COORD'][:,None]+0*self.wavel[ins][None,:],
-                        #     self.wavel[ins][None,:]+0*hdu.data['V1COORD'][:,None],
-                        #     hdu.data['MJD'][:,None]+0*self.wavel[ins][None,:],
-                        #     np.exp(1j*data), err])
-                        # -- cos(CP) and sin(CP)
-                        self._rawData.append(['ccp;'+ins,
-                            hdu.data['U1COORD'][:,None]+0*self.wavel[ins][None,:],
-                            hdu.data['V1COORD'][:,None]+0*self.wavel[ins][None,:],
-                            hdu.data['U2COORD'][:,None]+0*self.wavel[ins][None,:],
-                            hdu.data['V2COORD'][:,None]+0*self.wavel[ins][None,:],
-                            self.wavel[ins][None,:]+0*hdu.data['V1COORD'][:,None],
-                            hdu.data['MJD'][:,None]+0*self.wavel[ins][None,:],
-                            np.cos(data), err/np.sqrt(2),
-                            #np.abs(np.sin(data))*err
-                            ])
-                        self._rawData.append(['scp;'+ins,
-                            hdu.data['U1COORD'][:,None]+0*self.wavel[ins][None,:],
-                            hdu.data['V1COORD'][:,None]+0*self.wavel[ins][None,:],
-                            hdu.data['U2COORD'][:,None]+0*self.wavel[ins][None,:],
-                            hdu.data['V2COORD'][:,None]+0*self.wavel[ins][None,:],
-                            self.wavel[ins][None,:]+0*hdu.data['V1COORD'][:,None],
-                            hdu.data['MJD'][:,None]+0*self.wavel[ins][None,:],
-                            np.sin(data), err/np.sqrt(2),
-                            #np.abs(np.cos(data))*err
-                            ])
-                else:
-                    print(' > WARNING: no valid T3PHI values in this HDU')
-                # -- T3
-                data = hdu.data['T3AMP']
-                data /= np.sqrt(self.v2bias)**3
-                data[hdu.data['FLAG']] = np.nan # we'll deal with that later...
-                data[hdu.data['T3AMPERR']>1e8] = np.nan # we'll deal with that later...
-                if len(data.shape)==1:
-                    data = np.array([np.array([d]) for d in data])
-                err = hdu.data['T3AMPERR']
-                if len(err.shape)==1:
-                    err = np.array([np.array([e]) for e in err])
-                if 'AMBER' in ins:
-                    print(' | !!AMBER: rejecting T3 WL<%3.1fum'%amberWLmin)
-                    print(' | !!AMBER: rejecting T3 WL>%3.1fum'%amberWLmax)
-                    wl = hdu.data['MJD'][:,None]*0+self.wavel[ins][None,:]
-                    data[wl<amberWLmin] = np.nan
-                    data[wl>amberWLmax] = np.nan
-
-                    for b in amberAtmBand:
-                        data[np.abs(wl-b)<0.1] = np.nan
-
-                if np.sum(np.isnan(data))<data.size:
-                    self._rawData.append(['t3;'+ins,
-                          hdu.data['U1COORD'][:,None]+0*self.wavel[ins][None,:],
-                          hdu.data['V1COORD'][:,None]+0*self.wavel[ins][None,:],
-                          hdu.data['U2COORD'][:,None]+0*self.wavel[ins][None,:],
-                          hdu.data['V2COORD'][:,None]+0*self.wavel[ins][None,:],
-                          self.wavel[ins][None,:]+0*hdu.data['V1COORD'][:,None],
-                          hdu.data['MJD'][:,None]+0*self.wavel[ins][None,:],
-                          data, err])
-                else:
-                    print(' > WARNING: no valid T3AMP values in this HDU')
-                Bmax = (hdu.data['U1COORD']**2+hdu.data['V1COORD']**2).max()
-                Bmax = max(Bmax, (hdu.data['U2COORD']**2+hdu.data['V2COORD']**2).max())
-                Bmax = max(Bmax, ((hdu.data['U1COORD']+hdu.data['U2COORD'])**2
-                                   +(hdu.data['V1COORD']+hdu.data['V2COORD'])**2).max())
-                Bmax = np.sqrt(Bmax)
-                maxRes = max(maxRes, Bmax/self.wavel[ins].min())
-                self.smearFov = min(self.smearFov, self.wavel[ins].min()**2/self.dwavel[ins]/Bmax*180*3.6/np.pi)
-                self.diffFov = min(self.diffFov, self.wavel[ins].min()/self.telArray[arr]*180*3.6/np.pi)
-
-            if hdu.header['EXTNAME']=='OI_VIS2' and testInst(hdu):
-                data = hdu.data['VIS2DATA']
-                if len(data.shape)==1:
-                    data = np.array([np.array([d]) for d in data])
-                err = hdu.data['VIS2ERR']
-                if len(err.shape)==1:
-                    err = np.array([np.array([e]) for e in err])
-                data[hdu.data['FLAG']] = np.nan # we'll deal with that later...
-                data /= self.v2bias
-
-                if 'AMBER' in ins:
-                    print(' | !!AMBER: rejecting V2 WL<%3.1fum'%amberWLmin)
-                    print(' | !!AMBER: rejecting V2 WL>%3.1fum'%amberWLmax)
-                    wl = hdu.data['MJD'][:,None]*0+self.wavel[ins][None,:]
-                    data[wl<amberWLmin] = np.nan
-                    data[wl>amberWLmax] = np.nan
-                    print(' | !!AMBER: rejecting bad V2 (<<0 or err too large):', end=' ')
-                    data[data<-3*hdu.data['VIS2ERR']] = np.nan
-                    print(np.sum(hdu.data['VIS2ERR']>np.abs(data)))
-                    data[hdu.data['VIS2ERR']>0.5*np.abs(data)] = np.nan
-                    for b in amberAtmBand:
-                        data[np.abs(wl-b)<0.1] = np.nan
-                if not reducePoly is None:
-                    p = []
-                    ep = []
-                    for i in range(len(data)):
-                        if all(np.isnan(data[i])) or all(np.isnan(hdu.data['VIS2ERR'][i])):
-                            tmp = {'A'+str(j):np.nan for j in range(reducePoly+1)},\
-                                {'A'+str(j):np.nan for j in range(reducePoly+1)}
-                        else:
-                            tmp = _decomposeObs(self.wavel[ins], data[i], hdu.data['VIS2ERR'][i], reducePoly)
-                        p.append(tmp[0])
-                        ep.append(tmp[1])
-                    # -- each order:
-                    for j in range(reducePoly+1):
-                        self._rawData.append(['v2_%d_%d;'%(j,reducePoly)+ins,
-                          hdu.data['UCOORD'],
-                          hdu.data['VCOORD'],
-                          self.wavel_3m[ins],
-                          hdu.data['MJD'],
-                          np.array([x['A'+str(j)] for x in p]),
-                          np.array([x['A'+str(j)] for x in ep])])
+            files = [_read(f) for f in filenames]
 
-                #print('KLUDGE on V2 err') ???
-                self._rawData.append(['v2;'+ins,
-                      hdu.data['UCOORD'][:,None]+0*self.wavel[ins][None,:],
-                      hdu.data['VCOORD'][:,None]+0*self.wavel[ins][None,:],
-                      self.wavel[ins][None,:]+0*hdu.data['VCOORD'][:,None],
-                      hdu.data['MJD'][:,None]+0*self.wavel[ins][None,:],
-                      data, err])
-
-                Bmax = (hdu.data['UCOORD']**2+hdu.data['VCOORD']**2).max()
-                Bmax = np.sqrt(Bmax)
-                maxRes = max(maxRes, Bmax/self.wavel[ins].min())
-                self.smearFov = min(self.smearFov, self.wavel[ins].min()**2/self.dwavel[ins]/Bmax*180*3.6/np.pi)
-                self.diffFov = min(self.diffFov, self.wavel[ins].min()/self.telArray[arr]*180*3.6/np.pi)
-
-        self.minSpatialScale = min(1e-6/maxRes*180*3600*1000/np.pi, self.minSpatialScale)
-        print(' | Smallest spatial scale:    %7.2f mas'%(self.minSpatialScale))
-        print(' | Diffraction Field of view: %7.2f mas'%(self.diffFov))
-        print(' | WL Smearing Field of view: %7.2f mas'%(self.smearFov))
-        self._fitsHandler.close()
+        # -- merge, in the order of the files
+        for i,f in enumerate(files):
+            if len(filenames)>1:
+                print(' | file %d/%d: %s'%(i+1, len(filenames), filenames[i]), end=' ')
+                if isinstance(f, Exception):
+                    print('')
+                    print('   -> ERROR! could not read', filenames[i])
+                    continue
+                print('(%.2fs)'%f.time)
+            else:
+                print(' | file loaded in %.2fs'%f.time)
+            for l in f.log:
+                print(l)
+            for k in ['wavel', 'wavel_3m', 'all_dwavel', 'dwavel', 'telArray']:
+                getattr(self, k).update(getattr(f, k))
+            self._rawData.extend(f._rawData)
+            self.smearFov = min(self.smearFov, f.smearFov)
+            self.diffFov = min(self.diffFov, f.diffFov)
+            self.minSpatialScale = min(self.minSpatialScale, f.minSpatialScale)
+            self._fitsHandler, self._dataheader = f._fitsHandler, f._dataheader
+            print(' | Smallest spatial scale:    %7.2f mas'%(self.minSpatialScale))
+            print(' | Diffraction Field of view: %7.2f mas'%(self.diffFov))
+            print(' | WL Smearing Field of view: %7.2f mas'%(self.smearFov))
         return
     def _compute_delta(self):
         # -- compute a flatten version of all V2:
@@ -1503,32 +2540,22 @@ class Open:
             allV2['mjd'] = np.append(allV2['mjd'], r[4].flatten())
             allV2['v2'] = np.append(allV2['v2'], r[-2].flatten())
 
-        # -- delta for approximation, very long!
+        # -- delta for approximation: nearest V2 point in (u, v, wl, mjd/1e4)
+        X = np.array([allV2['u'], allV2['v'], allV2['wl'], allV2['mjd']/10000.]).T
+        w = np.where(np.all(np.isfinite(X), axis=1))[0]
+        tree = scipy.spatial.cKDTree(X[w]) if len(w) else None
         for r in self._rawData:
             if r[0].split(';')[0] in ['cp', 't3', 'icp', 'ccp', 'scp']:
                 # -- this will contain the delta for this r
                 vis1, vis2, vis3 = np.zeros(r[-2].shape), np.zeros(r[-2].shape), np.zeros(r[-2].shape)
-                for i in range(r[-2].shape[0]):
-                    for j in range(r[-2].shape[1]):
-                        # -- find Vis
-                        k1 = np.argmin((allV2['u']-r[1][i,j])**2+
-                                       (allV2['v']-r[2][i,j])**2+
-                                       (allV2['wl']-r[5][i,j])**2+
-                                       ((allV2['mjd']-r[6][i,j])/10000.)**2)
-                        if not np.isnan(r[-2][i,j]):
-                            vis1[i,j] = np.sqrt(allV2['v2'][k1])
-                        k2 = np.argmin((allV2['u']-r[3][i,j])**2+
-                                       (allV2['v']-r[4][i,j])**2+
-                                       (allV2['wl']-r[5][i,j])**2+
-                                       ((allV2['mjd']-r[6][i,j])/10000.)**2)
-                        if not np.isnan(r[-2][i,j]):
-                            vis2[i,j] = np.sqrt(allV2['v2'][k2])
-                        k3 = np.argmin((allV2['u']-r[1][i,j]-r[3][i,j])**2+
-                                       (allV2['v']-r[2][i,j]-r[4][i,j])**2+
-                                       (allV2['wl']-r[5][i,j])**2+
-                                       ((allV2['mjd']-r[6][i,j])/10000.)**2)
-                        if not np.isnan(r[-2][i,j]):
-                            vis3[i,j] = np.sqrt(allV2['v2'][k3])
+                # -- only for valid data
+                valid = ~np.isnan(r[-2])
+                if not tree is None and valid.any():
+                    for vis, u, v in [(vis1, r[1], r[2]), (vis2, r[3], r[4]),
+                                      (vis3, r[1]+r[3], r[2]+r[4])]:
+                        k = tree.query(np.array([u[valid], v[valid], r[5][valid],
+                                                 r[6][valid]/10000.]).T)[1]
+                        vis[valid] = np.sqrt(allV2['v2'][w[k]])
                 self._delta.append((vis1, vis2, vis3))
             if r[0].split(';')[0] == 'v2':
                 self._delta.append(None)
@@ -1555,42 +2582,48 @@ class Open:
                 print('   ', d[0], '<E_syst / E_stat> = %4.2f'%(np.mean(tmp)))
         return
     def _estimateNsmear(self):
-        _meas, _errs, _uv, _types, _wl = _generateFitData(self._rawData,
-                                                          self.observables,
-                                                          self.instruments)
+        CONFIG['Nsmear'] = self._neededNsmear(self.rmax)
+        print(' | setting up Nsmear = %d'%CONFIG['Nsmear'])
+        return
+    def _neededNsmear(self, rmax):
+        """
+        Nsmear needed to compute the bandwidth smearing up to "rmax" (mas)
+        """
+        data = _FitData(self._rawData, self.observables, self.instruments)
+        # -- the polynomial fits (v2_p_n, cp_p_n) are modeled without smearing
+        w = np.array([not '_' in t.split(';')[0] for t in data.typenames],
+                     dtype=bool)[data.itype]
+        if not w.any():
+            return 3
+        _uv, _wl = data.uv[w], data.wl[w]
         # -- dwavel:
-        _dwavel = np.array([])
-        for c in self._rawData:
-            if c[0].split(';')[0] in self.observables and \
-                c[0].split(';')[1] in self.instruments:
-                _dwavel = np.append(_dwavel, np.ones(c[-2].shape).flatten()*
-                                        self.dwavel[c[0].split(';')[1]])
+        _dwavel = np.array([self.dwavel[t.split(';')[1]] for t in data.typenames])
+        _dwavel = _dwavel[data.itype][w]
         #print('_dwavel=', _dwavel)
-        res = (_uv*self.rmax/(_wl-0.5*_dwavel)-_uv*self.rmax/(_wl+0.5*_dwavel))*0.004848136
+        res = (_uv*rmax/(_wl-0.5*_dwavel)-_uv*rmax/(_wl+0.5*_dwavel))*0.004848136
         #print('DEBUG:', res)
-        CONFIG['Nsmear'] = max(int(np.ceil(4*res.max())), 3)
-        #CONFIG['Nsmear'] = max(int(np.ceil(8*res.max())), 3)
-        print(' | setting up Nsmear = %d'%CONFIG['Nsmear'])
-        return
+        return max(int(np.ceil(4*res.max())), 3)
+        #return max(int(np.ceil(8*res.max())), 3)
 
     def ndata(self):
-        tmp = 0
-        nan = 0
-        for i, c in enumerate(self._chi2Data):
-            if c[0].split(';')[0] in self.observables and\
-               c[0].split(';')[1] in self.instruments:
-                tmp += len(c[-1].flatten())
-                nan += np.sum(1-(1-np.isnan(c[-1]))*(1-np.isnan(c[-2])))
-        return int(tmp-nan)
+        return self._fitData().ndata
 
     def close(self):
-        self._fitsHandler.close()
+        """
+        close the file and stop the processes used for the computations
+        """
+        if not self._fitsHandler is None:
+            self._fitsHandler.close()
+        self._closePool()
+        self._releaseSharedData()
         return
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+        return False
     def _pool(self, verbose=False):
-        if CONFIG['Ncores'] is None:
-            self.Ncores = max(multiprocessing.cpu_count(),1)
-        else:
-            self.Ncores = min(multiprocessing.cpu_count(), CONFIG['Ncores'])
+        self.Ncores = _poolSize()
         if self.Ncores==1:
             if verbose:
                 print(' single processor', end=' ')
@@ -1598,28 +2631,368 @@ class Open:
         else:
             if verbose:
                 print(' [Pooling %d processors]'%self.Ncores, end='')
-            return multiprocessing.Pool(self.Ncores)
-    def _estimateRunTime(self, function, params):
-        # -- estimate how long it will take, in two passes
-        p = self._pool(verbose=True)
-        t = time.time()
+            # -- the processes are kept alive from one analysis to the next, as
+            #    long as the number of processes does not change. CONFIG (e.g.
+            #    Nsmear, set for each analysis) is sent with the tasks (see
+            #    _runChunk)
+            if not self._poolCache is None and self._poolCache[1]!=self.Ncores:
+                self._closePool()
+            if self._poolCache is None:
+                # -- processes attach the shared data, and use the same CONFIG
+                p = multiprocessing.Pool(self.Ncores, initializer=_poolInit,
+                                         initargs=(self._sharedData(), dict(CONFIG)))
+                self._poolCache = (p, self.Ncores)
+                _openInstances.add(self)
+            return self._poolCache[0]
+    def _closePool(self, terminate=False):
+        """
+        stop the processes of the pool, if any
+        """
+        if not self._poolCache is None:
+            if terminate:
+                self._poolCache[0].terminate()
+            else:
+                self._poolCache[0].close()
+            self._poolCache[0].join()
+            self._poolCache = None
+        return
+    def _map(self, p, function, args, callback=None, N=None):
+        """
+        compute function(*a) for each a in "args" (can be an iterator of length
+        "N") and pass the results to "callback", in the pool "p" if not None.
+
+        In the pool, consecutive items are sent in chunks (see _runChunk). The
+        chunks are submitted as the previous ones complete: their size is based
+        on the measured time per item to last about CONFIG['chunk duration']
+        seconds, and decreases as fewer items remain (guided scheduling), so the
+        last items are spread over the processes which are idle.
+
+        The first exception raised by "function" or "callback" is raised once
+        the chunks already submitted are completed; the remaining items are
+        not computed.
+        """
+        if N is None:
+            N = len(args)
+        args = iter(args)
         if p is None:
             # -- single thread:
-            for m in params:
-                function(*m)
+            for a in args:
+                r = function(*a)
+                if not callback is None:
+                    t0 = _profileTime()
+                    callback(r)
+                    _profileAdd('callbacks', t0)
+            return
+        lock, done = threading.Lock(), threading.Event()
+        config = dict(CONFIG)
+        state = {'submitted':0, 'completed':0, 'time':0.0, 'running':0,
+                 'error':None}
+        def _next():
+            # -- submit the next chunk, if any (lock must be held)
+            remaining = N - state['submitted']
+            if remaining<=0:
+                if state['running']==0:
+                    done.set()
+                return
+            n = int(np.ceil(remaining/(2.*self.Ncores)))
+            if state['completed']==0 or state['time']==0:
+                n = 1
+            else:
+                n = min(n, max(int(CONFIG['chunk duration']*state['completed']/
+                                   state['time']), 1))
+            chunk = []
+            for a in args:
+                chunk.append(a)
+                if len(chunk)==n:
+                    break
+            if len(chunk)<n:
+                # -- "args" shorter than N
+                state['submitted'] = N
+                if len(chunk)==0:
+                    if state['running']==0:
+                        done.set()
+                    return
+            n = len(chunk)
+            state['submitted'] += n
+            state['running'] += 1
+            t = time.time()
+            p.apply_async(_runChunk, (function, chunk, config),
+                          callback=lambda r: _done(n, r, t=t),
+                          error_callback=lambda e: _done(n, None, e))
+            return
+        def _done(n, r, e=None, t=None):
+            # -- called by the pool when a chunk is completed, or failed ("e")
+            t0 = _profileTime()
+            try:
+                if e is None and not callback is None:
+                    for x in r[0]:
+                        callback(x)
+            except Exception as err:
+                e = err
+            with lock:
+                state['running'] -= 1
+                state['completed'] += n
+                if e is None:
+                    _profileAdd('callbacks', t0)
+                    if not r[2] is None:
+                        _profileMerge(r[2])
+                        # -- round trip of the chunk, except the computation
+                        _profileData.setdefault('pool: transfer and wait', [0, 0.0])
+                        _profileData['pool: transfer and wait'][0] += 1
+                        _profileData['pool: transfer and wait'][1] += t0-t-r[1]
+                    state['time'] += r[1]
+                elif state['error'] is None:
+                    state['error'] = e
+                try:
+                    if not state['error'] is None:
+                        # -- do not submit the remaining items
+                        state['submitted'] = N
+                    _next()
+                except Exception as err:
+                    if state['error'] is None:
+                        state['error'] = err
+                    state['submitted'] = N
+                    if state['running']==0:
+                        done.set()
+            return
+        with lock:
+            for k in range(2*self.Ncores):
+                _next()
+        try:
+            while not done.wait(0.1):
+                pass
+        except KeyboardInterrupt:
+            # -- do not leave the remaining tasks running
+            self._closePool(terminate=True)
+            raise
+        if not state['error'] is None:
+            # -- first error of the processes or of the callback
+            raise state['error']
+        return
+    def _sharedData(self):
+        """
+        name of the copy of _fitData() in shared memory (see _shareFitData),
+        published only once for the current data. None if shared memory is not
+        available.
+        """
+        if shared_memory is None:
+            return None
+        data = self._fitData()
+        if self._shared is None or not self._shared[0] is data:
+            self._releaseSharedData()
+            self._shared = (data, _shareFitData(data))
+            _openInstances.add(self)
+        return self._shared[1].name
+    def _releaseSharedData(self):
+        if not self._shared is None:
+            self._shared[1].close()
+            self._shared[1].unlink()
+            self._shared = None
+        return
+    def _poolData(self, p):
+        """
+        data to be passed to the tasks: _fitData() in a single process, the name
+        of its copy in shared memory if the pool "p" is used
+        """
+        if p is None or shared_memory is None:
+            return self._fitData()
+        return self._sharedData()
+    def _batchSize(self, N):
+        """
+        number of companion positions computed at once by _chi2MapBlock, out of
+        "N" positions to be computed.
+        """
+        if not CONFIG['batch size'] is None:
+            return max(int(CONFIG['batch size']), 1)
+        # -- limit the size of the (position, data, smearing) arrays
+        ndata = max(len(self._fitData()), 1)
+        Nb = int(2e6/(ndata*max(CONFIG['Nsmear'], 1)))
+        # -- enough blocks to keep all processes busy
+        Ncores = _poolSize()
+        if Ncores>1:
+            # -- small enough for the blocks to be balanced between processes
+            #    (see _map)
+            Nb = min(Nb, int(np.ceil(N/(16.*Ncores))))
+        return max(Nb, 1)
+    def _probeRunTime(self, kind, function, tasks, callback=None, warmup=False):
+        """
+        computes "function"(*a) for each a in "tasks", in this process, and
+        passes the results to "callback" (so the analysis does not compute them
+        again). Calibrates the cost model of "kind" (see _predictRunTime) in
+        self._runTimeModel: the time per position (blocks of positions, X and Y
+        being the 2nd and 3rd arguments) or per model evaluation (_fitFunc),
+        per data point and per smearing sample. For the fits, the numbers of
+        model evaluations are kept with the radii of the starting points.
+
+        warmup: the first task is not timed (compilation, caches), unless it
+        is the only one.
+
+        returns the list of results
+        """
+        fit = function is _fitFunc
+        results, t, n, radii, nfev = [], 0.0, 0, [], []
+        # -- no progress bar during the probe
+        prog, self._prog = getattr(self, '_prog', 0.0), np.inf
+        try:
+            for i,a in enumerate(tasks):
+                t0 = time.time()
+                r = function(*a)
+                dt = time.time()-t0
+                if fit:
+                    radii.append(np.hypot(a[0].get('x', 0.0), a[0].get('y', 0.0)))
+                    try:
+                        nfev.append(r['info']['nfev'])
+                    except:
+                        nfev.append(1)
+                if i>0 or not warmup or len(tasks)==1:
+                    t += dt
+                    n += nfev[-1] if fit else len(a[1])
+                results.append(r)
+                if not callback is None:
+                    callback(r)
+        finally:
+            self._prog = prog
+        self._runTimeModel[kind] = {'cost':t/max(n, 1)/len(self._fitData())/_runTimeSamples(),
+                                    'Ndata':len(self._fitData()),
+                                    'Nsmear':CONFIG['Nsmear'],
+                                    'smearing':CONFIG['smearing']}
+        if fit:
+            self._runTimeModel[kind]['radii'] = radii
+            self._runTimeModel[kind]['nfev'] = nfev
+        return results
+    def _predictRunTime(self, kind, radii, Nsmear=None, Ncores=None):
+        """
+        duration (s) predicted by the cost model of "kind" (see _probeRunTime)
+        for positions, or starting points of fits, at "radii" (mas), if
+        CONFIG['Nsmear'] and CONFIG['Ncores'] are "Nsmear" and "Ncores" (default:
+        current values). The work is assumed to be evenly shared by the
+        processes; starting them is not included.
+        """
+        m = self._runTimeModel[kind]
+        radii = np.atleast_1d(radii)
+        if len(radii)==0:
+            return 0.0
+        if 'nfev' in m:
+            # -- number of model evaluations, interpolated in radius
+            i = np.argsort(m['radii'])
+            n = np.sum(np.interp(radii, np.array(m['radii'])[i],
+                                 np.array(m['nfev'], dtype=float)[i]))
+        else:
+            n = len(radii)
+        return m['cost']*n*len(self._fitData())*_runTimeSamples(Nsmear)/\
+                min(_poolSize(Ncores), len(radii))
+    def _checkRunTime(self, est, upper=False):
+        """
+        prints the estimated duration "est" (s) of an analysis ("upper": only an
+        upper limit). Returns False, after a warning, if it is longer than
+        CONFIG['long exec warning'].
+        """
+        if _poolSize()==1:
+            print(' single processor', end=' ')
+        else:
+            print(' [Pooling %d processors]'%_poolSize(), end='')
+        print('... it should take %s %d seconds'%('at most' if upper else 'about', int(est)))
+        if est>CONFIG['long exec warning']:
+            print(" > WARNING: this will take too long. ")
+            print(" | Increase CONFIG['long exec warning'] if you want to run longer computations.")
+            print(" | e.g. "+__name__+".CONFIG['long exec warning'] = %d"%int(1.2*est))
+            print(" | set it to None and the warning will disapear... at your own risks!")
+            return False
+        return True
+    def _calibrateRunTime(self, kind, rmin, rmax):
+        """
+        calibrates the cost model of "kind" ('chi2Map', 'fitMap', 'fitBoot' or
+        'detectionLimit;'+method) with a few positions or fits between "rmin"
+        and "rmax" (mas), see _probeRunTime. The results are not kept.
+        """
+        if self.diam is None:
+            self.fitUD()
+        param = {'f':1.0, 'diam*':self.diam, 'alpha*':self.alpha}
+        for _k in self.dwavel.keys():
+            param['dwavel;'+_k] = self.dwavel[_k]
+        if kind in ['fitMap', 'fitBoot']:
+            tasks = []
+            for r in np.linspace(max(rmin, 0.1*rmax), rmax, 8):
+                o = np.random.rand()*2*np.pi
+                tmp = dict(param)
+                tmp.update({'x':r*np.cos(o), 'y':r*np.sin(o), 'f':2.0})
+                if kind=='fitMap':
+                    # -- as the starting points of fitMap
+                    tmp['diam*'] = 0.0
+                tasks.append((tmp, self._fitData(), self.observables, self.instruments))
+            self._probeRunTime(kind, _fitFunc, tasks)
+        else:
+            o = np.random.rand(9)*2*np.pi
+            X, Y = rmax*np.cos(o), rmax*np.sin(o)
+            if kind=='chi2Map':
+                function, extra = _chi2MapBlock, ()
+            else:
+                function, extra = _detectLimitBlock, (kind.split(';')[1],)
+            tasks = [(param, X[:1], Y[:1], self._fitData(), self.observables,
+                      self.instruments)+extra,
+                     (param, X[1:], Y[1:], self._fitData(), self.observables,
+                      self.instruments)+extra]
+            self._probeRunTime(kind, function, tasks, warmup=True)
+        return
+    def estimateRunTime(self, method='chi2Map', step=None, rmin=None, rmax=None,
+                        N=100, Nsmear=None, Ncores=None, methods=['Absil', 'injection']):
+        """
+        predicted duration (s) of "method" ('chi2Map', 'fitMap', 'fitBoot' or
+        'detectionLimit') on the current data, without running it: grid of
+        step "step" between "rmin" and "rmax" (in mas, same default values as
+        the method), "N" fits for fitBoot, "methods" for detectionLimit.
+
+        "Nsmear" and "Ncores" (see CONFIG) default to the values the method
+        would use. The costs are the ones measured during the last run of the
+        method, or else on a few positions (or fits) computed now.
+        """
+        if rmin is None:
+            rmin = self.rmin
+        if rmax is None:
+            rmax = self.rmax
+        if Nsmear is None:
+            Nsmear = self._neededNsmear(rmax)
+        if method in ['chi2Map', 'detectionLimit']:
+            if step is None:
+                step = {'chi2Map':1/5., 'detectionLimit':1/2.}[method]*self.minSpatialScale
+            x = np.linspace(-rmax, rmax, int(np.ceil(2*rmax/step)))
+            radii = np.hypot(x[None,:], x[:,None]).flatten()
+            if method=='chi2Map':
+                kinds = ['chi2Map']
+            else:
+                kinds = ['detectionLimit;'+m for m in methods]
+        elif method=='fitMap':
+            if step is None:
+                step = self.minSpatialScale
+            XY = _fitMapGrid(rmin, rmax, step, halfPlane=self.observables==['v2'])[0]
+            radii = np.hypot(*np.array(XY).T)
+            kinds = ['fitMap']
+        elif method=='fitBoot':
+            if not self.bestFit is None:
+                r = np.hypot(self.bestFit['best']['x'], self.bestFit['best']['y'])
+            else:
+                r = 0.5*(rmin+rmax)
+            radii = r*np.ones(N)
+            kinds = ['fitBoot' if 'fitBoot' in self._runTimeModel else 'fitMap']
         else:
-            # -- multithreaded:
-            for m in params:
-                p.apply_async(function, m)
-            p.close()
-            p.join()
-        return (time.time()-t)/len(params)
+            print(' > ERROR: unknown method', method)
+            return None
+        if method!='fitBoot':
+            radii = radii[(radii>=rmin)*(radii<=rmax)]
+        for k in kinds:
+            if not k in self._runTimeModel:
+                self._calibrateRunTime(k, rmin, rmax)
+        return np.sum([self._predictRunTime(k, radii, Nsmear, Ncores) for k in kinds])
     def _cb_chi2Map(self, r):
         """
         callback function for chi2Map()
         """
         try:
             self.mapChi2[r[1], r[0]] = r[2]
+            if not self._checkpoint is None:
+                # -- values first, so the mask is never ahead of them
+                self._checkpoint[0][r[1], r[0]] = r[2]
+                self._checkpoint[1][r[1], r[0]] = True
             # -- completed / to be computed
             f = np.sum(self.mapChi2>0)/float(np.sum(self.mapChi2>=0))
             if f>self._prog and CONFIG['progress bar']:
@@ -1634,8 +3007,78 @@ class Open:
             print('did not work')
         return
 
+    def _chi2MapLevels(self, compute, N, levels, margin):
+        """
+        coarse to fine computation of self.mapChi2 (NxN, 0 for the pixels to
+        compute), see chi2Map. compute(I, J) computes the pixels of column I and
+        row J.
+        """
+        computed = np.zeros((N,N), dtype=bool)
+        computed[self.mapChi2>0] = True # -- from a checkpoint
+        for l in range(levels):
+            t0 = time.time()
+            s = 2**(levels-1-l)
+            # -- indices of the grid at this level, always including the edge
+            idx = np.union1d(np.arange(0, N, s), [N-1])
+            J, I = np.meshgrid(idx, idx, indexing='ij')
+            new = np.zeros((N,N), dtype=bool)
+            new[J, I] = True
+            new &= (self.mapChi2==0)
+            Ncomp, Ninterp = 0, 0
+            if l==0:
+                todo = new
+            else:
+                # -- smallest cell of the previous levels containing each new
+                #    pixel, with corners actually computed (or outside
+                #    rmin/rmax): interpolated values are never used as corners
+                jn, In = np.where(new)
+                j0, j1, i0, i1 = [np.zeros(len(jn), dtype=int) for k in range(4)]
+                valid = computed | (self.mapChi2<0)
+                found, t = np.zeros(len(jn), dtype=bool), 2*s
+                while not found.all():
+                    prev = np.union1d(np.arange(0, N, t), [N-1])
+                    w = np.where(~found)[0]
+                    a = np.clip(np.searchsorted(prev, jn[w], side='right')-1, 0, len(prev)-2)
+                    b = np.clip(np.searchsorted(prev, In[w], side='right')-1, 0, len(prev)-2)
+                    _j0, _j1, _i0, _i1 = prev[a], prev[a+1], prev[b], prev[b+1]
+                    ok = valid[_j0,_i0] & valid[_j0,_i1] & valid[_j1,_i0] & valid[_j1,_i1]
+                    if t>=2**(levels-1):
+                        ok[:] = True # -- first level: all computed
+                    w = w[ok]
+                    j0[w], j1[w], i0[w], i1[w] = _j0[ok], _j1[ok], _i0[ok], _i1[ok]
+                    found[w] = True
+                    t *= 2
+                corners = np.array([self.mapChi2[j0,i0], self.mapChi2[j0,i1],
+                                    self.mapChi2[j1,i0], self.mapChi2[j1,i1]])
+                known = self.mapChi2[computed & (self.mapChi2>0)]
+                cmin, rng = known.min(), known.max()-known.min()
+                refine = (corners<=0).any(axis=0) # -- outside rmin/rmax
+                refine |= corners.min(axis=0)-cmin <= margin*rng
+                refine |= corners.max(axis=0)-corners.min(axis=0) >= margin*rng
+                todo = np.zeros((N,N), dtype=bool)
+                todo[jn[refine], In[refine]] = True
+                # -- bilinear interpolation for the other pixels
+                k = ~refine
+                wj = (jn[k]-j0[k])/(j1[k]-j0[k])
+                wi = (In[k]-i0[k])/(i1[k]-i0[k])
+                self.mapChi2[jn[k], In[k]] = (1-wj)*(1-wi)*corners[0][k] + \
+                        (1-wj)*wi*corners[1][k] + wj*(1-wi)*corners[2][k] + \
+                        wj*wi*corners[3][k]
+                Ninterp = np.sum(k)
+            J, I = np.where(todo)
+            Ncomp = len(I)
+            compute(I, J)
+            computed |= todo
+            print(' | level %d (step %.2f mas): %d pixels computed, %d interpolated, in %.1fs'%(
+                    l, s*2*self.rmax/(N-1), Ncomp, Ninterp, time.time()-t0))
+        print(' | %d pixels computed out of %d (%.0f%%)'%(np.sum(computed),
+                np.sum(self.mapChi2>0), 100*np.sum(computed)/np.sum(self.mapChi2>0)))
+        return
+
+    @_profiled
     def chi2Map(self, step=None, fratio=None, addCompanion=None, removeCompanion=None,
-                fig=0, diam=None, rmin=None, rmax=None):
+                fig=0, diam=None, rmin=None, rmax=None, checkpoint=None,
+                levels=1, refineMargin=0.1):
         """
         Performs a chi2 map between rmin and rmax (should be defined) with step
         "step". The diameter is taken as the best fit UD diameter (biased if
@@ -1644,6 +3087,17 @@ class Open:
         If 'addCompanion' or 'removeCompanion' are defined, a companion will
         be analytically added or removed from the data. define the companion
         as {'x':mas, 'y':mas, 'f':fratio in %}. 'f' will be forced to be positive.
+
+        checkpoint: directory where the map is written as it is computed. If it
+        contains a map computed (even partially) with the same data and
+        parameters, only the missing pixels are computed. The map can be read
+        by another process during the computation (see loadChi2Map).
+
+        levels: if >1, the map is first computed on a grid 2**(levels-1) times
+        coarser, then refined by factors of 2. At each level, a cell of the
+        coarser grid is computed only if its chi2 is within "refineMargin"
+        (fraction of the range of the map) of the minimum, or if it varies by
+        more than "refineMargin" across the cell. Other cells are interpolated.
         """
         if step is None:
             step = 1/5. * self.minSpatialScale
@@ -1699,55 +3153,69 @@ class Open:
         self._prog = 0.0
         self._progTime = [time.time(), time.time()]
 
+        self._checkpoint = None
+        if not checkpoint is None:
+            self._checkpoint = _openChi2Map(checkpoint, allX, allY,
+                {'fratio':fratio, 'diam*':self.diam, 'alpha*':self.alpha,
+                 'rmin':self.rmin, 'rmax':self.rmax, 'Nsmear':CONFIG['Nsmear'],
+                 'observables':sorted(self.observables),
+                 'instruments':sorted(self.instruments),
+                 'data':_fitDataHash(self._fitData())})
+            done = self._checkpoint[1] & (self.mapChi2==0)
+            self.mapChi2[done] = self._checkpoint[0][done]
+            if done.any():
+                print(' | resuming from %s: %d pixels already computed'%(
+                        checkpoint, np.sum(done)))
+
+        def _task(I, J, data):
+            params = {'f':fratio, 'diam*':self.diam, 'alpha*':self.alpha,
+                      '_i':I, '_j':J}
+            for _k in self.dwavel.keys():
+                params['dwavel;'+_k] = self.dwavel[_k]
+            return (params, allX[I], allY[J], data, self.observables,
+                    self.instruments)
+
         # -- parallel treatment:
         print(' | Computing Map %dx%d'%(N, N), end=' ')
         if not CONFIG['long exec warning'] is None:
-            # -- estimate how long it will take, in two passes
-            params, Ntest = [], 20*max(multiprocessing.cpu_count()-1,1)
-            for i in range(Ntest):
-                o = np.random.rand()*2*np.pi
-                tmp = {'x':np.cos(o)*(self.rmax+self.rmin),
-                          'y':np.sin(o)*(self.rmax+self.rmin),
-                          'f':1.0, 'diam*':self.diam, 'alpha*':self.alpha}
-                for _k in self.dwavel.keys():
-                    tmp['dwavel;'+_k] = self.dwavel[_k]
-                params.append((tmp,self._chi2Data, self.observables, self.instruments))
-            est = self._estimateRunTime(_chi2Func, params)
-            est *= np.sum(self.mapChi2>=0)
-            print('... it should take about %d seconds'%(int(est)))
-            if not CONFIG['long exec warning'] is None and\
-                 est>CONFIG['long exec warning']:
-                print(" > WARNING: this will take too long. ")
-                print(" | Increase CONFIG['long exec warning'] if you want to run longer computations.")
-                print(" | e.g. "+__name__+".CONFIG['long exec warning'] = %d"%int(1.2*est))
-                print(" | set it to None and the warning will disapear... at your own risks!")
-                return
+            # -- estimate how long it will take: a few pixels (of the coarser
+            #    grid if levels>1) are computed here, and kept
+            J, I = np.where(self.mapChi2==0)
+            if levels>1:
+                idx = np.union1d(np.arange(0, N, 2**(levels-1)), [N-1])
+                k = np.isin(I, idx)*np.isin(J, idx)
+                J, I = J[k], I[k]
+            k = np.unique(np.linspace(0, len(I)-1, min(len(I), 9)).astype(int))
+            if len(k):
+                self._probeRunTime('chi2Map', _chi2MapBlock,
+                                   [_task(I[k[i:j]], J[k[i:j]], self._fitData())
+                                    for i,j in [(0, 1), (1, len(k))] if j>i],
+                                   self._cb_chi2Map, warmup=True)
+                J, I = np.where(self.mapChi2==0)
+                est = self._predictRunTime('chi2Map', np.hypot(allX[I], allY[J]))
+                if not self._checkRunTime(est, upper=levels>1):
+                    return
         print('')
         # -- done estimating time
 
-        # -- compute actual grid:
+        # -- compute actual grid, by blocks of positions:
         p = self._pool()
-
-        for i,x in enumerate(allX):
-            for j,y in enumerate(allY):
-                if self.mapChi2[j,i]==0:
-                    params = {'x':x, 'y':y, 'f':fratio, 'diam*':self.diam,
-                              '_i':i, '_j':j, 'alpha*':self.alpha}
-                    for _k in self.dwavel.keys():
-                        params['dwavel;'+_k] = self.dwavel[_k]
-
-                    if p is None:
-                        # -- single thread:
-                        self._cb_chi2Map(_chi2Func(params, self._chi2Data,
-                                                    self.observables, self.instruments))
-                    else:
-                        # -- multi-thread:
-                        p.apply_async(_chi2Func, (params, self._chi2Data,
-                                    self.observables, self.instruments),
-                                    callback=self._cb_chi2Map)
-        if not p is None:
-            p.close()
-            p.join()
+        data = self._poolData(p)
+        def _compute(I, J):
+            Nb = self._batchSize(len(I))
+            tasks = [_task(I[k:k+Nb], J[k:k+Nb], data) for k in range(0, len(I), Nb)]
+            self._map(p, _chi2MapBlock, tasks, self._cb_chi2Map)
+        try:
+            if levels<=1:
+                J, I = np.where(self.mapChi2==0)
+                _compute(I, J)
+            else:
+                self._chi2MapLevels(_compute, N, levels, refineMargin)
+        finally:
+            if not self._checkpoint is None:
+                self._checkpoint[0].flush()
+                self._checkpoint[1].flush()
+                self._checkpoint = None
 
         # -- take care of unfitted zone, for esthetics
         self.mapChi2[self.mapChi2<=0] = self.chi2_UD
@@ -1830,6 +3298,228 @@ class Open:
         plt.text(0.9*x0, 0.9*y0, r'n$\sigma$=%3.1f'%s0, color='r')
         return
 
+    def chi2Flux(self, x, y, fratio):
+        """
+        chi2r of the binary with the companion at "x", "y" (in mas, scalars or
+        1D arrays) for each flux ratio in "fratio" (in %, 1D array), on the
+        current data (observables, instruments and injected or removed
+        companion of the last analysis), with the diameter of the last UD fit.
+
+        The part of the model which does not depend on the flux ratio is
+        computed once per position (see _FluxModel), so a scan in flux ratio
+        costs little more than a single model.
+
+        returns an array (position, flux ratio), 1D if "x" and "y" are scalars
+        """
+        if self.diam is None:
+            self.fitUD()
+        X, Y = np.atleast_1d(x).astype(float), np.atleast_1d(y).astype(float)
+        F = np.atleast_1d(fratio).astype(float)
+        param = {'f':1.0, 'diam*':self.diam, 'alpha*':self.alpha}
+        for _k in self.dwavel.keys():
+            param['dwavel;'+_k] = self.dwavel[_k]
+        data = self._fitData()
+        if all([o[0].split(';')[0] in _jacObservables for o in data.obs]):
+            res = _FluxModel(data, param, X, Y).chi2(F, data.meas, data.errs)
+        else:
+            # -- polynomial observables: one flux ratio at a time
+            res = []
+            for f in F:
+                param['f'] = f
+                res.append(_chi2MapBlock(param, X, Y, data, self.observables,
+                                         self.instruments))
+            res = np.array(res).T
+        if np.isscalar(x) and np.isscalar(y):
+            return res[0]
+        return res
+
+    def _cb_chi2Cube(self, r):
+        """
+        callback function for chi2Cube()
+        """
+        self._cube[r[1], r[0], :] = r[2]
+        self._cubeDone[r[1], r[0]] = True
+        f = np.sum(self._cubeDone)/float(self._cubeTodo)
+        if f>self._prog and CONFIG['progress bar']:
+            n = int(50*f)
+            print('\033[F',end =' ')
+            print('|'+'='*(n+1)+' '*(50-n)+'|', end=' ')
+            print('%2d%%'%(int(100*f)), end=' ')
+            self._progTime[1] = time.time()
+            print('%3d s remaining'%(int((self._progTime[1]-self._progTime[0])/f*(1-f))))
+            self._prog = max(self._prog+0.01, f+0.01)
+        return
+
+    @_profiled
+    def chi2Cube(self, step=None, fratio=None, addCompanion=None,
+                 removeCompanion=None, fig=0, rmin=None, rmax=None,
+                 filename=None):
+        """
+        chi2 of the binary on a grid of positions (see chi2Map) and for each
+        flux ratio in "fratio" (in %, 1D array, default 21 values from 0.1% to
+        10%), in one run: the terms which do not depend on the flux ratio are
+        computed only once per position (see _FluxModel).
+
+        The cube (Y, X, fratio) is stored as float32 in a memory-mapped array:
+        in "filename" (.npy, can be read with numpy.load(filename,
+        mmap_mode='r')) if given, else in a temporary file. Pixels outside
+        rmin/rmax are nan.
+
+        results are in self.chi2CubeResult: 'X', 'Y' (1D, mas), 'fratio',
+        'chi2' (the cube), and the maps derived from it: 'chi2 min' (minimum
+        over the flux ratios, nan outside rmin/rmax), 'best f' (flux ratio of
+        the minimum) and 'nsigma' (detection level of the minimum, see
+        chi2Map), as well as the overall 'best' {'x', 'y', 'f', 'chi2',
+        'nsigma'}.
+
+        addCompanion, removeCompanion: see chi2Map
+        """
+        if step is None:
+            step = 1/5. * self.minSpatialScale
+            print(' | step= not given, using 1/5 X smallest spatial scale = %4.2f mas'%step)
+        if rmin is None:
+            self.rmin = self.minSpatialScale
+            print(" | rmin= not given, set to smallest spatial scale: rmin=%5.2f mas"%(self.rmin))
+        else:
+            self.rmin = rmin
+        if rmax is None:
+            self.rmax = 1.2*self.smearFov
+            print(" | rmax= not given, set to 1.2*Field of View: rmax=%5.2f mas"%(self.rmax))
+        else:
+            self.rmax = rmax
+        self._estimateNsmear()
+        N = int(np.ceil(2*self.rmax/step))
+        if fratio is None:
+            fratio = np.logspace(-1, 1, 21)
+            print(' | fratio= not given -> using %d values from %.1f%% to %.1f%%'%(
+                    len(fratio), fratio[0], fratio[-1]))
+        F = np.atleast_1d(fratio).astype(float)
+
+        print(' | observables:', self.observables, 'from', self.ALLobservables)
+        print(' | instruments:', self.instruments, 'from', self.ALLinstruments)
+
+        self._chi2Data = self._copyRawData()
+        if not addCompanion is None:
+            tmp = {k:addCompanion[k] for k in addCompanion.keys()}
+            tmp['f'] = np.abs(tmp['f'])
+            self._chi2Data = _injectCompanionData(self._chi2Data, self._delta, tmp)
+        if not removeCompanion is None:
+            tmp = {k:removeCompanion[k] for k in removeCompanion.keys()}
+            tmp['f'] = -np.abs(tmp['f'])
+            self._chi2Data = _injectCompanionData(self._chi2Data, self._delta, tmp)
+        self.fitUD()
+
+        # -- prepare the grid and the cube
+        allX = np.linspace(-self.rmax, self.rmax, N)
+        allY = np.linspace(-self.rmax, self.rmax, N)
+        R2 = allX[None,:]**2+allY[:,None]**2
+        todo = (R2<=self.rmax**2)&(R2>=self.rmin**2)
+        if filename is None:
+            self._cube = np.memmap(tempfile.TemporaryFile(), dtype=np.float32,
+                                   mode='w+', shape=(N,N,len(F)))
+        else:
+            self._cube = np.lib.format.open_memmap(filename, mode='w+',
+                                dtype=np.float32, shape=(N,N,len(F)))
+        self._cube[~todo] = np.nan
+        self._cubeDone = np.zeros((N,N), dtype=bool)
+        self._cubeTodo = np.sum(todo)
+        self._prog = 0.0
+        self._progTime = [time.time(), time.time()]
+
+        param = {'f':1.0, 'diam*':self.diam, 'alpha*':self.alpha}
+        for _k in self.dwavel.keys():
+            param['dwavel;'+_k] = self.dwavel[_k]
+
+        def _task(I, J, data):
+            tmp = dict(param)
+            tmp['_i'], tmp['_j'] = I, J
+            return (tmp, allX[I], allY[J], F, data, self.observables,
+                    self.instruments)
+
+        print(' | Computing Cube %dx%dx%d'%(N, N, len(F)), end=' ')
+        cube = self._cube
+        try:
+            if not CONFIG['long exec warning'] is None:
+                # -- estimate how long it will take: a few positions are
+                #    computed here, and kept
+                J, I = np.where(todo)
+                k = np.unique(np.linspace(0, len(I)-1, min(len(I), 9)).astype(int))
+                if len(k):
+                    self._probeRunTime('chi2Cube', _chi2CubeBlock,
+                                       [_task(I[k[i:j]], J[k[i:j]], self._fitData())
+                                        for i,j in [(0, 1), (1, len(k))] if j>i],
+                                       self._cb_chi2Cube, warmup=True)
+                    J, I = np.where(todo*~self._cubeDone)
+                    est = self._predictRunTime('chi2Cube', np.hypot(allX[I], allY[J]))
+                    if not self._checkRunTime(est):
+                        return
+            print('')
+
+            p = self._pool()
+            data = self._poolData(p)
+            J, I = np.where(todo*~self._cubeDone)
+            Nb = self._batchSize(len(I))
+            tasks = [_task(I[k:k+Nb], J[k:k+Nb], data) for k in range(0, len(I), Nb)]
+            self._map(p, _chi2CubeBlock, tasks, self._cb_chi2Cube)
+        finally:
+            # -- also if stopped: the cube is not kept open by self
+            cube.flush()
+            self._cube, self._cubeDone = None, None
+
+        # -- maps derived from the cube, one flux ratio at a time
+        chi2min = np.zeros((N,N))+np.inf
+        bestf = np.zeros((N,N))+np.nan
+        for k in range(len(F)):
+            c = np.array(cube[:,:,k], dtype=float)
+            w = todo & (c<chi2min)
+            chi2min[w], bestf[w] = c[w], F[k]
+        chi2min[np.isinf(chi2min)] = np.nan
+        nsigma = _nSigmas(self.chi2_UD, np.minimum(chi2min, self.chi2_UD),
+                          self.ndata())
+        j0, i0 = np.unravel_index(np.nanargmin(chi2min), chi2min.shape)
+        best = {'x':allX[i0], 'y':allY[j0], 'f':bestf[j0,i0],
+                'chi2':chi2min[j0,i0], 'nsigma':nsigma[j0,i0]}
+        self.chi2CubeResult = {'X':allX, 'Y':allY, 'fratio':F,
+                               'chi2':cube, 'chi2 min':chi2min,
+                               'best f':bestf, 'nsigma':nsigma, 'best':best}
+        print(' | chi2 Min: %5.3f'%(best['chi2']))
+        print(' | at X,Y  : %6.2f, %6.2f mas, f=%5.3f%%'%(best['x'], best['y'], best['f']))
+        print(' | NDOF=%d'%( self.ndata()-1),end=' ')
+        print(' | n sigma detection: %5.2f (fully uncorrelated errors)'%best['nsigma'])
+
+        if fig is None:
+            return
+        plt.close(fig)
+        plt.figure(fig, figsize=(12, 4.5))
+        plt.subplots_adjust(top=0.85, bottom=0.12, left=0.06, right=0.98,
+                            wspace=0.15)
+        if CONFIG['suptitle']:
+            title = "CANDID: $\chi^2$ Cube for %d f$_\mathrm{ratio}$ in [%4.2f%%, %4.2f%%]"%(
+                    len(F), F.min(), F.max())
+            title += ' Using '+', '.join(self.observables)
+            title += '\nfrom '+', '.join(self.instruments)
+            title += '\n'+self.titleFilename
+            plt.suptitle(title, fontsize=10, fontweight='bold')
+        X, Y = np.meshgrid(allX, allY)
+        maps = [(chi2min/self.chi2_UD, '$\chi^2_\mathrm{BIN}/\chi^2_\mathrm{UD}$, min over f$_\mathrm{ratio}$'),
+                (bestf, 'best f$_\mathrm{ratio}$ (%)'),
+                (nsigma, 'detection ($\sigma$)')]
+        ax1 = None
+        for k, (m, t) in enumerate(maps):
+            ax = plt.subplot(1, 3, k+1, sharex=ax1, sharey=ax1)
+            if ax1 is None:
+                ax1 = ax
+                plt.ylabel(r'$\Delta \delta\, \rightarrow$ N (mas)')
+            ax.set_aspect('equal')
+            plt.title(t)
+            plt.pcolormesh(X, Y, m, cmap=CONFIG['color map'], shading='auto')
+            plt.colorbar(format='%0.2f')
+            plt.xlabel(r'E $\leftarrow\, \Delta \alpha$ (mas)')
+            plt.plot(best['x'], best['y'], '+r', markersize=12)
+        plt.xlim(self.rmax, -self.rmax)
+        plt.ylim(-self.rmax, self.rmax)
+        return
+
     def _cb_fitFunc(self, r):
         """
         callback function for fitMap
@@ -1852,9 +3542,10 @@ class Open:
         #     print('!!! I expect a dict!')
         return
 
+    @_profiled
     def fitMap(self, step=None,  fig=1, addCompanion=None,
                removeCompanion=None, rmin=None, rmax=None, fratio=2.0,
-               doNotFit=[], addParam={}, beta=1.0, showNmin=1):
+               doNotFit=[], addParam={}, beta=1.0, showNmin=1, adaptive=False):
         """
         - filename: a standard OIFITS data file
         - N: starts fits on a NxN grid
@@ -1862,6 +3553,9 @@ class Open:
         - rmin: do not look into the inner radius, in mas
         - fig=0: the figure number (default 0)
         - fratio: initial flux ratio for each fit (default=2 for 2%)
+        - adaptive: start with every other starting point, then skip the
+          remaining ones whose neighbours all converged to the same minimum
+          (the skipped points are listed in self.skippedFitMap)
         """
         result = {'call':{'method':'fitMap'},
                   'internal':{},
@@ -1888,6 +3582,7 @@ class Open:
         result['call']['fratio']=fratio
         result['call']['addParam']=addParam
         result['call']['doNotFit']=doNotFit
+        result['call']['adaptive']=adaptive
 
         self._estimateNsmear()
         result['internal']['Nsmear'] = CONFIG['Nsmear']
@@ -1948,52 +3643,17 @@ class Open:
         # self.Nfits = np.sum((X[:,None]**2+Y[None,:]**2>=self.rmin**2)*
         #                     (X[:,None]**2+Y[None,:]**2<=self.rmax**2))
 
-        R = np.linspace(self.rmin**(1/beta), self.rmax**(1/beta),
-                    int((self.rmax-self.rmin)/step+1))**beta
-        XY = []
-        for i,r in enumerate(R):
-            n = max(4, int(2*np.pi*r/np.gradient(R)[i]))
-            for t in np.linspace(0, 2*np.pi, n+1)[:-1]:
-                if not (self.observables==['v2'] and np.cos(t)<0):
-                    XY.append((r*np.cos(t), r*np.sin(t)))
+        XY, coarse, spacing = _fitMapGrid(self.rmin, self.rmax, step, beta,
+                                          halfPlane=self.observables==['v2'])
 
         self.allFits, self._prog = [{} for k in range(len(XY))], 0.0
+        self.skippedFitMap = []
         self._progTime = [time.time(), time.time()]
         self.Nfits = len(XY)
 
-        print(' | Grid Fitting on %d starting points:'%(len(XY)),end=' ')
-        # -- estimate how long it will take, in two passes
-        if not CONFIG['long exec warning'] is None:
-            params, Ntest = [], 2*max(multiprocessing.cpu_count()-1,1)
-            for i in range(Ntest):
-                o = np.random.rand()*2*np.pi
-                tmp = {'x':np.cos(o)*(self.rmax+self.rmin),
-                          'y':np.sin(o)*(self.rmax+self.rmin),
-                          'f':fratio, 'diam*':self.diam, 'alpha*':self.alpha}
-                for _k in self.dwavel.keys():
-                    tmp['dwavel;'+_k] = self.dwavel[_k]
-                params.append((tmp, self._chi2Data, self.observables,
-                                self.instruments))
-            est = self._estimateRunTime(_fitFunc, params)
-            est *= self.Nfits
-            print('... it should take about %d seconds'%(int(est)))
-            if not CONFIG['long exec warning'] is None and\
-                 est>CONFIG['long exec warning']:
-                print(" > WARNING: this will take too long. ")
-                print(" | Increase CONFIG['long exec warning'] if you want to run longer computations.")
-                print(" | e.g. "+__name__+".CONFIG['long exec warning'] = %d"%int(1.2*est))
-                print(" | set it to 'None' and the warning will disapear... at your own risks!")
-                return
-        else:
-            print('')
-        print('')
-        # -- parallel on N-1 cores
-        p = self._pool()
         k = 0
-        #t0 = time.time()
-        params = []
-        t0 = time.time()
-        for x,y in XY:
+        params, _coarse, _spacing = [], [], []
+        for i,(x,y) in enumerate(XY):
             if x**2+y**2>=self.rmin**2 and x**2+y**2<=self.rmax**2:
                 tmp={'diam*': 0.0, 'f':fratio, 'x':x, 'y':y, '_k':k,
                      'alpha*':self.alpha}
@@ -2001,28 +3661,78 @@ class Open:
                     tmp['dwavel;'+_k] = self.dwavel[_k]
                 tmp.update(addParam)
                 params.append(tmp)
-                if p is None:
-                    # -- single thread:
-                    self._cb_fitFunc(_fitFunc(params[-1], self._chi2Data,
-                                              self.observables, self.instruments,
-                                              None, doNotFit))
-                else:
-                    # -- multiple threads:
-                    p.apply_async(_fitFunc, (params[-1], self._chi2Data,
-                                             self.observables, self.instruments,
-                                             None, doNotFit),
-                                             callback=self._cb_fitFunc)
+                _coarse.append(coarse[i])
+                _spacing.append(spacing[i])
                 k += 1
-        if not p is None:
-            p.close()
-            p.join()
+
+        print(' | Grid Fitting on %d starting points:'%(len(XY)),end=' ')
+        t0 = time.time()
+        # -- estimate how long it will take: a few fits, spread in radius (on
+        #    the coarse grid if adaptive), are done here and kept
+        if not CONFIG['long exec warning'] is None and len(params):
+            probe = [k for k in range(len(params)) if _coarse[k] or not adaptive]
+            probe = sorted(probe, key=lambda k: params[k]['x']**2+params[k]['y']**2)
+            probe = [probe[i] for i in np.unique(np.linspace(0, len(probe)-1,
+                                                   min(len(probe), 8)).astype(int))]
+            self._probeRunTime('fitMap', _fitFunc,
+                               [(params[k], self._fitData(), self.observables,
+                                 self.instruments, None, doNotFit) for k in probe],
+                               self._cb_fitFunc)
+            est = self._predictRunTime('fitMap', [np.hypot(tmp['x'], tmp['y']) for tmp in params
+                                                  if self.allFits[tmp['_k']]=={}])
+            if not self._checkRunTime(est, upper=adaptive):
+                return
+        else:
+            print('')
+        print('')
+        # -- parallel on N-1 cores
+        p = self._pool()
+        data = self._poolData(p)
+        if adaptive:
+            # -- coarse grid first, then the other points if needed
+            order = [k for k in range(len(params)) if _coarse[k]]+\
+                    [k for k in range(len(params)) if not _coarse[k]]
+            xy = np.array([[tmp['x'], tmp['y']] for tmp in params])
+            neighbours = scipy.spatial.cKDTree(xy).query_ball_point(xy, 1.5*np.array(_spacing))
+            def _mapped(k):
+                # -- neighbours of k (at least 2) already converged to one minimum
+                best = [self.allFits[j]['best'] for j in neighbours[k] if
+                        j!=k and self.allFits[j]!={}]
+                if len(best)<2 or not self.rmin**2<=best[0]['x']**2+best[0]['y']**2<=self.rmax**2:
+                    return False
+                return all([(b['x']-best[0]['x'])**2+(b['y']-best[0]['y'])**2<=
+                            (0.5*self.minSpatialScale)**2 for b in best])
+            def _starts():
+                # -- consumed as the fits are submitted, see _map
+                for k in order:
+                    if self.allFits[k]!={}:
+                        # -- done while estimating the time
+                        continue
+                    elif _coarse[k] or not _mapped(k):
+                        yield (params[k], data, self.observables, self.instruments,
+                               None, doNotFit)
+                    else:
+                        self.skippedFitMap.append(params[k])
+                        # -- for the progress bar
+                        self.Nfits -= 1
+            self._map(p, _fitFunc, _starts(), self._cb_fitFunc,
+                      N=len([k for k in order if self.allFits[k]=={}]))
+        else:
+            self._map(p, _fitFunc, [(tmp, data, self.observables, self.instruments,
+                                     None, doNotFit) for tmp in params
+                                    if self.allFits[tmp['_k']]=={}],
+                      self._cb_fitFunc)
         print(' | grid of fit took %.1f seconds'%(time.time()-t0))
+        if adaptive:
+            print(' | %d starting points out of %d skipped (in already mapped minima)'%(
+                    len(self.skippedFitMap), len(params)))
+        result['internal']['skipped starts'] = [(tmp['x'], tmp['y']) for tmp in self.skippedFitMap]
         print(' | Computing map of interpolated Chi2 minima')
 
         # -- keep only real fits
         self.allFits = list(filter(lambda x: x!={}, self.allFits))
         for i,f in enumerate(self.allFits):
-            f['init'] = params[i]
+            f['init'] = params[f['_k']]
         # -- keep only fits within range
         self.allFits = list(filter(lambda x: (x['best']['x']**2+x['best']['y']**2)>=self.rmin**2 and
                                              (x['best']['x']**2+x['best']['y']**2)<=self.rmax**2, self.allFits))
@@ -2073,49 +3783,25 @@ class Open:
             plt.ylabel('mas')
             plt.legend()
 
-        # -- count number of unique minima, start with first one, add N sigma:
-        allMin = [self.allFits[0]]
-        allMin[0]['nsigma'] =  _nSigmas(self.chi2_UD,  allMin[0]['chi2'], self.ndata()-1)
-        for f in self.allFits:
-            chi2 = []
-            for a in allMin:
-                tmp, n = 0., 0.
-                for k in ['x', 'y', 'f', 'diam']:
-                    if k in f['uncer'].keys() and k in a['uncer'].keys() and\
-                            f['uncer'][k]!=0 and a['uncer'][k]!=0:
-                        if k == 'f':
-                            tmp += (f['best'][k]-a['best'][k])**2/(0.01)**2
-                        elif k == 'diam':
-                            tmp += (f['best'][k]-a['best'][k])**2/(0.1*self.minSpatialScale)**2
-                        else: # -- for x and y
-                            tmp += (f['best'][k]-a['best'][k])**2/(0.5*self.minSpatialScale)**2
-                        n += 1.
-                tmp /= n
-                chi2.append(tmp)
-            if not any([c<=1 for c in chi2]) and \
-                    f['best']['x']**2+f['best']['y']**2>=self.rmin**2 and \
-                    f['best']['x']**2+f['best']['y']**2<=self.rmax**2:
-                allMin.append(f)
-                allMin[-1]['nsigma'] = _nSigmas(self.chi2_UD,  allMin[-1]['chi2'], self.ndata()-1)
-                try:
-                    allMin[-1]['best']['f'] = np.abs(allMin[-1]['best']['f'])
-                except:
-                    pass
+        # -- count number of unique minima, add N sigma:
+        allMin = [self.allFits[i] for i in _uniqueMinima(self.allFits, self.minSpatialScale)]
+        for a in allMin:
+            a['nsigma'] = _nSigmas(self.chi2_UD, a['chi2'], self.ndata()-1)
 
         if self.observables==['v2']:
             # -- symetric
             _allMin = []
-            for a in allMin:
-                # -- copy fit
-                tmp = {k:a[k].copy() for k in a.keys() if isinstance(a[k], dict)}
-                tmp.update({k:a[k] for k in a.keys() if not isinstance(a[k], dict)})
-                tmp['best']['x'] *= -1
-                tmp['best']['y'] *= -1
-                tmp['init']['x'] *= -1
-                tmp['init']['y'] *= -1
-                d = min([(tmp['best']['x']-x['best']['x'])**2 +
-                         (tmp['best']['y']-x['best']['y'])**2 for x in allMin])
-                if d >0.1**2:
+            tree = scipy.spatial.cKDTree([(a['best']['x'], a['best']['y']) for a in allMin])
+            d = tree.query([(-a['best']['x'], -a['best']['y']) for a in allMin])[0]
+            for i,a in enumerate(allMin):
+                if d[i]>0.1:
+                    # -- copy fit
+                    tmp = {k:a[k].copy() for k in a.keys() if isinstance(a[k], dict)}
+                    tmp.update({k:a[k] for k in a.keys() if not isinstance(a[k], dict)})
+                    tmp['best']['x'] *= -1
+                    tmp['best']['y'] *= -1
+                    tmp['init']['x'] *= -1
+                    tmp['init']['y'] *= -1
                     _allMin.append(tmp)
             allMin = allMin+_allMin
         result['internal']['all minima'] = allMin
@@ -2128,12 +3814,15 @@ class Open:
                                 np.percentile([f['dist'] for f in self.allFits], 10),
                                 np.percentile([f['dist'] for f in self.allFits], 50),
                                 np.percentile([f['dist'] for f in self.allFits], 90),))
-        self.Nopt = self.rmax/np.nanmedian([f['dist'] for f in self.allFits])*np.sqrt(2)
+        # -- fits which did not move (median displacement 0) give no estimate
+        d = np.nanmedian([f['dist'] for f in self.allFits])
+        self.Nopt = self.rmax/d*np.sqrt(2) if d>0 else 0
         self.Nopt = max(np.sqrt(2*len(allMin)), self.Nopt)
         self.Nopt = int(np.ceil(self.Nopt))
         self.stepOptFitMap = 2*self.rmax/self.Nopt
         result['internal']['optimum step'] = self.stepOptFitMap
-        Naf = len(self.allFits)
+        # -- skipped starting points would have converged to known minima
+        Naf = len(self.allFits)+len(self.skippedFitMap)
         #if self.observables==['v2']:
         #    Naf *= 2 #
         print(' | %.1f fit per minima with step %.2f'%(Naf/len(allMin), step))
@@ -2155,6 +3844,7 @@ class Open:
             reliability = 'reliable'
 
         result['result']['reliability'] = reliability
+        result['result']['skipped starts'] = len(self.skippedFitMap)
 
         # == plot chi2 min map:
         # -- limited in 32 bit, hacking something dirty:
@@ -2164,7 +3854,8 @@ class Open:
         Nx = 2*int(self.rmax/step)+1
         Ny = 2*int(self.rmax/step)+1
 
-        if len(allMin)**2*Nx*Ny >= sys.maxsize:
+        if CONFIG['map interpolation']=='legacy rbf' and \
+            len(allMin)**2*Nx*Ny >= sys.maxsize:
             # -- interpolation grid is too large
             Nx = int(np.sqrt(sys.maxsize/(len(allMin)**2)))-1
             Ny = int(np.sqrt(sys.maxsize/(len(allMin)**2)))-1
@@ -2178,7 +3869,8 @@ class Open:
         dx = np.mean(np.diff(_x))
         dy = np.mean(np.diff(_y))
 
-        print(' | Rbf interpolating: %d points -> %d pixels map'%(len(allMin), Nx*Ny))
+        print(' | %s interpolating: %d points -> %d pixels map'%(
+                CONFIG['map interpolation'], len(allMin), Nx*Ny))
         if CONFIG['chi2 scale']!='auto':
             chi2Scale = CONFIG['chi2 scale']
         else:
@@ -2188,16 +3880,13 @@ class Open:
                 chi2Scale = 'lin'
 
         if chi2Scale=='log':
-            rbf = scipy.interpolate.Rbf([x['best']['x'] for x in allMin],
-                                        [x['best']['y'] for x in allMin],
-                                        [np.log10(x['chi2']) for x in allMin],
-                                        function='linear')
+            _Z = _interpMap([x['best']['x'] for x in allMin],
+                            [x['best']['y'] for x in allMin],
+                            [np.log10(x['chi2']) for x in allMin], _X, _Y)
         else:
-            rbf = scipy.interpolate.Rbf([x['best']['x'] for x in allMin],
-                                        [x['best']['y'] for x in allMin],
-                                        [x['chi2'] for x in allMin],
-                                        function='linear')
-        _Z = rbf(_X, _Y)
+            _Z = _interpMap([x['best']['x'] for x in allMin],
+                            [x['best']['y'] for x in allMin],
+                            [x['chi2'] for x in allMin], _X, _Y)
 
         # -- http://www.aanda.org/articles/aa/pdf/2011/11/aa17719-11.pdf section 3.2
         if chi2Scale=='log':
@@ -2258,6 +3947,10 @@ class Open:
                 plt.plot([f['best']['x'], f['init']['x']],
                          [f['best']['y'], f['init']['y']], '-y',
                          alpha=0.3, linewidth=2)
+            if len(self.skippedFitMap):
+                plt.plot([tmp['x'] for tmp in self.skippedFitMap],
+                         [tmp['y'] for tmp in self.skippedFitMap], '.y',
+                         alpha=0.3, label='skipped')
             plt.xlabel(r'E $\leftarrow\, \Delta \alpha$ (mas)')
 
             plt.ylabel(r'$\Delta \delta\, \rightarrow$ N (mas)')
@@ -2405,7 +4098,7 @@ class Open:
             print('*'*3, 'do an additional fit by fitting also the bandwidth smearing', '*'*3)
             print('*'*67)
 
-            fit = _fitFunc(param, self._chi2Data, self.observables,
+            fit = _fitFunc(param, self._fitData(), self.observables,
                             self.instruments,fitAlso)
             print('  > chi2 = %5.3f'%fit['chi2'])
             tmp = ['x', 'y', 'f', 'diam*']
@@ -2416,6 +4109,7 @@ class Open:
         self.history.append(result)
         return
 
+    @_profiled
     def fitBoot(self, N=None, param=None, fig=2, fitAlso=None, doNotFit=[], useMJD=True,
                 monteCarlo=False, corrSpecCha=None, nSigmaClip=4.5, addCompanion=None,
                 removeCompanion=None, debug=False):
@@ -2479,35 +4173,21 @@ class Open:
         self._progTime = [time.time(), time.time()]
         self.allFits, self._prog = [{} for k in range(N)], 0.0
         self.Nfits = N
-        # -- estimate how long it will take, in two passes
-        if not CONFIG['long exec warning'] is None:
-            params, Ntest = [], 2*max(multiprocessing.cpu_count()-1,1)
-            for i in range(Ntest):
-                tmp = {k:param[k] for k in param.keys()}
-                tmp['_k'] = i
-                for _k in self.dwavel.keys():
-                    tmp['dwavel;'+_k] = self.dwavel[_k]
-                params.append((tmp, self._chi2Data, self.observables,
-                                self.instruments))
-            est = self._estimateRunTime(_fitFunc, params)
-            est *= self.Nfits
-            print('... it should take about %d seconds'%(int(est)))
-            self.allFits, self._prog = [{} for k in range(N)], 0.0
-            self._progTime = [time.time(), time.time()]
-            if not CONFIG['long exec warning'] is None and\
-                 est>CONFIG['long exec warning']:
-                print(" > WARNING: this will take too long. ")
-                print(" | Increase CONFIG['long exec warning'] if you want to run longer computations.")
-                print(" | e.g. "+__name__+".CONFIG['long exec warning'] = %d"%int(1.2*est))
-                print(" | set it to 'None' and the warning will disapear... at your own risks!")
-                return
-
         tmp = {k:param[k] for k in param.keys()}
         for _k in self.dwavel.keys():
             tmp['dwavel;'+_k] = self.dwavel[_k]
-        # -- reference fit (all data)
-        refFit = _fitFunc(tmp, self._chi2Data, self.observables,
-                          self.instruments, fitAlso, doNotFit)
+        # -- reference fit (all data), which also calibrates the estimate of
+        #    how long the bootstrap will take
+        refFit = self._probeRunTime('fitBoot', _fitFunc,
+                                    [(tmp, self._fitData(), self.observables,
+                                      self.instruments, fitAlso, doNotFit)])[0]
+        if not CONFIG['long exec warning'] is None:
+            est = self._predictRunTime('fitBoot', np.hypot(tmp.get('x', 0.0),
+                                                           tmp.get('y', 0.0))*np.ones(N))
+            if not self._checkRunTime(est):
+                return
+        else:
+            print('')
         print(' | ------------------------------------------')
         print(' | Reference Least Square Fit (all data):')
         print(' | chi2 = %.3f'%(refFit['chi2']))
@@ -2542,63 +4222,63 @@ class Open:
         print('')
         t0 = time.time()
         allMasks = []
-        for i in range(N): # -- looping fits
-            if useMJD:
-                selected = [mjds[np.random.randint(len(mjds))] for i in range(len(mjds))]
-            tmp = {k:param[k] for k in param.keys()}
-            for _k in self.dwavel.keys():
-                tmp['dwavel;'+_k] = self.dwavel[_k]
-            tmp['_k'] = i
-            # -- Bootstrap data:
-            data = []
-            if useMJD:
-                allMasks.append(tuple(sorted(selected)))
-            for d in self._chi2Data:
-                # -- for each data file
-                data.append([_d if i==0 else _d.copy() for i,_d in enumerate(d)]) # recreate a list of data
-                if monteCarlo:
-                    # -- Monte Carlo noise ----------------------------------------------------------
-                    if corrSpecCha is None:
-                        data[-1][-2] = d[-2] + 1.0*d[-1] * np.random.randn(d[-1].shape[0], d[-1].shape[1])
-                    else:
-                        print('error! >> not implemented')
-                        return
-                else:
-                    # -- Bootstrapping:
-                    if useMJD:
-                        mask = np.zeros(d[-1].shape)
-                        for j in selected:
-                            mask[np.abs(d[-3]-j)<1e-8] += 1
-                    else:
+        if monteCarlo and not corrSpecCha is None:
+            print('error! >> not implemented')
+            return
+        def _replicas():
+            # -- Monte Carlo: one set of noisy data per fit, built as they are computed
+            for i in range(N): # -- looping fits
+                tmp = {k:param[k] for k in param.keys()}
+                for _k in self.dwavel.keys():
+                    tmp['dwavel;'+_k] = self.dwavel[_k]
+                tmp['_k'] = i
+                data = []
+                for d in self._chi2Data:
+                    # -- for each data file
+                    data.append([_d if i==0 else _d.copy() for i,_d in enumerate(d)]) # recreate a list of data
+                    data[-1][-2] = d[-2] + 1.0*d[-1] * np.random.randn(d[-1].shape[0], d[-1].shape[1])
+                yield (tmp, data, self.observables, self.instruments, fitAlso,
+                       doNotFit)
+        fitData = self._fitData()
+        # -- blocks of self._chi2Data in fitData (observables and instruments)
+        selectedBlocks = set([id(d) for d in fitData.obs])
+        data = self._poolData(p)
+        def _counts():
+            # -- bootstrap: the number of times each data point (see _FitData)
+            #    is drawn, applied as weights of the residuals by _fitFunc
+            for i in range(N): # -- looping fits
+                if useMJD:
+                    selected = np.array([mjds[np.random.randint(len(mjds))] for i in range(len(mjds))])
+                    allMasks.append(tuple(sorted(selected)))
+                tmp = {k:param[k] for k in param.keys()}
+                for _k in self.dwavel.keys():
+                    tmp['dwavel;'+_k] = self.dwavel[_k]
+                tmp['_k'] = i
+                counts = []
+                for d in self._chi2Data:
+                    if not useMJD:
+                        # -- each spectral channel drawn 0, 1 or 2 times, drawn
+                        #    for all the blocks, in the same order as before
                         mask = np.random.rand(d[-1].shape[-1])
-                        mask = np.float_(mask>=1/3.) + np.float_(mask>=2/3.)
-
-                    # -- weight the error bars
-                    # - chi2 = sum( ((yi-mi)/ei)**2 )/N
-                    # - each data point's contribution goes as mask**2
-                    # - hence we want sum(mask**2) = N
-
-                    mask *= np.sqrt(mask.size/np.sum(mask**2))
-                    mask[mask==0] = np.nan
-
-                    if len(d[-1].shape)==2:
-                        data[-1][-1] = data[-1][-1]/mask[None,:]
+                        mask = np.int8(mask>=1/3.) + np.int8(mask>=2/3.)
+                    if not id(d) in selectedBlocks:
+                        continue
+                    if useMJD:
+                        # -- number of times the date of each point is drawn
+                        u, n = np.unique(selected, return_counts=True)
+                        mjd = np.broadcast_to(d[-3], d[-1].shape).ravel()
+                        k = np.clip(np.searchsorted(u, mjd-1e-8), 0, len(u)-1)
+                        counts.append(n[k]*(np.abs(u[k]-mjd)<1e-8))
                     else:
-                        data[-1][-1] = data[-1][-1]/mask
-                    data[-1][-1] = np.nan_to_num(data[-1][-1], nan=1e8)
-
-            if p is None:
-                # -- single thread:
-                self._cb_fitFunc(_fitFunc(tmp, data, self.observables,
-                                          self.instruments, fitAlso, doNotFit))
-            else:
-                # -- multi thread:
-                p.apply_async(_fitFunc, (tmp, data, self.observables,
-                                self.instruments, fitAlso, doNotFit),
-                                        callback=self._cb_fitFunc)
-        if not p is None:
-            p.close()
-            p.join()
+                        counts.append(np.ravel(np.broadcast_to(mask, d[-1].shape)))
+                counts = np.concatenate(counts)
+                counts = counts.astype(np.int8 if counts.max()<128 else np.int16)
+                yield (tmp, data, self.observables, self.instruments, fitAlso,
+                       doNotFit, counts)
+        if monteCarlo:
+            self._map(p, _fitFunc, _replicas(), self._cb_fitFunc, N=N)
+        else:
+            self._map(p, _fitFunc, _counts(), self._cb_fitFunc, N=N)
 
         if debug:
             print('debug: %d different data masks'%len(set(allMasks)))
@@ -2848,13 +4528,9 @@ class Open:
         for _k in self.dwavel.keys():
             param['dwavel;'+_k] = self.dwavel[_k]
         print(' (plotting _chi2Data instead of _rawData)')
-        _meas, _errs, _uv, _types, _wl = _generateFitData(#self._rawData,
-                                                          self._chi2Data,
-                                                          self.observables,
-                                                          self.instruments)
-        _mod = _modelObservables(list(filter(lambda c: c[0].split(';')[0] in self.observables
-                                    and c[0].split(';')[1] in self.instruments,
-                                self._chi2Data)), param)
+        data = self._fitData()
+        _meas, _errs, _uv, _types, _wl = data.meas, data.errs, data.uv, data.types, data.wl
+        _mod = _modelObservables(data.obs, param)
         #print(_meas.shape)
         plt.close(fig)
         plt.figure(fig, figsize=(7,7))
@@ -2949,6 +4625,7 @@ class Open:
             print('did not work')
         return
 
+    @_profiled
     def detectionLimit(self, step=None, diam=None, fig=4, addCompanion=None,
                         removeCompanion=None, drawMaps=True, rmin=None, rmax=None,
                         methods = ['Absil', 'injection'], fratio=1.):
@@ -2957,7 +4634,8 @@ class Open:
         drawMaps: display the detection maps in addition to the radial profile (default)
 
         Apart from the plots, the radial detection limits are stored in the dictionnary
-        'self.f3s'.
+        'self.f3s'. Positions where 3 sigma is not reached for flux ratios up
+        to 100% are nan, with a warning.
         """
         if isinstance(methods, str):
             methods = [methods]
@@ -3006,68 +4684,64 @@ class Open:
 
         print(' | Detection Limit Map %dx%d'%(N,N),end=' ')
 
-        # -- estimate how long it will take
+        # -- prepare grid:
+        allX = np.linspace(-self.rmax, self.rmax, N)
+        allY = np.linspace(-self.rmax, self.rmax, N)
+        todo = (allX[None,:]**2+allY[:,None]**2 <= self.rmax**2)*\
+               (allX[None,:]**2+allY[:,None]**2 >= self.rmin**2)
+        def _task(I, J, data, method):
+            params = {'f':fratio, 'diam*':self.diam, 'alpha*':self.alpha,
+                      '_i':I, '_j':J}
+            for _k in self.dwavel.keys():
+                params['dwavel;'+_k] = self.dwavel[_k]
+            return (params, allX[I], allY[J], data, self.observables,
+                    self.instruments, method)
+
+        # -- estimate how long it will take: a few positions are computed
+        #    here for each method, and kept
+        probes = {method:[] for method in methods}
         if not CONFIG['long exec warning'] is None:
-            Ntest = 2*max(multiprocessing.cpu_count()-1,1)
-            params = []
-            for k in range (Ntest):
-                tmp = {'x':10*np.random.rand(), 'y':10*np.random.rand(),
-                       'f':fratio, 'diam*':self.diam, 'alpha*':self.alpha}
-                for _k in self.dwavel.keys():
-                    tmp['dwavel;'+_k] = self.dwavel[_k]
-                params.append((tmp, self._chi2Data, self.observables,
-                                self.instruments, self._delta))
-            # -- Absil is twice as fast as injection
-            est = 1.5*self._estimateRunTime(_detectLimit, params)
-            est *= N**2
-            print('... it should take about %d seconds'%(int(est)))
-            if not CONFIG['long exec warning'] is None and\
-                 est>CONFIG['long exec warning']:
-                print(" > WARNING: this will take too long. ")
-                print(" | Increase CONFIG['long exec warning'] if you want to run longer computations.")
-                print(" | e.g. "+__name__+".CONFIG['long exec warning'] = %d"%int(1.2*est))
-                print(" | set it to 'None' and the warning will disapear... at your own risks!")
+            J, I = np.where(todo)
+            k = np.unique(np.linspace(0, len(I)-1, min(len(I), 9)).astype(int))
+            est = 0.0
+            for method in methods:
+                if len(k):
+                    self._probeRunTime('detectionLimit;'+method, _detectLimitBlock,
+                                       [_task(I[k[i:j]], J[k[i:j]], self._fitData(), method)
+                                        for i,j in [(0, 1), (1, len(k))] if j>i],
+                                       probes[method].append, warmup=True)
+                    est += self._predictRunTime('detectionLimit;'+method,
+                                                np.hypot(np.delete(allX[I], k),
+                                                         np.delete(allY[J], k)))
+            if len(k) and not self._checkRunTime(est):
                 return
         else:
             print('')
 
-        #print('estimated time:', est)
-        #t0 = time.time()
-
-        # -- prepare grid:
-        allX = np.linspace(-self.rmax, self.rmax, N)
-        allY = np.linspace(-self.rmax, self.rmax, N)
         self.allf3s = {} # flux at 3 sigma (%)
         for method in methods:
             print(" | Method:", method)
             print('')
             self.f3s = np.zeros((N,N))
-            self.f3s[allX[None,:]**2+allY[:,None]**2 > self.rmax**2] = -1
-            self.f3s[allX[None,:]**2+allY[:,None]**2 < self.rmin**2] = -1
+            self.f3s[~todo] = -1
+            for r in probes[method]:
+                self.f3s[r[1], r[0]] = r[2]
             self._prog = 0.0
             self._progTime = [time.time(), time.time()]
             # -- parallel treatment:
             p = self._pool()
-            for i,x in enumerate(allX):
-                for j,y in enumerate(allY):
-                    if self.f3s[j,i]==0:
-                        params = {'x':x, 'y':y, 'f':fratio, 'diam*':self.diam,
-                                  '_i':i, '_j':j, 'alpha*':self.alpha}
-                        for _k in self.dwavel.keys():
-                            params['dwavel;'+_k] = self.dwavel[_k]
-                        if p is None:
-                            # -- single thread:
-                            self._cb_nsigmaFunc(_detectLimit(params, self._chi2Data,
-                                        self.observables, self.instruments,
-                                           self._delta, method))
-                        else:
-                            # -- parallel:
-                            p.apply_async(_detectLimit, (params, self._chi2Data,
-                                        self.observables, self.instruments,
-                                       self._delta, method), callback=self._cb_nsigmaFunc)
-            if not p is None:
-                p.close()
-                p.join()
+            data = self._poolData(p)
+            # -- by blocks of positions
+            J, I = np.where(self.f3s==0)
+            Nb = self._batchSize(len(I))
+            tasks = [_task(I[k:k+Nb], J[k:k+Nb], data, method)
+                     for k in range(0, len(I), Nb)]
+            self._map(p, _detectLimitBlock, tasks, self._cb_nsigmaFunc)
+            n = np.sum(np.isnan(self.f3s))
+            if n>0:
+                print(' > WARNING: 3 sigma detection not reached for %d positions (out of %d)'%(
+                        n, np.sum(todo)))
+                print(' |          their flux ratio is nan (see _detectLimitBlock)')
             # -- take care of unfitted zone, for esthetics
             self.f3s[self.f3s<=0] = np.median(self.f3s[self.f3s>0])
             self.allf3s[method] = self.f3s.copy()
@@ -3155,21 +4829,107 @@ class Open:
                                                 self.rmax/float(N), 90)
         return
 
+def _slidingWindows(x, h):
+    """
+    for "x" sorted, indices lo, hi such that x[lo[i]:hi[i]] are the points
+    with abs(x-x[i])<h
+    """
+    n = len(x)
+    lo = np.searchsorted(x, x-h, side='right')
+    hi = np.searchsorted(x, x+h, side='left')
+    # -- x-h and x+h are rounded: same test as abs(x-x[i])<h at the edges
+    inside = lambda j, k: np.abs(x[j]-x[k])<h
+    for a, step, test, cond in [(lo, -1, lambda k: inside(lo[k]-1, k), lambda: lo>0),
+                                (lo, 1, lambda k: ~inside(lo[k], k), lambda: lo<hi),
+                                (hi, 1, lambda k: inside(hi[k], k), lambda: hi<n),
+                                (hi, -1, lambda k: ~inside(hi[k]-1, k), lambda: hi>lo)]:
+        k = np.where(cond())[0]
+        k = k[test(k)]
+        while len(k):
+            a[k] += step
+            k = k[cond()[k]]
+            k = k[test(k)]
+    return lo, hi
+
 def sliding_percentile(x, y, dx, percentile=50, smooth=True):
-    res = np.zeros(len(y))
-    for i in range(len(x)):
-        res[i] = np.percentile(y[np.abs(x-x[i])<dx/2.], percentile)
+    """
+    for each point, "percentile" of the "y" of the points within dx/2 in "x"
+    (linear interpolation, as np.percentile). If smooth, the result is then
+    averaged over the points within dx/4.
+
+    The points are sorted in x and the window slides along them. The values in
+    the window are counted in a Fenwick tree over the ranks of "y", so that
+    adding or removing a point and finding the k-th value of the window take
+    O(log N): O(N log N) in total, whatever the width of the window.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    o = np.argsort(x, kind='stable')
+    xs, ys = x[o], y[o]
+    lo, hi = _slidingWindows(xs, dx/2.)
+    q = percentile/100.
+    res = np.zeros(len(ys))
+    # -- ranks of the finite values of ys (NaN: -1)
+    finite = ~np.isnan(ys)
+    vals = np.sort(ys[finite], kind='stable')
+    rank = -np.ones(len(ys), dtype=int)
+    rank[np.where(finite)[0][np.argsort(ys[finite], kind='stable')]] = np.arange(len(vals))
+    rank, vals = rank.tolist(), vals.tolist()
+    M = len(vals)
+    tree = [0]*(M+1)
+    top = 1<<max(M.bit_length()-1, 0)
+    def _add(r, d):
+        r += 1
+        while r<=M:
+            tree[r] += d
+            r += r & -r
+    def _kth(k):
+        # -- k-th (from 0) smallest value in the window
+        p, s = 0, top
+        while s:
+            if p+s<=M and tree[p+s]<=k:
+                p += s
+                k -= tree[p]
+            s >>= 1
+        return vals[p]
+    n, nnan, j0, j1 = 0, 0, 0, 0
+    for i in range(len(xs)):
+        # -- points entering and leaving the window
+        while j1<hi[i]:
+            if rank[j1]<0:
+                nnan += 1
+            else:
+                _add(rank[j1], 1)
+                n += 1
+            j1 += 1
+        while j0<min(lo[i], j1):
+            if rank[j0]<0:
+                nnan -= 1
+            else:
+                _add(rank[j0], -1)
+                n -= 1
+            j0 += 1
+        if nnan>0 or n==0:
+            res[i] = np.nan
+            continue
+        v = q*(n-1)
+        k = int(v)
+        a, t = _kth(k), v-k
+        b = _kth(k+1) if t>0 else a
+        res[i] = b-(b-a)*(1-t) if t>=0.5 else a+(b-a)*t
     if smooth:
-        resp = np.zeros(len(y))
-        for i in range(len(x)):
-            resp[i] = res[np.abs(x-x[i])<dx/4.].mean()
-        return resp
-    else:
-        return res
+        lo, hi = _slidingWindows(xs, dx/4.)
+        cs = np.concatenate([[0.], np.cumsum(np.nan_to_num(res))])
+        cn = np.concatenate([[0], np.cumsum(np.isnan(res))])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            res = (cs[hi]-cs[lo])/(hi-lo)
+        res[cn[hi]-cn[lo]>0] = np.nan
+    tmp = np.zeros(len(res))
+    tmp[o] = res
+    return tmp
 
 def _dpfit_leastsqFit(func, x, params, y, err=None, fitOnly=None, verbose=False,
                         doNotFit=[], epsfcn=1e-8, ftol=1e-5, fullOutput=True,
-                        normalizedUncer=True, follow=None):
+                        normalizedUncer=True, follow=None, jac=None, weights=None):
     """
     - params is a Dict containing the first guess.
 
@@ -3184,6 +4944,14 @@ def _dpfit_leastsqFit(func, x, params, y, err=None, fitOnly=None, verbose=False,
     - follow=[...] list of parameters to "follow" in the fit, i.e. to print(in)
       verbose mode
 
+    - jac: optional function jac(x, params, keys) returning func(x, params) and
+      its derivatives with respect to the parameters "keys", as an array of
+      shape (len(y), len(keys)). It is then used by leastsq instead of finite
+      differences (y and err must be 1D ndarrays).
+
+    - weights: optional weights of the residuals (same length as y, 1D
+      ndarray), e.g. the number of times each point is drawn in a bootstrap.
+
     - fitOnly is a LIST of keywords to fit. By default, it fits all
       parameters in 'params'. Alternatively, one can give a list of
       parameters not to be fitted, as 'doNotFit='
@@ -3215,7 +4983,7 @@ def _dpfit_leastsqFit(func, x, params, y, err=None, fitOnly=None, verbose=False,
         if len(doNotFit)>0:
             fitOnly = list(filter(lambda x: x not in doNotFit, params.keys()))
         else:
-            fitOnly = params.keys()
+            fitOnly = list(params.keys())
         fitOnly.sort() # makes some display nicer
 
     # -- build fitted parameters vector:
@@ -3259,11 +5027,17 @@ def _dpfit_leastsqFit(func, x, params, y, err=None, fitOnly=None, verbose=False,
         info, mesg, ier = [], '', ''
     else:
         # -- actual fit, using leastsq
+        if jac is None:
+            Dfun = None
+        else:
+            Dfun = lambda *args: _dpfit_fitJac(*args, jac=jac)
+        t0 = _profileTime()
         plsq, cov, info, mesg, ier = \
                   scipy.optimize.leastsq(_dpfit_fitFunc, pfit,
-                        args=(fitOnly,x,y,err,func,pfix,verbose,follow,),
-                        full_output=True, epsfcn=epsfcn, ftol=ftol,
+                        args=(fitOnly,x,y,err,func,pfix,verbose,follow,weights,),
+                        Dfun=Dfun, full_output=True, epsfcn=epsfcn, ftol=ftol,
                         maxfev=1000,)
+        _profileAdd('leastsq', t0)
 
     # -- best fit -> agregate to pfix
     for i,k in enumerate(fitOnly):
@@ -3271,7 +5045,7 @@ def _dpfit_leastsqFit(func, x, params, y, err=None, fitOnly=None, verbose=False,
 
     # -- reduced chi2
     model = func(x,pfix)
-    tmp = _dpfit_fitFunc(plsq, fitOnly, x, y, err, func, pfix)
+    tmp = _dpfit_fitFunc(plsq, fitOnly, x, y, err, func, pfix, weights=weights)
     try:
         chi2 = (np.array(tmp)**2).sum()
     except:
@@ -3383,10 +5157,11 @@ def _dpfit_leastsqFit(func, x, params, y, err=None, fitOnly=None, verbose=False,
     return pfix
 
 def _dpfit_fitFunc(pfit, pfitKeys, x, y, err=None, func=None, pfix=None,
-                verbose=False, follow=None):
+                verbose=False, follow=None, weights=None):
     """
     interface to leastsq from scipy:
     - x,y,err are the data to fit: f(x) = y +- err
+    - weights (optional) multiply the residuals (y and err being ndarrays)
     - pfit is a list of the paramters
     - pfitsKeys are the keys to build the dict
     pfit and pfix (optional) and combines the two
@@ -3394,6 +5169,7 @@ def _dpfit_fitFunc(pfit, pfitKeys, x, y, err=None, func=None, pfix=None,
 
     """
     global verboseTime
+    t0 = _profileTime()
     params = {}
     # -- build dic from parameters to fit and their values:
     for i,k in enumerate(pfitKeys):
@@ -3411,6 +5187,8 @@ def _dpfit_fitFunc(pfit, pfitKeys, x, y, err=None, func=None, pfix=None,
         res = (np.abs(func(x,params)-y)/err).flatten()
         # -- avoid NaN! -> make them 0's
         res = np.nan_to_num(res)
+        if not weights is None:
+            res *= weights
     else:
         # much slower: this time assumes y (and the result from func) is
         # a list of things, each convertible in np.array
@@ -3456,8 +5234,31 @@ def _dpfit_fitFunc(pfit, pfitKeys, x, y, err=None, func=None, pfix=None,
                 print(' '.join([k+'='+'%5.2e'%params[k] for k in follow]))
             except:
                 print('')
+    _profileAdd('leastsq: residuals', t0)
     return res
 
+def _dpfit_fitJac(pfit, pfitKeys, x, y, err=None, func=None, pfix=None,
+                verbose=False, follow=None, weights=None, jac=None):
+    """
+    Jacobian of _dpfit_fitFunc, as "Dfun" for leastsq, using the model
+    derivatives given by "jac" (see _dpfit_leastsqFit)
+    """
+    t0 = _profileTime()
+    params = {}
+    for i,k in enumerate(pfitKeys):
+        params[k]=pfit[i]
+    for k in pfix:
+        params[k]=pfix[k]
+    if err is None:
+        err = np.ones(np.array(y).shape)
+    model, J = jac(x, params, pfitKeys)
+    # -- residuals are |model-y|/err, NaN being 0's
+    s = np.nan_to_num(np.sign(model-y)/err)
+    if not weights is None:
+        s *= weights
+    _profileAdd('leastsq: jacobian', t0)
+    return np.nan_to_num(s[:,None]*J)
+
 def _dpfit_fitFuncCF(x, *pfit):
     """
     interface to curve_fit from scipy:
@@ -3556,6 +5357,35 @@ def _dpfit_dispCor(fit):
             print(c+col+tmp+'\033[0m', end=' ')
         print('')
 
+def _decomposeObsBatch(wl, data, err, order=1):
+    """
+    same as _decomposeObs, for all the rows of "data" and "err" (2D arrays,
+    wavelength "wl" along the second axis) at once: the weighted linear least
+    squares are solved together, using the normal equations.
+
+    returns the coefficients and their uncertainties, as 2 arrays of shape
+    (len(data), order+1). Rows without valid data are NaN.
+    """
+    X = (wl-wl.mean())[None,:]**np.arange(order+1)[:,None] # (order+1, Nwl)
+    # -- invalid points do not contribute (residuals set to 0, see _dpfit_fitFunc)
+    w = np.nan_to_num(1/err**2, nan=0.0, posinf=0.0)*np.isfinite(data)
+    y = np.nan_to_num(data)
+    M = np.einsum('rl,il,jl->rij', w, X, X)
+    cov = np.linalg.pinv(M)
+    p = np.einsum('rij,rj->ri', cov, np.einsum('rl,il,rl->ri', w, X, y))
+    model = p.dot(X)
+    # -- uncertainties normalized to the reduced chi2
+    chi2 = np.sum(w*(y-model)**2, axis=1)/(data.shape[1]-(order+1)+1)
+    ep = np.sqrt(np.abs(np.diagonal(cov, axis1=1, axis2=2))*chi2[:,None])
+    # -- statistical errors, as scatter around model, and systematic errors
+    with np.errstate(all='ignore'):
+        stat = np.nanstd(data - model, axis=1)
+        sys = np.nanmedian(np.sqrt(np.maximum(err**2-stat[:,None]**2, 0.0)), axis=1)
+    ep[:,0] = np.sqrt(ep[:,0]**2 + sys**2)
+    bad = np.all(np.isnan(data), axis=1) | np.all(np.isnan(err), axis=1)
+    p[bad,:], ep[bad,:] = np.nan, np.nan
+    return p, ep
+
 def _decomposeObs(wl, data, err, order=1, plot=False):
     """
     decompose data(wl)+-err as a polynomial of order "order" in (wl-wl.mean())
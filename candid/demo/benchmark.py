@@ -0,0 +1,351 @@
+"""
+Benchmark of CANDID on synthetic OIFITS files, shaped like the data of
+real instruments (baselines x spectral channels x dates), with an injected
+companion.
+
+run all the benchmarks and store the timings in a JSON file:
+
+    python benchmark.py -o candid_bench.json
+
+compare two JSON files (e.g. two versions of CANDID):
+
+    python benchmark.py --compare old.json new.json
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy
+
+try:
+    from astropy.io import fits
+except:
+    import pyfits as fits
+
+import candid
+
+# -- shapes of the data: telescopes, spectral channels (um), telescope
+#    diameter (m), longest baseline (m) and typical errors
+INSTRUMENTS = {
+    'PIONIER':       {'array':'VLTI', 'tel':'AT', 'Ntel':4, 'diam':1.8,
+                      'wl':(1.53, 1.77), 'Nwl':6, 'Bmax':130.,
+                      'errV2':0.02, 'errCP':1.0},
+    'GRAVITY_FT':    {'array':'VLTI', 'tel':'UT', 'Ntel':4, 'diam':8.2,
+                      'wl':(1.98, 2.40), 'Nwl':5, 'Bmax':130.,
+                      'errV2':0.01, 'errCP':0.5},
+    'GRAVITY_SC_MR': {'array':'VLTI', 'tel':'UT', 'Ntel':4, 'diam':8.2,
+                      'wl':(1.98, 2.45), 'Nwl':210, 'Bmax':130.,
+                      'errV2':0.02, 'errCP':1.0},
+    'MIRCX':         {'array':'CHARA', 'tel':'S', 'Ntel':6, 'diam':1.0,
+                      'wl':(1.50, 1.74), 'Nwl':8, 'Bmax':330.,
+                      'errV2':0.03, 'errCP':1.0},
+    'MATISSE_LM':    {'array':'VLTI', 'tel':'AT', 'Ntel':4, 'diam':1.8,
+                      'wl':(2.95, 4.05), 'Nwl':64, 'Bmax':130.,
+                      'errV2':0.05, 'errCP':2.0},
+}
+
+# -- number of dates (MJD) for each size
+SIZES = {'small':4, 'medium':12, 'large':36}
+
+# -- all the stages timed, in this order
+STAGES = ['Open', '_compute_delta', '_modelObservables', '_fitFunc',
+          'chi2Map', 'fitMap', 'fitBoot', 'detectionLimit']
+
+# -- companion injected in the data
+COMPANION = {'x':6.0, 'y':-12.0, 'f':2.0, 'diam*':0.8}
+
+def makeOifits(filename, instrument, Nmjd, companion=COMPANION, seed=0):
+    """
+    write in "filename" a synthetic OIFITS file for "instrument" (see
+    INSTRUMENTS) with "Nmjd" dates over a night, for a binary "companion" (x,
+    y in mas, f in %, diam* in mas), with gaussian noise. V2 and T3 (amplitude
+    and closure phase) for all the baselines and triangles of the telescopes.
+
+    returns the number of V2 and CP data points
+    """
+    ins = INSTRUMENTS[instrument]
+    rng = np.random.RandomState(seed)
+    # -- telescopes positions (m), baselines and triangles
+    T = rng.uniform(-0.5, 0.5, (ins['Ntel'], 2))*ins['Bmax']/np.sqrt(2)
+    base = [(i,j) for i in range(ins['Ntel']) for j in range(i+1, ins['Ntel'])]
+    tri = [(i,j,k) for i in range(ins['Ntel']) for j in range(i+1, ins['Ntel'])
+           for k in range(j+1, ins['Ntel'])]
+    wl = np.linspace(ins['wl'][0], ins['wl'][1], ins['Nwl'])
+    dwl = np.gradient(wl) if len(wl)>1 else np.array([0.05*wl[0]])
+    mjd = 58000.0 + np.linspace(-0.15, 0.15, Nmjd)
+    # -- earth rotation: projected baselines rotate with the hour angle
+    H = 2*np.pi*1.0027*(mjd-mjd.mean())
+    def uv(i, j):
+        b = T[j]-T[i]
+        return (b[0]*np.cos(H) + b[1]*np.sin(H),
+                0.7*(-b[0]*np.sin(H) + b[1]*np.cos(H)))
+    param = dict(companion)
+    param['dwavel'] = np.mean(dwl)
+
+    # -- V2
+    u = np.concatenate([uv(i,j)[0] for i,j in base])
+    v = np.concatenate([uv(i,j)[1] for i,j in base])
+    param['wavel'] = wl[None,:] + 0*u[:,None]
+    V2 = candid._V2binSlow([u[:,None]+0*wl[None,:], v[:,None]+0*wl[None,:]], param)
+    eV2 = ins['errV2']*np.ones(V2.shape)
+    V2 += eV2*rng.randn(*V2.shape)
+
+    # -- T3
+    u1 = np.concatenate([uv(i,j)[0] for i,j,k in tri])
+    v1 = np.concatenate([uv(i,j)[1] for i,j,k in tri])
+    u2 = np.concatenate([uv(j,k)[0] for i,j,k in tri])
+    v2 = np.concatenate([uv(j,k)[1] for i,j,k in tri])
+    param['wavel'] = wl[None,:] + 0*u1[:,None]
+    _b = lambda x: x[:,None]+0*wl[None,:]
+    T3 = candid._T3binSlow((_b(u1), _b(v1), _b(u2), _b(v2)), param)
+    eCP = ins['errCP']*np.ones(T3.shape)
+    CP = np.angle(T3, deg=True) + eCP*rng.randn(*T3.shape)
+    eT3 = ins['errV2']*np.ones(T3.shape)
+    T3amp = np.abs(T3) + eT3*rng.randn(*T3.shape)
+
+    insname, arrname = instrument, ins['array']
+    mjds = lambda n: np.repeat(mjd[None,:], n, axis=0).flatten()
+    hdus = [fits.PrimaryHDU()]
+    for k in ['x', 'y', 'f']:
+        hdus[0].header['INJCOMP'+k.upper()] = companion[k]
+
+    Nwl = len(wl)
+    h = fits.BinTableHDU.from_columns([
+            fits.Column(name='EFF_WAVE', format='E', array=wl*1e-6),
+            fits.Column(name='EFF_BAND', format='E', array=dwl*1e-6)])
+    h.header['EXTNAME'], h.header['INSNAME'] = 'OI_WAVELENGTH', insname
+    hdus.append(h)
+
+    h = fits.BinTableHDU.from_columns([
+            fits.Column(name='TEL_NAME', format='16A',
+                        array=['%s%d'%(ins['tel'], i+1) for i in range(ins['Ntel'])]),
+            fits.Column(name='DIAMETER', format='E',
+                        array=ins['diam']*np.ones(ins['Ntel']))])
+    h.header['EXTNAME'], h.header['ARRNAME'] = 'OI_ARRAY', arrname
+    hdus.append(h)
+
+    # -- rows are (baseline, date), as in the OIFITS files
+    _r = lambda x: np.reshape(x, (-1, Nwl))
+    h = fits.BinTableHDU.from_columns([
+            fits.Column(name='MJD', format='D', array=mjds(len(base))),
+            fits.Column(name='UCOORD', format='D', array=u),
+            fits.Column(name='VCOORD', format='D', array=v),
+            fits.Column(name='VIS2DATA', format='%dD'%Nwl, array=_r(V2)),
+            fits.Column(name='VIS2ERR', format='%dD'%Nwl, array=_r(eV2)),
+            fits.Column(name='FLAG', format='%dL'%Nwl,
+                        array=np.zeros(V2.shape, dtype=bool))])
+    h.header['EXTNAME'], h.header['INSNAME'] = 'OI_VIS2', insname
+    h.header['ARRNAME'] = arrname
+    hdus.append(h)
+
+    h = fits.BinTableHDU.from_columns([
+            fits.Column(name='MJD', format='D', array=mjds(len(tri))),
+            fits.Column(name='U1COORD', format='D', array=u1),
+            fits.Column(name='V1COORD', format='D', array=v1),
+            fits.Column(name='U2COORD', format='D', array=u2),
+            fits.Column(name='V2COORD', format='D', array=v2),
+            fits.Column(name='T3AMP', format='%dD'%Nwl, array=_r(T3amp)),
+            fits.Column(name='T3AMPERR', format='%dD'%Nwl, array=_r(eT3)),
+            fits.Column(name='T3PHI', format='%dD'%Nwl, array=_r(CP)),
+            fits.Column(name='T3PHIERR', format='%dD'%Nwl, array=_r(eCP)),
+            fits.Column(name='FLAG', format='%dL'%Nwl,
+                        array=np.zeros(CP.shape, dtype=bool))])
+    h.header['EXTNAME'], h.header['INSNAME'] = 'OI_T3', insname
+    h.header['ARRNAME'] = arrname
+    hdus.append(h)
+
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+    return V2.size, CP.size
+
+def _timeit(function, repeat=1):
+    """
+    runs "function" "repeat" times. returns the mean duration (s) and the last
+    result
+    """
+    t = time.time()
+    for i in range(repeat):
+        res = function()
+    return (time.time()-t)/repeat, res
+
+def runBenchmark(filename, Ncores=1, stages=STAGES, grid=20, Nboot=16):
+    """
+    time the "stages" (see STAGES) of an analysis of the OIFITS "filename",
+    using "Ncores" processes. The maps are computed on about "grid" x "grid"
+    pixels (fitMap on a grid twice coarser), fitBoot with "Nboot" fits.
+
+    returns a dict: stage -> duration (s). '_modelObservables' and '_fitFunc'
+    are per call.
+    """
+    candid.CONFIG['Ncores'] = Ncores
+    res = {}
+    t, o = _timeit(lambda: candid.Open(filename))
+    res['Open'] = t
+    rmax = 2.5*np.hypot(COMPANION['x'], COMPANION['y'])
+    step = 2*rmax/grid
+    param = dict(COMPANION)
+    for k in o.dwavel.keys():
+        param['dwavel;'+k] = o.dwavel[k]
+    try:
+        if '_compute_delta' in stages:
+            def _delta():
+                o._delta = []
+                o._compute_delta()
+            res['_compute_delta'] = _timeit(_delta)[0]
+        if '_modelObservables' in stages:
+            obs = o._fitData().obs
+            res['_modelObservables'] = _timeit(lambda: candid._modelObservables(obs, param),
+                                               repeat=5)[0]
+        if '_fitFunc' in stages:
+            start = {k:param[k] for k in param.keys()}
+            start['x'] += 0.5; start['y'] -= 0.5
+            res['_fitFunc'] = _timeit(lambda: candid._fitFunc(start, o._fitData(),
+                                                    o.observables, o.instruments))[0]
+        # -- the processes are started before timing the analyses
+        t = time.time()
+        o._pool()
+        res['pool start'] = time.time()-t
+        res['Ncores'] = o.Ncores
+        if 'chi2Map' in stages:
+            res['chi2Map'] = _timeit(lambda: o.chi2Map(step=step, rmax=rmax,
+                                                       fratio=COMPANION['f'], fig=None))[0]
+        if 'fitMap' in stages:
+            res['fitMap'] = _timeit(lambda: o.fitMap(step=2*step, rmax=rmax, fig=None))[0]
+        if 'fitBoot' in stages:
+            o.bestFit = {'best':dict(COMPANION)}
+            res['fitBoot'] = _timeit(lambda: o.fitBoot(N=Nboot, fig=None))[0]
+        if 'detectionLimit' in stages:
+            res['detectionLimit'] = _timeit(lambda: o.detectionLimit(step=step,
+                    rmax=rmax, removeCompanion=COMPANION, fig=None))[0]
+    finally:
+        o.close()
+    return res
+
+def runAll(output='candid_bench.json', instruments=None, sizes=None,
+           cores=[1], stages=STAGES, grid=20, Nboot=16, directory=None):
+    """
+    run the benchmarks for all "instruments" (see INSTRUMENTS), "sizes" (see
+    SIZES) and number of processes "cores", and store the results in the JSON
+    file "output". The synthetic OIFITS files are written in "directory" (a
+    temporary one by default).
+
+    returns the results, as stored in "output"
+    """
+    if instruments is None:
+        instruments = sorted(INSTRUMENTS.keys())
+    if sizes is None:
+        sizes = ['small', 'medium']
+    for k in ['long exec warning', 'progress bar', 'cache']:
+        candid.CONFIG[k] = {'long exec warning':None, 'progress bar':False,
+                            'cache':None}[k]
+    try:
+        import numba
+        numba = numba.__version__
+    except:
+        numba = None
+    results = {'candid':candid.__version__,
+               'date':datetime.datetime.now().isoformat(),
+               'python':sys.version.split()[0],
+               'numpy':np.__version__, 'scipy':scipy.__version__,
+               'numba':numba, 'platform':platform.platform(),
+               'cpu count':os.cpu_count(),
+               'CONFIG':{k:candid.CONFIG[k] for k in candid.CONFIG.keys()},
+               'grid':grid, 'Nboot':Nboot, 'runs':[]}
+    tmp = None
+    if directory is None:
+        tmp = tempfile.TemporaryDirectory()
+        directory = tmp.name
+    try:
+        for ins in instruments:
+            for size in sizes:
+                filename = os.path.join(directory, '%s_%s.fits'%(ins, size))
+                Nv2, Ncp = makeOifits(filename, ins, SIZES[size])
+                for n in cores:
+                    print('*** %s %s (%d V2, %d CP), %d cores'%(ins, size, Nv2, Ncp, n))
+                    t = runBenchmark(filename, Ncores=n, stages=stages,
+                                     grid=grid, Nboot=Nboot)
+                    results['runs'].append({'instrument':ins, 'size':size,
+                                            'Nmjd':SIZES[size], 'Nv2':Nv2,
+                                            'Ncp':Ncp, 'Ncores':n, 'time':t})
+                    # -- saved after each run, in case it is interrupted
+                    with open(output, 'w') as f:
+                        json.dump(results, f, indent=1)
+    finally:
+        if not tmp is None:
+            tmp.cleanup()
+    printResults(results)
+    return results
+
+def printResults(results):
+    """
+    table of the timings (s) in "results" (see runAll)
+    """
+    stages = [s for s in STAGES if any([s in r['time'] for r in results['runs']])]
+    print('CANDID %s, %s'%(results['candid'], results['date']))
+    print('%-14s %-6s %3s '%('instrument', 'size', 'N')+
+          ' '.join(['%10s'%s[:10] for s in stages]))
+    for r in results['runs']:
+        print('%-14s %-6s %3d '%(r['instrument'], r['size'], r['Ncores'])+
+              ' '.join(['%10.4f'%r['time'][s] if s in r['time'] else ' '*10
+                        for s in stages]))
+    return
+
+def compare(old, new, threshold=1.2):
+    """
+    compare two JSON files written by runAll: ratio new/old of the timings of
+    the runs present in both. Ratios larger than "threshold" are flagged.
+    """
+    res = []
+    for f in [old, new]:
+        with open(f) as fh:
+            res.append(json.load(fh))
+    old, new = res
+    key = lambda r: (r['instrument'], r['size'], r['Ncores'])
+    ref = {key(r):r for r in old['runs']}
+    print('new/old: CANDID %s (%s) / %s (%s)'%(new['candid'], new['date'],
+                                               old['candid'], old['date']))
+    stages = [s for s in STAGES if any([s in r['time'] for r in new['runs']])]
+    print('%-14s %-6s %3s '%('instrument', 'size', 'N')+
+          ' '.join(['%10s'%s[:10] for s in stages]))
+    for r in new['runs']:
+        if not key(r) in ref:
+            continue
+        line = '%-14s %-6s %3d '%key(r)
+        for s in stages:
+            if s in r['time'] and s in ref[key(r)]['time'] and ref[key(r)]['time'][s]>0:
+                x = r['time'][s]/ref[key(r)]['time'][s]
+                line += ' %8.2f%s'%(x, '!' if x>threshold else ' ')
+            else:
+                line += ' '*10
+        print(line)
+    return
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='CANDID benchmarks on synthetic OIFITS files')
+    parser.add_argument('-o', '--output', default='candid_bench.json',
+                        help='JSON file for the results')
+    parser.add_argument('-i', '--instruments', nargs='+', choices=sorted(INSTRUMENTS.keys()),
+                        help='instruments (default: all)')
+    parser.add_argument('-s', '--sizes', nargs='+', choices=sorted(SIZES.keys()),
+                        default=['small', 'medium'], help='sizes of the data')
+    parser.add_argument('-n', '--cores', nargs='+', type=int, default=[1],
+                        help='numbers of processes')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                        help='what to time (default: all)')
+    parser.add_argument('--grid', type=int, default=20, help='size of the maps, in pixels')
+    parser.add_argument('--Nboot', type=int, default=16, help='number of fits in fitBoot')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON files instead')
+    args = parser.parse_args()
+    if not args.compare is None:
+        compare(*args.compare)
+    else:
+        runAll(args.output, instruments=args.instruments, sizes=args.sizes,
+               cores=args.cores, stages=args.stages, grid=args.grid,
+               Nboot=args.Nboot)
@@ -0,0 +1,42 @@
+"""
+chi2 over positions and flux ratios (see Open.chi2Cube)
+"""
+import os
+
+import numpy as np
+import pytest
+
+import candid
+
+FILENAME = os.path.join(os.path.dirname(candid.__file__), 'demo', 'AXCir.oifits')
+
+@pytest.fixture(scope='module')
+def o():
+    o = candid.Open(FILENAME)
+    yield o
+    o.close()
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setitem(candid.CONFIG, 'Ncores', 1)
+    monkeypatch.setitem(candid.CONFIG, 'long exec warning', None)
+
+def test_chi2Cube(o, tmp_path):
+    filename = str(tmp_path/'cube.npy')
+    o.chi2Cube(step=4, rmax=20, fratio=[0.3, 1.0, 30.], fig=None,
+               filename=filename)
+    res = o.chi2CubeResult
+    assert o._cube is None
+    cube = np.load(filename)
+    inside = ~np.isnan(cube[:,:,0])
+    # -- raw minimum over the flux ratios, also above the chi2 of the UD
+    assert np.allclose(res['chi2 min'][inside], cube[inside].min(axis=1))
+    assert np.all(np.isnan(res['chi2 min'][~inside]))
+    assert np.any(res['chi2 min'][inside]>o.chi2_UD)
+    assert res['best']['chi2']==np.nanmin(res['chi2 min'])
+
+def test_chi2Cube_stopped(o, monkeypatch):
+    # -- stopped after the run time estimate: the cube is not left open
+    monkeypatch.setitem(candid.CONFIG, 'long exec warning', 1e-9)
+    o.chi2Cube(step=4, rmax=20, fratio=[0.3, 1.0], fig=None)
+    assert o._cube is None and o._cubeDone is None
@@ -0,0 +1,55 @@
+"""
+coarse to fine chi2Map (see Open._chi2MapLevels)
+"""
+import numpy as np
+
+import candid
+
+def _levels(N, levels, func):
+    o = candid.Open.__new__(candid.Open)
+    o.rmax = 20.
+    o.mapChi2 = np.zeros((N,N))
+    x = np.linspace(-o.rmax, o.rmax, N)
+    R2 = x[None,:]**2+x[:,None]**2
+    o.mapChi2[(R2>o.rmax**2)|(R2<2.**2)] = -1
+    evaluated = np.zeros((N,N), dtype=bool)
+    def compute(I, J):
+        o.mapChi2[J, I] = func(x[I], x[J])
+        evaluated[J, I] = True
+    o._chi2MapLevels(compute, N, levels, 0.1)
+    return o.mapChi2, evaluated
+
+def _func(x, y):
+    return 1 + 0.02*np.hypot(x-3, y+5) - 0.5*np.exp(-((x+7)**2+(y-6)**2)/2.)
+
+def test_chi2MapLevels_minimum():
+    m, evaluated = _levels(65, 4, _func)
+    x = np.linspace(-20, 20, 65)
+    ref = _func(x[None,:], x[:,None])
+    inside = m>0
+    assert np.array_equal(m[evaluated], ref[evaluated])
+    j, i = np.unravel_index(np.argmin(np.where(inside, ref, np.inf)), m.shape)
+    assert evaluated[j, i]
+    assert m[j, i]==m[inside].min()
+
+def test_chi2MapLevels_interpolation():
+    # -- interpolated pixels are bilinear interpolations of the corners of a
+    #    cell of one of the coarser grids, all actually computed
+    N, levels = 65, 4
+    m, evaluated = _levels(N, levels, _func)
+    valid = evaluated | (m<0)
+    for j, i in zip(*np.where((m>0) & ~evaluated)):
+        ok = False
+        for l in range(1, levels):
+            t = 2**l
+            g = np.union1d(np.arange(0, N, t), [N-1])
+            a = min(np.searchsorted(g, j, side='right')-1, len(g)-2)
+            b = min(np.searchsorted(g, i, side='right')-1, len(g)-2)
+            j0, j1, i0, i1 = g[a], g[a+1], g[b], g[b+1]
+            if not (valid[j0,i0] and valid[j0,i1] and valid[j1,i0] and valid[j1,i1]):
+                continue
+            wj, wi = (j-j0)/(j1-j0), (i-i0)/(i1-i0)
+            v = (1-wj)*(1-wi)*m[j0,i0] + (1-wj)*wi*m[j0,i1] + \
+                wj*(1-wi)*m[j1,i0] + wj*wi*m[j1,i1]
+            ok |= np.abs(v-m[j,i])<1e-12
+        assert ok, (j, i)
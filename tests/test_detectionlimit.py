@@ -0,0 +1,53 @@
+"""
+flux ratio of the 3 sigma detection (see _detectLimitBlock)
+"""
+import os
+
+import numpy as np
+import pytest
+
+import candid
+
+FILENAME = os.path.join(os.path.dirname(candid.__file__), 'demo', 'AXCir.oifits')
+
+@pytest.fixture(scope='module')
+def o():
+    o = candid.Open(FILENAME)
+    o.fitUD()
+    yield o
+    o.close()
+
+def _param(o):
+    param = {'f':1.0, 'diam*':o.diam, 'alpha*':o.alpha}
+    for k in o.dwavel.keys():
+        param['dwavel;'+k] = o.dwavel[k]
+    return param
+
+def _noisy(o):
+    data = candid._FitData(o._chi2Data, o.observables, o.instruments)
+    rng = np.random.RandomState(0)
+    data.meas = data.meas + 1e3*data.errs*rng.randn(len(data.meas))
+    return data
+
+@pytest.mark.parametrize('method', ['Absil', 'injection'])
+def test_detectLimitBlock(o, method):
+    X, Y = np.array([5., -12., 20.]), np.array([8., 3., -15.])
+    f3 = candid._detectLimitBlock(_param(o), X, Y, o._fitData(), o.observables,
+                                  o.instruments, method=method)
+    assert np.all(np.isfinite(f3)) and np.all((f3>1e-3)&(f3<100))
+
+@pytest.mark.parametrize('method', ['Absil', 'injection'])
+def test_detectLimitBlock_notReached(o, method):
+    # -- noise so large that a companion is never detected: nan, not 100%
+    data = _noisy(o)
+    X, Y = np.array([5., -12.]), np.array([8., 3.])
+    f3 = candid._detectLimitBlock(_param(o), X, Y, data, o.observables,
+                                  o.instruments, method=method)
+    assert np.all(np.isnan(f3))
+
+def test_detectLimit_notReached(o):
+    data = _noisy(o)
+    param = _param(o)
+    param['x'], param['y'] = 5., 8.
+    assert np.isnan(candid._detectLimit(param, data, o.observables,
+                                        o.instruments, method='Absil'))
@@ -0,0 +1,42 @@
+"""
+bootstrap replicas of fitBoot
+"""
+import os
+
+import numpy as np
+import pytest
+
+import candid
+
+FILENAME = os.path.join(os.path.dirname(candid.__file__), 'demo', 'AXCir.oifits')
+
+@pytest.mark.parametrize('observables', [['v2', 'cp'], ['cp']])
+def test_fitBoot_draws(monkeypatch, observables):
+    # -- spectral channels drawn for all the blocks, in the order of the data,
+    #    also when some are not used (same draws as the copies of the data
+    #    before the replicas were weights)
+    monkeypatch.setitem(candid.CONFIG, 'Ncores', 1)
+    monkeypatch.setitem(candid.CONFIG, 'long exec warning', None)
+    o = candid.Open(FILENAME)
+    o.observables = observables
+    tasks, _map = [], o._map
+    def _capture(p, f, args, callback=None, N=None):
+        tasks.extend(args)
+        return _map(p, f, tasks, callback, N)
+    monkeypatch.setattr(o, '_map', _capture)
+    param = {'x':6.2, 'y':-28.5, 'f':0.8, 'diam*':0.8}
+    np.random.seed(1)
+    o.fitBoot(N=5, param=param, useMJD=False, fig=None)
+    np.random.seed(1)
+    data = o._fitData()
+    assert len(tasks)==5
+    for t in tasks:
+        ref = []
+        for d in o._chi2Data:
+            mask = np.random.rand(d[-1].shape[-1])
+            mask = np.int8(mask>=1/3.) + np.int8(mask>=2/3.)
+            if d[0].split(';')[0] in observables:
+                ref.append(np.ravel(np.broadcast_to(mask, d[-1].shape)))
+        assert np.array_equal(t[-1], np.concatenate(ref))
+        assert len(t[-1])==len(data.meas)
+    o.close()
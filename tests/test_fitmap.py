@@ -0,0 +1,21 @@
+"""
+starting points of fitMap (see _fitMapGrid)
+"""
+import numpy as np
+
+import candid
+
+def test_fitMapGrid_axes():
+    # -- on the axes, the coordinates are exactly 0 (not ~1e-16), else the
+    #    finite differences of leastsq cannot move the companion off the axis
+    XY, coarse, spacing = candid._fitMapGrid(4.04, 20., 3.)
+    XY = np.array(XY)
+    assert len(XY)==len(coarse)==len(spacing)
+    assert np.sum(XY==0.0)>0
+    assert np.all((np.abs(XY)==0.0) | (np.abs(XY)>1e-9))
+    r = np.hypot(XY[:,0], XY[:,1])
+    assert np.all(r>=4.04-1e-9) and np.all(r<=20.+1e-9)
+
+def test_fitMapGrid_halfPlane():
+    XY = np.array(candid._fitMapGrid(4.04, 20., 3., halfPlane=True)[0])
+    assert np.all(XY[:,0]>=0)
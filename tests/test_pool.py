@@ -0,0 +1,59 @@
+"""
+scheduling of the computations in the pool of processes (see Open._map)
+"""
+import math
+import multiprocessing
+import os
+
+import pytest
+
+import candid
+
+FILENAME = os.path.join(os.path.dirname(candid.__file__), 'demo', 'AXCir.oifits')
+
+@pytest.fixture(scope='module')
+def runner():
+    # -- the processes import candid (spawn): one pool for all the tests
+    o = candid.Open.__new__(candid.Open)
+    o.Ncores, o._poolCache = 2, None
+    p = multiprocessing.Pool(2)
+    yield o, p
+    p.terminate()
+    p.join()
+
+def test_map(runner):
+    o, p = runner
+    res = []
+    o._map(p, math.sqrt, [(float(k),) for k in range(50)], res.append)
+    assert sorted(res)==[math.sqrt(k) for k in range(50)]
+
+@pytest.mark.parametrize('p', [None, 'pool'])
+def test_map_workerError(runner, p):
+    # -- one bad item: raised in the caller, instead of waiting forever
+    o, pool = runner
+    args = [(float(k),) for k in range(20)]
+    args[7] = (-1.0,)
+    with pytest.raises(ValueError):
+        o._map(pool if p else None, math.sqrt, args, lambda r: None)
+
+def test_map_callbackError(runner):
+    o, p = runner
+    def callback(r):
+        if r>3:
+            raise RuntimeError('bad result')
+    with pytest.raises(RuntimeError):
+        o._map(p, math.sqrt, [(float(k),) for k in range(40)], callback)
+
+def test_pool_config(monkeypatch):
+    # -- the processes are kept when CONFIG changes (e.g. Nsmear, set by each
+    #    analysis), and compute with the CONFIG of the main process
+    monkeypatch.setattr(candid, '_poolSize', lambda Ncores=None: 2)
+    monkeypatch.setitem(candid.CONFIG, 'smearing', 'samples')
+    with candid.Open(FILENAME) as o:
+        p = o._pool()
+        for n in [3, 5, 7]:
+            monkeypatch.setitem(candid.CONFIG, 'Nsmear', n)
+            assert o._pool() is p
+            res = []
+            o._map(p, candid._runTimeSamples, [()]*6, res.append)
+            assert res==[n]*6
@@ -0,0 +1,38 @@
+"""
+analyses on data reduced by polynomial fits (Open(..., reducePoly=n))
+"""
+import os
+
+import numpy as np
+import pytest
+
+import candid
+
+FILENAME = os.path.join(os.path.dirname(candid.__file__), 'demo', 'AXCir.oifits')
+
+@pytest.fixture(scope='module')
+def poly():
+    o = candid.Open(FILENAME, reducePoly=1)
+    o.observables = ['v2_0_1', 'cp_0_1', 'cp_1_1']
+    yield o
+    o.close()
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setitem(candid.CONFIG, 'Ncores', 1)
+    monkeypatch.setitem(candid.CONFIG, 'long exec warning', None)
+
+def test_fitData(poly):
+    data = candid._FitData(poly._rawData, poly.ALLobservables, poly.instruments)
+    assert len(data.wl)==len(data.uv)==len(data.meas)
+    assert np.all(np.isfinite(data.wl)) and np.all(np.isfinite(data.uv))
+
+def test_chi2Map(poly):
+    poly.fitUD()
+    assert not poly.diam is None
+    poly.chi2Map(step=6, rmax=20, fig=None)
+    assert np.all(np.isfinite(poly.mapChi2)) and np.all(poly.mapChi2>0)
+
+def test_fitMap(poly):
+    poly.fitMap(step=8, rmax=15, fig=None)
+    assert np.isfinite(poly.bestFit['chi2'])
@@ -0,0 +1,110 @@
+"""
+parity of the visibility functions in use (_Vbin, compiled with Numba or with
+Numpy) with the reference implementation _VbinSlow
+"""
+import numpy as np
+import pytest
+
+import candid
+
+# -- UD, LD, resolved companion and resolved flux, gaussian
+PARAMS = [{'x':5.0, 'y':-12., 'f':2.0, 'diam*':0.8},
+          {'x':-30., 'y':4.2, 'f':10., 'diam*':1.5, 'alpha*':0.3},
+          {'x':12., 'y':25., 'f':1.0, 'diam*':2.3, 'diamc':0.5},
+          {'x':-8., 'y':15., 'f':3.0, 'diam*':1.1, 'fres':3.0},
+          {'x':-3., 'y':-7., 'f':5.0, 'diam*':0.5, 'diamg':5., 'fg':4.0},
+          ]
+BACKENDS = ['numba', 'numpy']
+TOL = 1e-12
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    """
+    smeared phasors computed with Numba or Numpy (see _smearedPhasorSamples)
+    """
+    if request.param=='numba':
+        if not candid._numbaLoaded:
+            pytest.skip('numba is not installed')
+        monkeypatch.setattr(candid, '_smearedPhasorSamples',
+                            candid._smearedPhasorNumba)
+    else:
+        monkeypatch.setattr(candid, '_smearedPhasorSamples',
+                            candid._smearedPhasorSlow)
+    monkeypatch.setitem(candid.CONFIG, 'smearing', 'samples')
+    return request.param
+
+def _uv(N=50, seed=0):
+    rng = np.random.RandomState(seed)
+    u1, v1, u2, v2 = rng.uniform(-130, 130, (4, N, 6))
+    wavel = np.linspace(1.5, 1.8, 6)[None,:] + 0*u1
+    return u1, v1, u2, v2, wavel
+
+def _param(p, wavel):
+    p = dict(p)
+    p['wavel'], p['dwavel'] = wavel, 0.05
+    return p
+
+@pytest.mark.parametrize('Nsmear', [1, 3, 7])
+@pytest.mark.parametrize('p', PARAMS)
+def test_Vbin(backend, monkeypatch, Nsmear, p):
+    monkeypatch.setitem(candid.CONFIG, 'Nsmear', Nsmear)
+    u1, v1, u2, v2, wavel = _uv()
+    ref = candid._VbinSlow((u1, v1), _param(p, wavel))
+    res = candid._Vbin((u1, v1), _param(p, wavel))
+    assert np.abs(res-ref).max() < TOL
+
+@pytest.mark.parametrize('Nsmear', [1, 3, 7])
+@pytest.mark.parametrize('p', PARAMS)
+def test_V2bin(backend, monkeypatch, Nsmear, p):
+    monkeypatch.setitem(candid.CONFIG, 'Nsmear', Nsmear)
+    u1, v1, u2, v2, wavel = _uv()
+    ref = np.abs(candid._VbinSlow((u1, v1), _param(p, wavel)))**2
+    for f in [candid._V2binSlow, candid._V2binFast]:
+        res = f((u1, v1), _param(p, wavel))
+        assert np.abs(res-ref).max() < TOL
+
+@pytest.mark.parametrize('Nsmear', [1, 3, 7])
+@pytest.mark.parametrize('p', PARAMS)
+def test_T3bin(backend, monkeypatch, Nsmear, p):
+    monkeypatch.setitem(candid.CONFIG, 'Nsmear', Nsmear)
+    u1, v1, u2, v2, wavel = _uv()
+    ref = candid._VbinSlow((u1, v1), _param(p, wavel))*\
+          candid._VbinSlow((u2, v2), _param(p, wavel))*\
+          np.conj(candid._VbinSlow((u1+u2, v1+v2), _param(p, wavel)))
+    for f in [candid._T3binSlow, candid._T3binFast]:
+        res = f((u1, v1, u2, v2), _param(p, wavel))
+        assert np.abs(res-ref).max() < TOL
+
+def test_checkVbin(backend):
+    assert candid._checkVbin(N=20, verbose=False) < TOL
+
+def test_smearingKernelCache(backend, monkeypatch):
+    # -- the wavelengths of the data blocks are broadcast views (see _oiGrid),
+    #    flattened to a new copy at each call
+    monkeypatch.setattr(candid, '_smearingKernelCache', {})
+    u1, v1, u2, v2, wavel = _uv()
+    wavel = np.broadcast_to(np.linspace(1.5, 1.8, 6)[None,:], u1.shape)
+    p = _param(PARAMS[0], wavel)
+    X, Y = np.linspace(-20, 20, 5), np.linspace(10, -10, 5)
+    ref = candid._VbinBatch((u1, v1), p, X, Y)
+    cache = dict(candid._smearingKernelCache)
+    assert len(cache)==1
+    res = candid._VbinBatch((u1, v1), _param(PARAMS[0], wavel), X, Y)
+    assert candid._smearingKernelCache.keys()==cache.keys()
+    assert all([candid._smearingKernelCache[k] is cache[k] for k in cache])
+    assert np.abs(res-ref).max() < TOL
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_checkVbin_config(monkeypatch, fail):
+    # -- CONFIG is restored, also if the check fails
+    monkeypatch.setitem(candid.CONFIG, 'Nsmear', 5)
+    monkeypatch.setitem(candid.CONFIG, 'smearing', 'analytic')
+    if fail:
+        def _fail(uv, param):
+            raise AssertionError('wrong visibility')
+        monkeypatch.setattr(candid, '_Vbin', _fail)
+        with pytest.raises(AssertionError):
+            candid._checkVbin(N=5, verbose=False)
+    else:
+        candid._checkVbin(N=5, verbose=False)
+    assert candid.CONFIG['Nsmear']==5 and candid.CONFIG['smearing']=='analytic'